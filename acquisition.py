@@ -0,0 +1,295 @@
+import math
+import multiprocessing
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+import numpy as np
+from psychopy import core
+
+TrackerEvent = namedtuple('TrackerEvent', ['type', 'time', 'gaze_x', 'gaze_y'])
+recordDtype = np.dtype([('seq', 'i8'), ('type', 'i8'), ('time', 'f8'), ('gaze_x', 'f8'), ('gaze_y', 'f8')])
+#header: write sequence number, version of latest sample (odd while written), acquisition loops, longest loop gap (ns)
+headerFields = ('writeSeq', 'latestVersion', 'loops', 'maxGap')
+headerBytes = 64 #int64 header, then float64 latest sample (time, x, y), then records
+
+class RingBuffer:
+    '''
+    Single-producer ring buffer of tracker events in shared memory, without locks.
+    The writer stores every event with its sequence number and publishes it by advancing writeSeq.
+    The latest gaze sample is kept separately, versioned like a seqlock, so it can be read in place at any time.
+    A reader that falls more than capacity events behind loses the oldest events (counted as overruns).
+    '''
+    def __init__(self, capacity = 65536, name = None):
+        self.capacity = capacity
+        size = headerBytes + capacity * recordDtype.itemsize
+        self.shm = shared_memory.SharedMemory(name = name, create = name is None, size = size)
+        self.owner = name is None
+        buf = self.shm.buf
+        self.header = np.ndarray(len(headerFields), dtype = np.int64, buffer = buf)
+        self.latest = np.ndarray(3, dtype = np.float64, buffer = buf, offset = len(headerFields) * 8)
+        self.records = np.ndarray(capacity, dtype = recordDtype, buffer = buf, offset = headerBytes)
+        if self.owner:
+            self.header[:] = 0
+            self.latest[:] = np.nan
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, events):
+        '''
+        Appends events (objects with type, time and, for samples, gaze_x and gaze_y). Writer side only.
+        '''
+        seq = int(self.header[0])
+        for event in events:
+            self.records[seq % self.capacity] = (seq, event.type, event.time,
+                getattr(event, 'gaze_x', math.nan), getattr(event, 'gaze_y', math.nan))
+            seq += 1
+        self.header[0] = seq #publishes events
+
+    def set_latest(self, t, x, y):
+        self.header[1] += 1 #odd: being written
+        self.latest[:] = t, x, y
+        self.header[1] += 1
+
+    def read_latest(self, tries = 100):
+        '''
+        Returns time and position of latest gaze sample (consistent snapshot of shared values).
+        '''
+        for _ in range(tries):
+            version = self.header[1]
+            if version % 2 == 0:
+                t, x, y = self.latest.tolist()
+                if self.header[1] == version:
+                    return t, x, y
+        return math.nan, math.nan, math.nan
+
+    def close(self):
+        del self.header, self.latest, self.records #views must be released before shared memory is closed
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+class RingReader:
+    '''
+    Reads events of ring buffer in order. Counts overruns (events lost because the reader fell behind)
+    and reader lag (events waiting when read).
+    '''
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.seq = int(buffer.header[0])
+        self.overruns = 0
+        self.reads = 0
+        self.maxLag = 0
+        self.totalLag = 0
+
+    def read(self):
+        '''
+        Returns new events as array of records (copy).
+        '''
+        buffer = self.buffer
+        writeSeq = int(buffer.header[0])
+        lag = writeSeq - self.seq
+        self.reads += 1
+        self.maxLag = max(self.maxLag, lag)
+        self.totalLag += lag
+        if lag > buffer.capacity:
+            self.overruns += lag - buffer.capacity
+            self.seq = writeSeq - buffer.capacity
+        if writeSeq == self.seq:
+            return buffer.records[:0].copy()
+        expected = np.arange(self.seq, writeSeq)
+        records = buffer.records[expected % buffer.capacity] #copy
+        #events overwritten while they were copied are lost as well: their slot holds a later sequence number
+        #(written first), or the writer has published events that reuse it
+        oldest = int(buffer.header[0]) - buffer.capacity
+        valid = (records['seq'] == expected) & (expected >= oldest)
+        if not valid.all():
+            self.overruns += int((~valid).sum())
+            records = records[valid]
+        self.seq = writeSeq
+        return records
+
+    def skip(self):
+        '''
+        Drops all events written so far.
+        '''
+        self.seq = int(self.buffer.header[0])
+
+    def stats(self):
+        return {
+            'overruns': self.overruns,
+            'maxLag': self.maxLag,
+            'meanLag': self.totalLag / self.reads if self.reads else math.nan}
+
+def connect_iohub(config):
+    '''
+    Launches iohub with device config in acquisition process. Returns tracker and connection.
+    The psychopy window is not available there, so config should contain the display of the session
+    (see display_config), which iohub uses for gaze coordinates.
+    '''
+    from psychopy.iohub import launchHubServer
+    io = launchHubServer(**config)
+    return io.devices.tracker, io
+
+def display_config(win):
+    '''
+    Returns iohub display config matching window (screen, monitor with size and distance, units),
+    as launchHubServer derives it when the window is passed.
+    '''
+    return {
+        'name': 'display',
+        'reporting_unit_type': win.units,
+        'device_number': win.screen,
+        'psychopy_monitor_name': win.monitor.name}
+
+def acquire(connect, args, bufferName, capacity, commands, sampleType, pollInterval = .001):
+    '''
+    Acquisition loop (runs in own process): drains tracker events continuously into ring buffer
+    and executes commands (tracker method name and arguments) received on pipe. Stops on None.
+    '''
+    try:
+        tracker, io = connect(*args)
+    except Exception as e:
+        commands.send(('error', repr(e)))
+        return
+    buffer = RingBuffer(capacity, bufferName)
+    commands.send(('ready', None))
+    recording = False
+    last = time.perf_counter_ns()
+    try:
+        while True:
+            while commands.poll():
+                command = commands.recv()
+                if command is None:
+                    return
+                name, args, reply = command
+                try:
+                    result = getattr(tracker, name)(*args)
+                except Exception as e:
+                    result = e
+                if name == 'setRecordingState':
+                    recording = bool(args[0])
+                    if not recording: #no position until next recording
+                        buffer.set_latest(core.getTime(), math.nan, math.nan)
+                if reply:
+                    commands.send(('result', result))
+            if recording:
+                events = tracker.getEvents()
+                if events:
+                    buffer.write(events)
+                samples = [event for event in events if event.type == sampleType]
+                if samples:
+                    buffer.set_latest(samples[-1].time, samples[-1].gaze_x, samples[-1].gaze_y)
+                else: #tracker without sample events
+                    position = tracker.getPosition()
+                    if position is None:
+                        buffer.set_latest(core.getTime(), math.nan, math.nan)
+                    else:
+                        buffer.set_latest(core.getTime(), *position[:2])
+            now = time.perf_counter_ns()
+            buffer.header[2] += 1
+            buffer.header[3] = max(buffer.header[3], now - last)
+            last = now
+            time.sleep(pollInterval)
+    finally:
+        buffer.close()
+        if io is not None:
+            io.quit()
+
+class RemoteTracker:
+    '''
+    Stands in for session.tracker (and session.io) with a dedicated acquisition process that owns the
+    tracker connection, so that gaze keeps being collected while the main thread draws, flips or uploads textures.
+    getEvents() and getPosition() read from the shared-memory ring buffer without calling the tracker,
+    other methods are forwarded to the acquisition process.
+    The acquisition process has no window, so the tracker's setup procedure (calibration screen) cannot be shown there.
+    Sessions therefore only use it with the iohub mouse simulator (see Session).
+    '''
+    lockFree = ('getEvents', 'clearEvents', 'getPosition') #read shared buffer only (see messages.SharedTracker)
+
+    def __init__(self, connect, args = (), capacity = 65536, sampleType = None, timeout = 30):
+        if sampleType is None:
+            from psychopy.iohub.constants import EventConstants
+            sampleType = EventConstants.MONOCULAR_EYE_SAMPLE
+        self.buffer = RingBuffer(capacity)
+        self.reader = RingReader(self.buffer)
+        context = multiprocessing.get_context('spawn') #started from startup thread, next to open window
+        self.commands, childCommands = context.Pipe()
+        self.process = context.Process(target = acquire, name = 'GazeAcquisition', daemon = True,
+            args = (connect, args, self.buffer.name, capacity, childCommands, sampleType))
+        self.process.start()
+        if not self.commands.poll(timeout):
+            self.quit()
+            raise RuntimeError('Gaze acquisition process did not start')
+        status, error = self.commands.recv()
+        if status == 'error':
+            self.quit()
+            raise RuntimeError('Could not connect to tracker in acquisition process: ' + error)
+        self.ages = [] #age of latest sample when read (s)
+
+    def call(self, name, *args):
+        self.commands.send((name, args, True))
+        _, result = self.commands.recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def getEvents(self):
+        return [TrackerEvent(*row) for row in self.reader.read()[['type', 'time', 'gaze_x', 'gaze_y']].tolist()]
+
+    def clearEvents(self):
+        self.reader.skip()
+
+    def getPosition(self):
+        '''
+        Returns latest gaze position in pixels, None during blinks and while not recording.
+        '''
+        t, x, y = self.buffer.read_latest()
+        if math.isnan(x):
+            return None
+        if len(self.ages) < 100000:
+            self.ages.append(core.getTime() - t)
+        return (x, y)
+
+    def setRecordingState(self, recording):
+        if recording:
+            self.reader.skip() #events of previous recording, events of new recording are written after the command
+        return self.call('setRecordingState', recording)
+
+    def sendMessage(self, msg, time_offset = 0):
+        self.commands.send(('sendMessage', (msg, time_offset), False)) #does not wait for tracker
+
+    def runSetupProcedure(self):
+        return self.call('runSetupProcedure')
+
+    def setConnectionState(self, connected):
+        return self.call('setConnectionState', connected)
+
+    def stats(self):
+        '''
+        Returns reader overruns and lag (events), age of latest sample when read (s),
+        and acquisition loops and longest gap between loops (s).
+        '''
+        ages = np.array(self.ages)
+        return dict(self.reader.stats(),
+            meanSampleAge = float(ages.mean()) if len(ages) else math.nan,
+            maxSampleAge = float(ages.max()) if len(ages) else math.nan,
+            loops = int(self.buffer.header[2]),
+            maxLoopGap = int(self.buffer.header[3]) / 1e9)
+
+    def quit(self):
+        '''
+        Stops acquisition process (which closes the iohub connection).
+        '''
+        if self.process.is_alive():
+            try:
+                self.commands.send(None)
+            except OSError:
+                pass
+            self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
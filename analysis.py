@@ -0,0 +1,198 @@
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import numpy as np
+import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError as e: #see requirements.txt
+    raise ImportError('analysis.py stores parquet datasets and needs pyarrow (pip install pyarrow)') from e
+import recorder
+import saccades
+import triallog
+
+#uniformity_<pp>_<date><suffix>.<ext>, date as written by data.getDateStr()
+filePattern = re.compile(r'^uniformity_(?P<pp>.+)_(?P<date>\d{4}-\d{2}-\d{2}_\d{2}h\d{2}\.\d{2}\.\d{3})(?P<suffix>[A-Za-z_]*)\.(csv|dat)$')
+microsaccadeAmplitude = 2 #saccades up to this amplitude (deg) count as microsaccades (as in Trial.count_saccade)
+
+def find_sessions(dataDir):
+    '''
+    Returns dict (participant, date) -> dict of files per suffix ('' is the session data file).
+    '''
+    sessions = {}
+    for name in sorted(os.listdir(dataDir)):
+        match = filePattern.match(name)
+        if match is None:
+            continue
+        files = sessions.setdefault((match['pp'], match['date']), {})
+        files[match['suffix']] = os.path.join(dataDir, name)
+    return sessions
+
+def signature(files):
+    '''
+    Returns size and modification time of every file of session (changes when session is extended).
+    '''
+    return {suffix: [os.path.getsize(path), os.path.getmtime(path)] for suffix, path in sorted(files.items())}
+
+def read_trials(files):
+    '''
+    Returns trial data of session, from session data file or, if session did not finish, from trial log.
+    '''
+    if '' in files:
+        df = pd.read_csv(files[''], index_col = 0)
+        df['n_saccades'] = [np.array(str(value).strip('[]').replace(',', ' ').split(), dtype = int)
+            for value in df['n_saccades']]
+    elif 'LOG' in files:
+        df = triallog.recover(files['LOG'])
+    else:
+        return pd.DataFrame()
+    n_saccades = np.array([np.resize(n, 2) for n in df['n_saccades']]).reshape(-1, 2)
+    df = df.drop(columns = 'n_saccades').assign(
+        onlineSaccades = n_saccades[:,0], onlineMicrosaccades = n_saccades[:,1])
+    return df
+
+def gaze_statistics(gazefilename, chunkSize = 64):
+    '''
+    Detects saccades in every recording (trial attempt) of session gaze file.
+    Recordings are read from the memory-mapped file in chunks of chunkSize recordings.
+    Returns saccades (one row per saccade) and statistics per recording and phase.
+    '''
+    samples, index = recorder.load(gazefilename)
+    phaseNames = {code: name for name, code in recorder.phaseCodes.items()}
+    saccadeRows, statRows = [], []
+    recordings = index.groupby('recording', sort = True)
+    keys = list(recordings.groups)
+    for i in range(0, len(keys), chunkSize):
+        chunk = index[index['recording'].isin(keys[i:i+chunkSize])]
+        if len(chunk) == 0:
+            continue
+        first, last = chunk['start'].min(), chunk['stop'].max()
+        block = np.array(samples[first:last]) #one read per chunk
+        for row in chunk.itertuples(index = False):
+            phaseSamples = block[row.start - first:row.stop - first]
+            detected = saccades.detect(phaseSamples['time'], np.column_stack((phaseSamples['x'], phaseSamples['y'])))
+            micro = detected['amplitude'] <= microsaccadeAmplitude
+            info = {'recording': row.recording, 'blockType': row.blockType, 'trialN': row.trialN,
+                'periphType': row.periphType, 'samplingType': row.samplingType, 'aborted': row.aborted,
+                'phase': phaseNames.get(row.phase, row.phase)}
+            saccadeRows.append(pd.DataFrame(dict(info, micro = micro, **detected)))
+            duration = phaseSamples['time'][-1] - phaseSamples['time'][0] if len(phaseSamples) else 0
+            statRows.append(dict(info,
+                nSamples = len(phaseSamples),
+                missing = float(np.isnan(phaseSamples['x']).mean()) if len(phaseSamples) else np.nan,
+                duration = duration,
+                saccades = int((~micro).sum()),
+                microsaccades = int(micro.sum()),
+                saccadeRate = (~micro).sum() / duration if duration > 0 else np.nan,
+                microsaccadeRate = micro.sum() / duration if duration > 0 else np.nan,
+                meanAmplitude = detected['amplitude'][~micro].mean() if (~micro).any() else np.nan,
+                meanMicroAmplitude = detected['amplitude'][micro].mean() if micro.any() else np.nan,
+                meanPeakVelocity = detected['peakVelocity'].mean() if len(micro) else np.nan))
+    saccadeTable = pd.concat(saccadeRows, ignore_index = True) if saccadeRows else pd.DataFrame()
+    return saccadeTable, pd.DataFrame(statRows)
+
+def process_session(task):
+    '''
+    Reads one session and returns its tables (trials, recordings, saccades). Runs in worker process.
+    '''
+    (pp, date), files = task
+    trials = read_trials(files)
+    saccadeTable, stats = pd.DataFrame(), pd.DataFrame()
+    if 'GAZE' in files and 'GAZE_index' in files:
+        saccadeTable, stats = gaze_statistics(files['GAZE'])
+    if len(stats) and len(trials):
+        #gaze statistics of completed attempt of every experimental trial, summed over phases
+        completed = stats[~stats['aborted'].astype(bool) & stats['trialN'].notna()]
+        perTrial = completed.groupby(['blockType', 'trialN'], as_index = False)[
+            ['saccades', 'microsaccades', 'duration']].sum().rename(columns = {'duration': 'recordedDuration'})
+        trials = trials.merge(perTrial, on = ['blockType', 'trialN'], how = 'left')
+    tables = {'trials': trials, 'recordings': stats, 'saccades': saccadeTable}
+    for name, table in tables.items():
+        if len(table):
+            sortKeys = [key for key in ('blockType', 'trialN', 'recording', 'onset') if key in table]
+            tables[name] = table.assign(participant = pp, session = date).sort_values(sortKeys, kind = 'stable')
+    return (pp, date), tables
+
+class AnalysisStore:
+    '''
+    Partitioned columnar store of all sessions in data folder.
+    Every table (trials, recordings, saccades) is a parquet dataset partitioned by participant,
+    with one file per session, sorted by block and trial (row group statistics allow filtering on them).
+    A manifest records which sessions were processed, so update() only processes new or changed sessions.
+    '''
+    tables = ('trials', 'recordings', 'saccades')
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifestFilename = os.path.join(directory, 'manifest.json')
+        os.makedirs(directory, exist_ok = True)
+        try:
+            with open(self.manifestFilename) as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def update(self, dataDir, processes = None):
+        '''
+        Processes new or changed sessions of data folder across process pool. Returns number of sessions processed.
+        '''
+        sessions = find_sessions(dataDir)
+        tasks = [(key, files) for key, files in sessions.items()
+            if self.manifest.get('%s/%s' % key, {}).get('signature') != signature(files)]
+        if not tasks:
+            return 0
+        with multiprocessing.Pool(processes) as pool:
+            for (pp, date), tables in pool.imap_unordered(process_session, tasks):
+                for name, table in tables.items():
+                    self.write(name, pp, date, table)
+                self.manifest['%s/%s' % (pp, date)] = {
+                    'signature': signature(sessions[(pp, date)]),
+                    'rows': {name: len(table) for name, table in tables.items()}}
+                self.write_manifest() #after every session, so an interrupted update can be resumed
+                print('Processed session', pp, date)
+        return len(tasks)
+
+    def write(self, name, pp, date, table):
+        path = os.path.join(self.directory, name, 'participant=%s' % pp, '%s.parquet' % date)
+        if len(table) == 0:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        tmp = path + '.tmp'
+        pq.write_table(pa.Table.from_pandas(table.drop(columns = 'participant'), preserve_index = False),
+            tmp, row_group_size = 1000)
+        os.replace(tmp, path)
+
+    def write_manifest(self):
+        tmp = self.manifestFilename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent = 1)
+        os.replace(tmp, self.manifestFilename)
+
+    def load(self, name, participant = None, blockType = None, trialN = None, columns = None):
+        '''
+        Returns table (DataFrame), optionally only rows of participant, block and trial.
+        Participant ids are read as strings (also if they are numbers, as in the data file names).
+        '''
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        filters = [(key, '==', value) for key, value in
+            (('participant', participant), ('blockType', blockType), ('trialN', trialN)) if value is not None]
+        partitioning = ds.partitioning(pa.schema([('participant', pa.string())]), flavor = 'hive')
+        return pd.read_parquet(path, columns = columns, filters = filters or None, partitioning = partitioning)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Updates analysis store with new sessions of data folder.')
+    parser.add_argument('--data', default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Data'))
+    parser.add_argument('--store', default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Analysis'))
+    parser.add_argument('--processes', type = int, default = None)
+    args = parser.parse_args()
+
+    store = AnalysisStore(args.store)
+    print('Processed %d new or changed sessions' % store.update(args.data, args.processes))
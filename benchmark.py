@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import numpy as np
+import headless #before psychopy: no shadow window, so no display is needed
+from psychopy import core, monitors
+import linefield
+import rasterizer
+import texturecache
+import gaze
+import events
+import saccades
+import recorder
+import latency
+import messages
+import frametiming
+import experiment
+import replay
+
+resolutions = ((1920, 1080), (2560, 1440), (3840, 2160))
+spacings = (.87, .6, .4) #grid densities (deg between lines)
+rates = (500, 1000, 2000)
+
+class MockStim:
+    def draw(self):
+        pass
+
+class MockAperture:
+    def __init__(self):
+        self.enabled = False
+        self.inverted = False
+        self.pos = (0,0)
+
+class MockWindow:
+    '''
+    Window without display: flip advances virtual clock by one frame and returns flip time.
+    '''
+    def __init__(self, clock, refresh = 1/60):
+        self.clock = clock
+        self.monitorFramePeriod = refresh
+
+    def flip(self):
+        self.clock.next_frame(self.monitorFramePeriod)
+        return core.monotonicClock.getTime()
+
+class MockSession:
+    '''
+    Provides the session attributes used by Trial phases, with mock window, stimuli and replay tracker
+    (synthetic gaze at given sampling rate). Files are written to directory.
+    '''
+    def __init__(self, clock, directory, rate = 500, size = (1920, 1080), composite = True, saccadeDetection = 'iohub'):
+        self.mon = monitors.Monitor('benchmark', width = 53, distance = 60)
+        self.mon.setSizePix(size)
+        self.win = MockWindow(clock)
+        self.profiler = frametiming.FrameProfiler(self.win, os.path.join(directory, 'FRAMES.csv'))
+        self.scheduler = None
+        self.prefetcher = None
+        self.abortOption = False
+        self.trialSeeds = np.random.default_rng(0)
+        self.saccadeDetector = saccades.SaccadeDetector() if saccadeDetection == 'online' else None
+        self.centerROI = gaze.RectROI((25.3, 13.3))
+        self.fixationROI = gaze.RectROI((15, 13.3))
+        self.gazeTransform = gaze.GazeTransform(self.mon)
+        self.aperture = MockAperture()
+        self.samplingAperture = MockAperture()
+        self.textures = {'seed': 0, 'center': MockStim(),
+            'periph': {name: MockStim() for name in linefield.defaultStds},
+            'frames': {name: MockStim() for name in linefield.defaultStds} if composite else {}}
+        self.recorder = recorder.GazeRecorder(os.path.join(directory, 'GAZE.dat'))
+        self.latency = latency.LatencyMonitor(os.path.join(directory, 'LATENCY.csv'))
+        self.trial = None
+        self.tracker = messages.SharedTracker(
+            replay.ReplayTracker(self, replay.synthetic_traces(0, duration = 30, rate = rate), 1 / self.gazeTransform.degPerPix))
+        self.messages = messages.MessageChannel(self.tracker, os.path.join(directory, 'MSG.csv'))
+        self.events = events.EventDispatcher(self.tracker, maxLen = 10000)
+
+    def get_keys(self, keyList = None):
+        return []
+
+    def start_trial(self, periphType, samplingType):
+        trial = experiment.Trial(self, periphType, samplingType)
+        trial.textures = self.textures
+        self.trial = trial
+        self.tracker.setRecordingState(True)
+        trial.subscribe_events(True)
+        self.recorder.start_trial(**trial.info())
+        self.latency.start_trial(**trial.info())
+        return trial
+
+    def stop_trial(self, trial):
+        trial.subscribe_events(False)
+        self.tracker.setRecordingState(False)
+        self.recorder.flush()
+        self.latency.stop_trial()
+
+    def close(self):
+        self.messages.close()
+
+def time_call(function, repeats = 1):
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        result = function()
+    return (time.perf_counter() - t0) / repeats, result
+
+def bench_build(resolutions = resolutions, spacings = spacings, width = 53, distance = 60):
+    '''
+    Times stimulus construction (NumPy renderer) and texture cache store/load per resolution and grid density.
+    '''
+    metrics = {}
+    for size in resolutions:
+        for spacing in spacings:
+            name = 'build/%dx%d/spacing%g/' % (size[0], size[1], spacing)
+            params = linefield.stimulus_params(width, distance, size, seed = 0, renderer = 'numpy', spacing = spacing)
+            metrics[name + 'nLines'] = len(linefield.field_coordinates(params))
+            metrics[name + 'render'], textures = time_call(lambda: rasterizer.render_textures(params))
+            with tempfile.TemporaryDirectory() as directory:
+                cache = texturecache.TextureCache(directory)
+                metrics[name + 'cacheStore'], _ = time_call(lambda: cache.store(params, textures))
+                metrics[name + 'cacheLoad'], _ = time_call(lambda: {key: np.asarray(texture)
+                    for key, texture in cache.load(params).items()})
+            print(name, '%.3f s' % metrics[name + 'render'])
+    return metrics
+
+def bench_loops(rates = rates, duration = 5, repeats = 10000):
+    '''
+    Runs phase loops with mock window and replay tracker in virtual time
+    and reports CPU cost per frame (mean per category as measured by frame profiler),
+    cost of single blank() and abort() calls, and sample throughput of update_gaze.
+    '''
+    metrics = {}
+    clock = replay.VirtualClock()
+    clock.install()
+    try:
+        for rate in rates:
+            with tempfile.TemporaryDirectory() as directory:
+                session = MockSession(clock, directory, rate)
+                for phase, periphType, samplingType in (
+                        ('fixation_phase', 'small', 'none'),
+                        ('exploration_phase', 'small', 'valid')):
+                    trial = session.start_trial(periphType, samplingType)
+                    getattr(trial, phase)(duration)
+                    row = session.profiler.rows[-1]
+                    name = 'loop/%dHz/%s/' % (rate, phase)
+                    for key in ('nFrames', 'mean_draw', 'mean_poll', 'mean_logic', 'maxFrameCost'):
+                        metrics[name + key] = row.get(key, np.nan)
+                    samplesPerFrame = rate * session.win.monitorFramePeriod
+                    metrics[name + 'samplesPerSecond'] = samplesPerFrame / row['mean_poll'] if row.get('mean_poll') else np.nan
+                    session.stop_trial(trial)
+                    print(name, 'poll %.1f us, draw %.1f us per frame' % (row['mean_poll'] * 1e6, row['mean_draw'] * 1e6))
+
+                trial = session.start_trial('small', 'none')
+                trial.phase = 'fixation_phase'
+                clock.wait(2)
+                trial.update_gaze()
+                name = 'calls/%dHz/' % rate
+                metrics[name + 'blank'], _ = time_call(trial.blank, repeats)
+                metrics[name + 'abort'], _ = time_call(trial.abort, repeats)
+                session.stop_trial(trial)
+                session.close()
+                print(name, 'blank %.2f us, abort %.2f us' % (metrics[name + 'blank'] * 1e6, metrics[name + 'abort'] * 1e6))
+    finally:
+        clock.uninstall()
+    return metrics
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            cwd = os.path.dirname(os.path.abspath(__file__)), stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(filename, quick = False):
+    '''
+    Runs all benchmarks and stores results with revision and machine info as json.
+    '''
+    metrics = {}
+    metrics.update(bench_build(resolutions[:1] if quick else resolutions, spacings[:1] if quick else spacings))
+    metrics.update(bench_loops(rates, duration = 1 if quick else 5))
+    results = {
+        'revision': revision(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {'platform': platform.platform(), 'processor': platform.processor(),
+            'python': platform.python_version(), 'numpy': np.__version__},
+        'metrics': {key: float(value) for key, value in metrics.items()}}
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent = 1)
+    print('Stored results under:', filename)
+    return results
+
+def compare(baseline, current, threshold = 1.2):
+    '''
+    Prints ratio current/baseline of every time metric (s) in both result files.
+    Returns names of metrics that got slower than threshold.
+    '''
+    with open(baseline) as f:
+        old = json.load(f)
+    with open(current) as f:
+        new = json.load(f)
+    print('Baseline %s, current %s' % (old['revision'], new['revision']))
+    regressions = []
+    for key in sorted(set(old['metrics']) & set(new['metrics'])):
+        if key.endswith(('nLines', 'nFrames', 'samplesPerSecond')):
+            continue
+        ratio = new['metrics'][key] / old['metrics'][key] if old['metrics'][key] else np.nan
+        flag = ''
+        if ratio > threshold:
+            regressions.append(key)
+            flag = '  SLOWER'
+        print('%-50s %10.3g %10.3g %6.2fx%s' % (key, old['metrics'][key], new['metrics'][key], ratio, flag))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmarks stimulus construction and phase loops (headless).')
+    parser.add_argument('--out', default = 'benchmark.json')
+    parser.add_argument('--quick', action = 'store_true', help = 'one resolution and density, short phases')
+    parser.add_argument('--compare', default = None, help = 'baseline json file to compare results with')
+    args = parser.parse_args()
+
+    run(args.out, args.quick)
+    if args.compare:
+        regressions = compare(args.compare, args.out)
+        if regressions:
+            print('%d metrics got slower' % len(regressions))
@@ -0,0 +1,119 @@
+import math
+import numpy as np
+from psychopy import core
+
+def tones():
+    '''
+    Returns phase cues of sampling trials (name -> psychopy Sound).
+    Selects the audio backend, so only sessions that play sounds initialise it.
+    '''
+    from psychopy import prefs
+    prefs.hardware['audioLib'] = ['PTB', 'sounddevice', 'pyo', 'pygame'] #set before sound is imported
+    prefs.hardware['audioLatencyMode'] = 3 #aggressive low latency (PTB)
+    from psychopy import sound
+    return {
+        'low': sound.Sound('A', octave=2, sampleRate=44100, secs=0.8, stereo=True),
+        'high': sound.Sound('A', octave=3, sampleRate=44100, secs=0.8, stereo=True)}
+
+class SoundSink:
+    '''
+    Plays pre-loaded psychopy sounds. All sounds share one stream that stays open for the session.
+    With the PTB backend, onsets are scheduled (play(when = ...)) and the measured start time is read back
+    from the stream status. Other backends play immediately and report no onset (NaN).
+    '''
+    def __init__(self, sounds):
+        from psychopy import sound #backend selected by tones()
+        self.sounds = sounds
+        print('Using %s (with %s) for sounds' % (sound.audioLib, sound.audioDriver))
+
+    def play(self, name, when):
+        try:
+            self.sounds[name].play(when = when)
+        except TypeError: #backend cannot schedule onsets
+            self.sounds[name].play()
+
+    def stop(self):
+        for cue in self.sounds.values():
+            cue.stop()
+
+    def onset(self, name, since):
+        '''
+        Returns start time (core.getTime) of sound played after since, None if it has not started yet.
+        '''
+        track = getattr(self.sounds[name], 'track', None)
+        if track is None:
+            return np.nan
+        start = track.status.get('StartTime', 0)
+        return start if start > since else None
+
+class NullSink:
+    '''
+    Sink without audio device (headless runs): cues start exactly when requested, or when played if that is later.
+    '''
+    def __init__(self):
+        self.onsets = {}
+
+    def play(self, name, when):
+        self.onsets[name] = max(when, core.getTime())
+
+    def stop(self):
+        pass
+
+    def onset(self, name, since):
+        onset = self.onsets.get(name)
+        return onset if onset is not None and onset >= since else None
+
+class CueEngine:
+    '''
+    Plays auditory cues with onset scheduled at the predicted time of the next flip (plus offset),
+    so that cue and first frame of a phase coincide. Onsets are collected by poll(),
+    with times on the tracker clock (core.getTime).
+    '''
+    def __init__(self, sink, offset = 0., minLead = .005):
+        self.sink = sink
+        self.offset = offset #cue onset relative to flip (s)
+        self.minLead = minLead #minimum time from play call to onset (s), later flip is used if needed
+        self.pending = []
+        self.played = 0
+
+    def reset(self):
+        '''
+        Stops all cues (outside timing-critical parts of trial).
+        '''
+        self.sink.stop()
+
+    def next_flip(self, lastFlip, refresh):
+        '''
+        Returns predicted time (core.monotonicClock) of next flip that is at least minLead ahead.
+        '''
+        now = core.monotonicClock.getTime()
+        if lastFlip is None:
+            return now + max(refresh, self.minLead)
+        nFrames = max(1, math.ceil((now + self.minLead - lastFlip) / refresh))
+        return lastFlip + nFrames * refresh
+
+    def play(self, name, lastFlip, refresh):
+        '''
+        Schedules cue for next flip (lastFlip on core.monotonicClock, e.g. FrameProfiler.lastFlip).
+        '''
+        flip = self.next_flip(lastFlip, refresh)
+        when = flip + core.monotonicClock.getLastResetTime() + self.offset
+        called = core.getTime()
+        self.sink.play(name, when)
+        self.played += 1
+        self.pending.append({'name': name, 'flip': flip, 'requested': when, 'called': called})
+
+    def poll(self):
+        '''
+        Returns cues whose onset is known since last call: dicts with name, predicted flip (core.monotonicClock),
+        requested and measured onset (core.getTime) and delay of onset (s).
+        '''
+        done, pending = [], []
+        for cue in self.pending:
+            onset = self.sink.onset(cue['name'], cue['called'])
+            if onset is None:
+                pending.append(cue)
+            else:
+                done.append(dict(cue, onset = onset, delay = onset - cue['requested']))
+        self.pending = pending
+        return done
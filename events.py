@@ -0,0 +1,60 @@
+from collections import deque
+from psychopy.iohub.constants import EventConstants
+
+class EventDispatcher:
+    '''
+    Drains the eye tracker event queue once per frame and sorts events into queues per event type.
+    Callbacks subscribed to an event type are called for every new event of that type.
+    Events of all types in eventTypes are queued, with or without subscribers, until read by get() or clear()
+    (at most maxLen per type, oldest are dropped first). Only events of types not in eventTypes are dropped.
+    '''
+    def __init__(self, tracker, eventTypes = (
+            EventConstants.SACCADE_START,
+            EventConstants.SACCADE_END,
+            EventConstants.BLINK_START,
+            EventConstants.BLINK_END,
+            EventConstants.MONOCULAR_EYE_SAMPLE), maxLen = 1000):
+        self.tracker = tracker
+        self.queues = {eventType: deque(maxlen = maxLen) for eventType in eventTypes}
+        self.subscribers = {eventType: [] for eventType in eventTypes}
+
+    def subscribe(self, eventType, callback):
+        self.subscribers[eventType].append(callback)
+
+    def unsubscribe(self, eventType, callback):
+        if callback in self.subscribers[eventType]:
+            self.subscribers[eventType].remove(callback)
+
+    def poll(self):
+        '''
+        Fetches all new events from tracker (one call) and dispatches them in order of arrival.
+        Returns number of events fetched.
+        '''
+        events = self.tracker.getEvents()
+        if not events:
+            return 0
+        for event in events:
+            queue = self.queues.get(event.type)
+            if queue is None:
+                continue
+            queue.append(event)
+            for callback in self.subscribers[event.type]:
+                callback(event)
+        return len(events)
+
+    def get(self, eventType):
+        '''
+        Returns and removes all queued events of eventType.
+        '''
+        queue = self.queues[eventType]
+        events = list(queue)
+        queue.clear()
+        return events
+
+    def clear(self):
+        '''
+        Clears tracker buffer and all queues.
+        '''
+        self.tracker.clearEvents()
+        for queue in self.queues.values():
+            queue.clear()
@@ -1,48 +1,174 @@
+import json
 import math
 import random
 import numpy as np
 import pandas as pd
 import os
 from psychopy import core, event, visual, clock, monitors, prefs, iohub, data, gui
-from psychopy.tools import monitorunittools
+import linefield
+import texturecache
+import saccades
+import recorder
+import latency
+import triallog
+import schedule
 
 class Session:
-    from materials import prepare_materials
-    def __init__(self, simulate = False, abortOption = False):
-        infoDict = {'Subject ID':''}
-        info = gui.DlgFromDict(infoDict)
-        if info.OK:
-            print(infoDict)
-            self.pp = str(infoDict['Subject ID'])
-        else:
-            self.terminate()
+    from materials import (prepare_materials, prepare_stimuli, prepare_devices, open_window, load_sounds,
+        connect_tracker, load_textures, create_stimuli, upload_textures)
+    def __init__(self, simulate = False, abortOption = False, periphStds = None, seed = None, renderer = 'gl', 
+            composite = True, saccadeDetection = 'iohub', lateLatching = False, prefetch = False, dataDir = None,
+            trialSchedule = None, scheduleSeed = None, maxRun = None, scheduleParticipant = None,
+            samplingPatches = True, acquisition = False):
+        self.pp = self.participant_id()
+        self.dataDir = dataDir #defaults to Data folder next to this file
+        self.trial = None #trial that is currently run
         self.simulate = simulate
         self.abortOption = abortOption
+        #orientation std per periphery condition, 'none' is required for invalid sampling trials
+        self.periphStds = dict(linefield.defaultStds if periphStds is None else periphStds)
+        #seed of stimulus orientations, also key of texture cache
+        self.seed = random.SystemRandom().getrandbits(32) if seed is None else int(seed)
+        print('Seed:', self.seed)
+        self.renderer = renderer #'gl' (draw into window) or 'numpy' (rasterizer, no window needed)
+        self.composite = composite #draw pre-composited center view instead of using stencil
+        #'iohub' (tracker's saccade events) or 'online' (velocity-threshold detector over raw samples)
+        self.saccadeDetector = saccades.SaccadeDetector() if saccadeDetection == 'online' else None
+        self.lateLatching = lateLatching #sample gaze just before draw deadline in exploration phase
+        #draw periphery patch of exploration phase as small texture around landing position instead of using stencil
+        self.samplingPatches = samplingPatches
+        #collect gaze in separate process that owns the tracker connection (see acquisition.py)
+        self.acquisition = acquisition
+        if acquisition and not simulate:
+            #calibration needs the window, which the acquisition process does not have
+            print('WARNING: Gaze acquisition process only supports the mouse simulator, using in-process tracker')
+            self.acquisition = False
+        #render freshly randomized textures per trial in the background (else all trials share textures)
+        self.prefetch = prefetch
+        if prefetch and renderer != 'numpy':
+            #prefetched textures are rasterized, shared textures (used when prefetch is late) must look the same
+            print('WARNING: Texture prefetch renders with NumPy rasterizer, using it for all textures')
+            self.renderer = 'numpy'
+        self.trialSeeds = np.random.default_rng(self.seed) #seeds of per-trial textures
+        #trial order (see schedule.py), counterbalanced by participant number (subject ID if it is a number,
+        #else scheduleSeed), maxRun limits runs of the same condition (None: unconstrained shuffle)
+        #a given trialSchedule should be the row of scheduleParticipant in schedule.generate(..., scheduleSeed, maxRun)
+        self.scheduleSeed = self.seed if scheduleSeed is None else int(scheduleSeed)
+        self.maxRun = maxRun
+        if scheduleParticipant is None:
+            scheduleParticipant = int(self.pp) if self.pp.isdigit() else self.scheduleSeed
+        self.scheduleParticipant = int(scheduleParticipant)
+        if trialSchedule is None:
+            trialSchedule = schedule.participant_schedule(self.scheduleSeed, self.scheduleParticipant, maxRun)
+        self.schedule = trialSchedule
+        self.trials = schedule.LazyTrials(self.schedule, self.create_trial)
+        self.textureCache = texturecache.TextureCache(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Cache'))
         self.open_files()
+        self.store_schedule()
+        self.logger = triallog.TrialLogger(self.logfilename)
+        self.recorder = recorder.GazeRecorder(self.gazefilename)
+        self.latency = latency.LatencyMonitor(self.latencyfilename)
         self.prepare_materials()
+        self.store_settings()
         self.data = []
         
     def open_files(self):
         print('creating files')
         _thisDir = os.path.dirname(os.path.abspath(__file__))
         os.chdir(_thisDir)
+        dataDir = self.dataDir or _thisDir + os.sep + 'Data'
         date = data.getDateStr()
-        self.filename = (_thisDir + os.sep + 
-            'Data'+os.sep+u'%s_%s_%s' % ('uniformity',self.pp,date) +'.csv')
-        self.logfilename = (_thisDir + os.sep + 
-            'Data'+os.sep+u'%s_%s_%sLOG' % ('uniformity',self.pp,date) +'.csv')
+        self.filename = (dataDir + os.sep + 
+            u'%s_%s_%s' % ('uniformity',self.pp,date) +'.csv')
+        self.logfilename = (dataDir + os.sep + 
+            u'%s_%s_%sLOG' % ('uniformity',self.pp,date) +'.csv')
+        self.gazefilename = (dataDir + os.sep + 
+            u'%s_%s_%sGAZE' % ('uniformity',self.pp,date) +'.dat')
+        self.framesfilename = (dataDir + os.sep + 
+            u'%s_%s_%sFRAMES' % ('uniformity',self.pp,date) +'.csv')
+        self.latencyfilename = (dataDir + os.sep + 
+            u'%s_%s_%sLATENCY' % ('uniformity',self.pp,date) +'.csv')
+        self.msgfilename = (dataDir + os.sep + 
+            u'%s_%s_%sMSG' % ('uniformity',self.pp,date) +'.csv')
+        self.startupfilename = (dataDir + os.sep + 
+            u'%s_%s_%sSTARTUP' % ('uniformity',self.pp,date) +'.csv')
+        self.schedulefilename = (dataDir + os.sep + 
+            u'%s_%s_%sSCHEDULE' % ('uniformity',self.pp,date) +'.csv')
+        self.settingsfilename = (dataDir + os.sep + 
+            u'%s_%s_%sSETTINGS' % ('uniformity',self.pp,date) +'.json')
         print('Filename:', self.filename)  
         print('Logfilename:', self.logfilename)
         
+    def participant_id(self):
+        infoDict = {'Subject ID':''}
+        info = gui.DlgFromDict(infoDict)
+        if info.OK:
+            print(infoDict)
+            return str(infoDict['Subject ID'])
+        else:
+            self.terminate()
+    
+    def get_keys(self, keyList = None):
+        '''
+        Returns keys pressed since last call (replay sessions answer without keyboard).
+        '''
+        return event.getKeys(keyList)
+    
+    def get_rating(self, slider):
+        return slider.getRating()
+    
+    def create_trial(self, index, row):
+        '''
+        Creates trial from row of session schedule (called when trial is first accessed).
+        '''
+        trial = Trial(self, schedule.periphTypes[row['periph']], schedule.samplingTypes[row['sampling']])
+        trial.index = index
+        trial.blockType = schedule.blockTypes[row['block']]
+        trial.trialN = None if row['practice'] else int(row['trialN'])
+        trial.pause = bool(row['pause'])
+        return trial
+    
+    def store_schedule(self):
+        '''
+        Stores trial schedule of session before the first trial, so trial order can be audited
+        (and regenerated with schedule.participant_schedule(scheduleSeed, scheduleParticipant, maxRun)).
+        '''
+        try:
+            df = schedule.to_frame(self.schedule)
+            df['scheduleSeed'] = self.scheduleSeed
+            df['scheduleParticipant'] = self.scheduleParticipant
+            df['maxRun'] = self.maxRun
+            df.to_csv(self.schedulefilename)
+        except OSError:
+            print('WARNING: Could not store trial schedule:', self.schedulefilename)
+    
+    def store_settings(self):
+        '''
+        Stores stimulus parameters and display settings, needed to reconstruct frames offline (see reconstruct.py).
+        '''
+        settings = {
+            'stimulus': self.stimulusParams,
+            'composite': self.composite,
+            'prefetch': self.prefetch, #per-trial textures, rendered like stimulus textures
+            'patchCell': self.patches.cellSize if self.patches is not None else None, #pix
+            'refresh': self.profiler.refresh,
+            'clockOffset': core.monotonicClock.getLastResetTime()} #message times + offset = tracker times
+        try:
+            with open(self.settingsfilename, 'w') as f:
+                json.dump(settings, f, indent = 1)
+        except OSError:
+            print('WARNING: Could not store session settings:', self.settingsfilename)
+    
     def run(self):
         self.instructions()
         self.data = []
-        blocks = [Block(self,'sampling'), Block(self,'no-sampling')]
-        random.shuffle(blocks)
+        blocks = [Block(self, blockType, self.trials[start:stop])
+            for blockType, start, stop in schedule.blocks(self.schedule)]
         
         blocks[0].run()
         
-        pause(self)
+        blocks[0].pause()
         
         blocks[1].run()
         
@@ -58,22 +184,42 @@ We highly appreciate your participation!!
 There are 3 blocks in this experiment.
 Please press enter to continue.''')
         event.getKeys() #clears buffer
-        while not event.getKeys(['return']):
+        while not self.get_keys(['return']):
             instructTxt.draw()
             self.win.flip()
             
     def send_msg(self, block_type, trial_index = None, txt = None):
         '''
-        Sends message to eye tracker EDF file
+        Sends message to eye tracker EDF file (queued, sent by message channel)
         '''
-        t = str(core.monotonicClock.getTime())
+        t = core.monotonicClock.getTime()
         msg = f"{t}; BLOCK{block_type}; TRIAL{trial_index}; {txt}"
-        self.tracker.sendMessage(msg)
+        self.messages.send(msg, t)
         
         
     def store_data(self):
+        try:
+            self.logger.close()
+        except OSError as e:
+            print('WARNING: Could not write trial log', self.logger.filename, e)
+        print('Trial log:', self.logger.stats())
+        try:
+            self.messages.close()
+        except OSError as e:
+            print('WARNING: Could not mirror tracker messages to', self.messages.mirrorFilename, e)
+        print('Tracker messages sent:', self.messages.sent)
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            print('Texture prefetch:', self.prefetcher.stats())
+        if self.patches is not None:
+            print('Periphery patches:', self.patches.stats())
+        if self.acquisition:
+            print('Gaze acquisition:', self.tracker.stats())
         try:
             df = pd.DataFrame(self.data)
+            df['seed'] = self.seed
+            df['scheduleSeed'] = self.scheduleSeed
+            df['renderer'] = self.renderer
             print(df)
             df.to_csv(self.filename)
             print('Success! Stored data under:',self.filename)
@@ -87,62 +233,34 @@ Please press enter to continue.''')
         Aborts experiment session.
         Should only be called at end of experiment.
         '''
+        if hasattr(self, 'logger'):
+            try:
+                self.logger.close()
+            except OSError as e:
+                print('WARNING: Could not write trial log', self.logger.filename, e)
+        if hasattr(self, 'messages'):
+            try:
+                self.messages.close()
+            except OSError as e:
+                print('WARNING: Could not mirror tracker messages to', self.messages.mirrorFilename, e)
+        if getattr(self, 'prefetcher', None) is not None:
+            self.prefetcher.close()
         self.tracker.setConnectionState(False)
         self.win.close()
         self.io.quit()
         core.quit()
 
 class Block:
-    def __init__(self, session, blockType):
+    def __init__(self, session, blockType, trials):
         self.session = session
         self.blockType = blockType
-        self.practiceList = []
-        self.trialList = []
-        
-        if self.blockType == 'no-sampling':
-            
-            #Determine order of practice trials
-            self.practiceList = [
-                Trial(self.session,'none','none'), 
-                Trial(self.session,'small','none'), 
-                Trial(self.session,'large','none')]
-            random.shuffle(self.practiceList)
-            
-            #Determine order of experimental trials
-            for i in range(10):
-                self.trialList.append(Trial(self.session,'none','none'))
-            for i in range(15):
-                self.trialList.append(Trial(self.session,'small','none'))
-                self.trialList.append(Trial(self.session,'large','none'))
-            random.shuffle(self.trialList)
-            
-        elif blockType == 'sampling':
-            
-            #Determine order of practice trials
-            self.practiceList = [
-                Trial(self.session,'none','invalid'),
-                Trial(self.session,'none','valid'),
-                Trial(self.session,'small', 'valid'),
-                Trial(self.session,'large', 'valid'),
-                Trial(self.session,'small', 'invalid'),
-                Trial(self.session,'large', 'invalid')]
-            random.shuffle(self.practiceList)
-            
-            #Determine order of experimental trials
-            for i in range(10):
-                self.trialList.append(Trial(self.session,'none','invalid'))
-                self.trialList.append(Trial(self.session,'none','valid'))
-            for i in range(15):
-                self.trialList.extend([
-                    Trial(self.session,'small','invalid'),
-                    Trial(self.session,'small','valid'),
-                    Trial(self.session,'large','invalid'),
-                    Trial(self.session,'large','valid')
-                    ])
-            random.shuffle(self.trialList)
-            
+        self.trials = trials #in order of presentation, created when first accessed
+        nPractice = int(trials.schedule['practice'].sum())
+        self.practiceList = trials[:nPractice]
+        self.trialList = trials[nPractice:]
         
     def run(self):
+        self.trials[0].prefetch() #rendered while instructions are shown
         if self.blockType == 'no-sampling':
             self.instructions(stage = 'pre-practice')
             for trial in self.practiceList:
@@ -158,6 +276,8 @@ class Block:
                         }
                 self.session.send_msg(self.blockType, i+1, 'start_trial')
                 trialData['rating'], trialData['n_saccades'] = trial.run()
+                trialData['textureSeed'] = trial.textureSeed
+                trialData['aborts'] = trial.aborts
                 self.session.data.append(trialData)
                 self.log_data(trialData)
                 self.session.send_msg(self.blockType, i+1, 'end_trial')
@@ -168,7 +288,7 @@ class Block:
             self.instructions(stage = 'post-practice')
             
             for i,trial in enumerate(self.trialList):
-                if i == len(self.trialList)//2:
+                if trial.pause:
                     self.pause()
                     self.instructions(stage = 'between-blocks')
                 
@@ -181,6 +301,8 @@ class Block:
                 t = str(core.monotonicClock.getTime())
                 self.session.send_msg(self.blockType, i+1, 'start_trial')
                 trialData['rating'], trialData['n_saccades'] = trial.run()
+                trialData['textureSeed'] = trial.textureSeed
+                trialData['aborts'] = trial.aborts
                 print(trialData)
                 self.session.data.append(trialData)
                 self.log_data(trialData)
@@ -226,7 +348,7 @@ Make your judgment based on your perception at the END of the trial.
 You will get several training trials to practice the procedure.
 Please press enter to continue.''')
         event.getKeys() #clears buffer
-        while not event.getKeys(['return']):
+        while not self.session.get_keys(['return']):
             instructTxt.draw()
             self.session.win.flip()
     def pause(self):
@@ -247,20 +369,16 @@ Please press enter to continue.''')
             'You may now continue.\n\nWhen you are ready, please press enter.')
         
         event.getKeys() #clears buffer
-        while not event.getKeys(['return']):
+        while not self.session.get_keys(['return']):
             continueTxt.draw()
             self.session.win.flip()
         self.session.tracker.runSetupProcedure()
     def log_data(self, trialData):
-        try:
-            with open(self.session.logfilename, mode = 'a') as csv_file:
-                csv_writer = csv.DictWriter(csv_file, fieldnames = trialData.keys())
-                csv_writer.writerow(trialData)
-            print('Stored trial data:',trialData)
-        except:
-            print('WARNING: Could not store trial data:',trialData)
-        else:
-            print(trialData)
+        '''
+        Hands trial data to background logger (does not block).
+        Session data can be recovered from the log with triallog.recover.
+        '''
+        self.session.logger.log(trialData)
     
     
 class Trial:
@@ -268,11 +386,19 @@ class Trial:
         self.session = session
         self.periphType = periphType
         self.samplingType = samplingType
+        self.blockType = None #set by block
+        self.trialN = None #None for practice trials
+        self.index = None #position in session schedule, set when created from schedule
+        self.pause = False #pause before trial
+        self.seed = int(session.trialSeeds.integers(2**32))
+        self.textures = None
+        self.textureSeed = None
+        self.aborts = 0 #number of times trial was repeated
         
     def run(self):
         self.data = []
-        self.session.soundHigh.stop() #resets sound
-        self.session.soundLow.stop()
+        self.session.trial = self
+        self.session.cues.reset() #stops cues of previous trial
         
         self.session.win.mouseVisible = False
         self.trialClock = clock.Clock()
@@ -280,22 +406,32 @@ class Trial:
         self.session.aperture.enabled = False
         self.session.tracker.setRecordingState(True)
         self.samplingPeriphDrawn = False
+        if self.textures is None: #kept when trial is repeated
+            self.select_textures()
         self.fixation_dot(1.5)
         self.session.aperture.enabled = True
-        self.session.tracker.clearEvents() #clears buffer
+        self.session.events.clear() #clears buffer
+        self.subscribe_events(True)
+        self.session.recorder.start_trial(**self.info())
+        self.session.latency.start_trial(**self.info())
         
         n_saccades = np.array((0,0)) #holds number of saccades (index 0) and micro-saccades (index 1)
         if self.samplingType == 'none':
             aborted = self.fixation_phase(10)
         else: 
-            self.session.soundLow.play()
+            self.cue('low')
             n_saccades += self.exploration_phase(5)
-            self.session.soundHigh.play() 
+            self.cue('high')
             n_saccades += self.exploration_phase(1) #give subject 1s to look back to center
             aborted = self.fixation_phase(4)
+        self.log_cues()
         
+        self.subscribe_events(False)
         self.session.tracker.setRecordingState(False)
+        self.session.recorder.flush(aborted)
+        self.session.latency.stop_trial()
         if aborted:
+            self.aborts += 1
             self.session.aperture.enabled = False
             txt = visual.TextStim(self.session.win,
                         'Trial invalid.\nThe trial will be repeated.',
@@ -304,31 +440,44 @@ class Trial:
             while timer.getTime() > 0:
                 txt.draw()
                 self.session.win.flip()
+            self.session.profiler.write()
             return self.run() #repeat trial until successful
         else:
-            return (self.rating_phase(),n_saccades)
+            rating = self.rating_phase()
+            self.session.profiler.write()
+            if self.periphType in self.textures['frames']:
+                self.textures['frames'][self.periphType].release()
+            self.textures = None #releases per-trial textures
+            return (rating,n_saccades)
         
     def fixation_dot(self, duration):
         self.send_msg('fixation_dot',txt = 'start_phase')
+        self.start_profiling('fixation_dot')
         timer = clock.CountdownTimer(duration)
         while timer.getTime() > 0:
             self.session.fixationDot.draw()
-            self.session.win.flip()
+            self.session.profiler.mark('draw')
+            self.session.profiler.flip()
+        self.session.profiler.stop()
         self.send_msg('fixation_dot',txt = 'end_phase')
         
     def fixation_phase(self, duration):
+        self.phase = 'fixation_phase'
         self.send_msg('fixation_phase',txt = 'start_phase')
+        self.start_profiling('fixation_phase')
         timer = clock.CountdownTimer(duration)
         aborted = False
-        self.session.tracker.getEvents() #clears buffer
+        self.session.events.clear() #clears buffer
         while timer.getTime() > 0 and not aborted:
-            self.session.aperture.inverted = False
-            self.session.center.draw()
-            self.session.aperture.inverted = True
-            self.session.periph[self.periphType].draw()
+            self.draw_center_view()
+            self.session.profiler.mark('draw')
             
-            self.session.win.flip()
+            self.session.profiler.flip()
+            self.update_gaze()
+            self.session.profiler.mark('poll')
             aborted = self.abort()
+            self.session.profiler.mark('logic')
+        self.session.profiler.stop()
         self.send_msg('fixation_phase',txt = 'end_phase')
         return aborted
     def exploration_phase(self, duration):
@@ -336,38 +485,93 @@ class Trial:
         Administers exploration phase.
         Shows patch of periphery upon saccade out of central area.
         '''
+        self.phase = 'exploration_phase'
         self.send_msg('exploration_phase',txt = 'start_phase')
+        self.start_profiling('exploration_phase')
         timer = clock.CountdownTimer(duration)
         n_saccades = np.array((0,0)) #number of saccades (index 0) and microsaccades (index 1)
+        scheduler = self.session.scheduler
+        if scheduler is not None:
+            scheduler.start_phase()
         while timer.getTime() > 0:
-            n_saccades += self.blank()
-            gaze_pos = self.gazePosDeg()
-            if isinstance(gaze_pos, (tuple, list)):  
-                
-                if self.session.centerRect.contains(gaze_pos):
-                    self.session.aperture.enabled = True
-                    self.session.aperture.inverted = False
-                    self.session.center.draw()
-                    self.session.aperture.inverted = True
-                    self.session.periph[self.periphType].draw()
-                    self.samplingPeriphDrawn = False
-                else:  
-                    self.session.aperture.enabled = False
-                    if not self.samplingPeriphDrawn: #only set position of samplingAperture to gaze position after first saccade in periph
-                        self.session.samplingAperture.pos = gaze_pos
-                        self.samplingPeriphDrawn = True
-                    self.session.samplingAperture.enabled = True
-                    if self.samplingType == 'invalid':
-                        self.session.periph['none'].draw() #draw no difference periphery instead of periphType
-                    elif self.samplingType == 'valid':
-                        self.session.periph[self.periphType].draw()
-                    self.session.samplingAperture.enabled = False
-                    
-            self.session.win.flip()
+            lastContent = self.content
+            if scheduler is not None:
+                scheduler.wait() #sample gaze just before draw deadline
+                self.session.profiler.mark('wait')
+            n_saccades += self.exploration_frame()
+            if scheduler is not None:
+                flipTime = scheduler.flip(self.session.profiler.flip)
+            else:
+                flipTime = self.session.profiler.flip()
+            if self.content != lastContent: #first blank or swapped frame
+                #flip times are relative to core.monotonicClock, tracker times are absolute (core.getTime)
+                self.session.latency.display_change(
+                    flipTime + core.monotonicClock.getLastResetTime(), self.content)
+        self.session.profiler.stop(**(scheduler.summary() if scheduler is not None else {}))
         self.send_msg('exploration_phase', txt = 'end_phase')
         return n_saccades
+    def exploration_frame(self):
+        '''
+        Samples gaze and draws center view, periphery patch or blank screen.
+        Returns number of saccades and microsaccades that ended since last frame.
+        '''
+        self.update_gaze()
+        n_saccades = self.blank()
+        gaze_pos = self.gazePosDeg()
+        self.session.profiler.mark('poll')
+        if self.blanking or np.isnan(gaze_pos).any(): #screen stays blank during long saccades and while gaze is missing
+            self.content = 'blank'
+        else:
+            
+            if self.session.centerROI.contains(gaze_pos):
+                self.content = 'center'
+                self.draw_center_view()
+                self.samplingPeriphDrawn = False
+            else:  
+                self.content = 'patch'
+                self.session.aperture.enabled = False
+                if not self.samplingPeriphDrawn: #only set position of patch to gaze position after first saccade in periph
+                    self.patchPos = gaze_pos
+                    self.session.samplingAperture.pos = gaze_pos
+                    self.samplingPeriphDrawn = True
+                self.draw_patch()
+        self.session.profiler.mark('draw')
+        return n_saccades
+    def draw_patch(self):
+        '''
+        Draws periphery around landing position, as small patch texture if available, else through samplingAperture.
+        '''
+        if self.samplingType == 'invalid':
+            name = 'none' #draw no difference periphery instead of periphType
+        elif self.samplingType == 'valid':
+            name = self.periphType
+        else:
+            return
+        if self.textures.get('patches') is not None:
+            self.textures['patches'].draw(name, self.patchPos)
+        else:
+            self.session.samplingAperture.enabled = True
+            self.textures['periph'][name].draw()
+            self.session.samplingAperture.enabled = False
+    
+    def draw_center_view(self):
+        '''
+        Draws center and periphery of current condition.
+        Uses pre-composited frame if available, else draws both through the stencil.
+        '''
+        if self.periphType in self.textures['frames']:
+            self.session.aperture.enabled = False
+            self.textures['frames'][self.periphType].draw()
+        else:
+            self.session.aperture.enabled = True
+            self.session.aperture.inverted = False
+            self.textures['center'].draw()
+            self.session.aperture.inverted = True
+            self.textures['periph'][self.periphType].draw()
+    
     def rating_phase(self):
         self.send_msg('rating_phase', txt = 'start_phase')
+        self.start_profiling('rating_phase')
         slider = visual.Slider(self.session.win, 
             ticks = (1,2,3,4),  
             labels = ['1','2','3','4'],
@@ -376,42 +580,145 @@ class Trial:
             units = 'pix'
             )
         self.session.aperture.enabled = False
+        if self.nextTrial is not None:
+            self.nextTrial.prefetch()
         
-        while slider.getRating() == None:
+        rating = None
+        while rating == None:
+            rating = self.session.get_rating(slider)
+            if self.session.prefetcher is not None:
+                self.session.prefetcher.poll() #uploads next trial's textures once rendered
+                self.session.profiler.mark('logic')
             self.session.ratingText.draw()
             slider.draw()
-            self.session.win.flip()
+            self.session.profiler.mark('draw')
+            self.session.profiler.flip()
+        self.session.profiler.stop()
         
         self.send_msg('rating_phase', txt = 'end_phase')
-        return slider.getRating()
+        return rating
+    @property
+    def nextTrial(self):
+        '''
+        Next trial of session schedule, textures of next trial are prefetched during rating phase.
+        '''
+        if self.index is None or self.index + 1 >= len(self.session.trials):
+            return None
+        return self.session.trials[self.index + 1]
+    
+    def texture_params(self):
+        '''
+        Returns stimulus params of this trial's textures (only conditions drawn in trial).
+        '''
+        params = self.session.stimulusParams
+        stds = {name: params['stds'][name] for name in ('none', self.periphType)}
+        return dict(params, renderer = 'numpy', stds = stds, seed = self.seed)
+    
+    def prefetch(self):
+        if self.session.prefetcher is not None:
+            self.session.prefetcher.request(self, self.texture_params())
+    
+    def select_textures(self):
+        '''
+        Uses prefetched textures of trial if ready, else shared textures of session.
+        '''
+        textures = None
+        if self.session.prefetcher is not None:
+            textures = self.session.prefetcher.get(self)
+        if textures is None:
+            textures = {
+                'seed': self.session.seed,
+                'center': self.session.center,
+                'periph': self.session.periph,
+                'frames': self.session.frames,
+                'patches': self.session.patches}
+        self.textures = textures
+        self.textureSeed = textures['seed']
+        if self.periphType in textures['frames']: #uploaded before the trial starts, released after it
+            textures['frames'][self.periphType].load()
+        self.send_msg('textures', txt = 'seed %d' % self.textureSeed)
+    
+    def info(self):
+        '''
+        Returns dict identifying trial in data files.
+        '''
+        return {
+            'recording': self.session.recorder.recording, 
+            'blockType': self.blockType, 
+            'trialN': self.trialN, 
+            'periphType': self.periphType, 
+            'samplingType': self.samplingType}
+    
+    def start_profiling(self, phase):
+        self.session.profiler.start(phase, **self.info())
+    
+    def subscribe_events(self, subscribe):
+        '''
+        (Un)subscribes trial to saccade and blink events of session's event dispatcher.
+        '''
+        self.saccadeStart = None #gaze position at start of ongoing saccade
+        self.inBlink = False
+        self.n_saccades = np.array((0,0)) #saccades and microsaccades that ended since last call of blank()
+        self.blanking = False
+        self.sampleTimes, self.samplesDeg = np.empty(0), np.empty((0,2))
+        self.lastOnset = None #onset time of last saccade passed on to latency monitor
+        self.content = None #what is drawn in current frame: 'center', 'patch' or 'blank'
+        handlers = {
+            iohub.constants.EventConstants.BLINK_START: self.blink_start,
+            iohub.constants.EventConstants.BLINK_END: self.blink_end}
+        if self.session.saccadeDetector is None:
+            handlers[iohub.constants.EventConstants.SACCADE_START] = self.saccade_start
+            handlers[iohub.constants.EventConstants.SACCADE_END] = self.saccade_end
+        else:
+            self.session.saccadeDetector.reset()
+        for eventType, handler in handlers.items():
+            if subscribe:
+                self.session.events.subscribe(eventType, handler)
+            else:
+                self.session.events.unsubscribe(eventType, handler)
+    
+    def saccade_start(self, event):
+        self.saccadeStart = self.gazePosDeg()
+        self.session.latency.onset(event.time, core.getTime(), self.phase)
+    
+    def saccade_end(self, event):
+        self.session.latency.offset(event.time)
+        if self.saccadeStart is None: #saccade was interrupted by blink
+            return
+        start_pos = self.saccadeStart
+        current_pos = self.gazePosDeg()
+        self.saccadeStart = None
+        if not np.isnan(current_pos).any() and not np.isnan(start_pos).any():
+            self.count_saccade(np.linalg.norm(current_pos - start_pos)) #distance of start and end point
+    
+    def count_saccade(self, saccade_length):
+        if saccade_length > 2:
+            self.n_saccades += np.array((1,0))
+        else:
+            self.n_saccades += np.array((0,1))
+    
+    def blink_start(self, event):
+        self.saccadeStart = None #blinks start with saccade event
+        self.inBlink = True
+    
+    def blink_end(self, event):
+        self.inBlink = False
+    
     def blank(self):
         '''
-        Shows blank screen if (long) saccade is detected.
-        Returns number of saccades and microsaccades detected.
-        '''
-        n_saccades = np.array((0,0))
-        saccade_starts = self.session.tracker.getEvents(event_type_id = iohub.constants.EventConstants.SACCADE_START)
-        if len(saccade_starts) > 0:
-            start_pos = np.array((self.gazePosDeg()))
-            saccade_ends = [] 
-            blink_starts = []
-            while len(saccade_ends) == 0 and len(blink_starts) == 0: #wait until end of saccade or blink (blinks start with saccade event)
-                saccade_ends = self.session.tracker.getEvents(event_type_id = iohub.constants.EventConstants.SACCADE_END)
-                blink_starts = self.session.tracker.getEvents(event_type_id = iohub.constants.EventConstants.BLINK_START)
-                
-                current_pos = np.array((self.gazePosDeg()))
-                if None not in current_pos and None not in start_pos:
-                    saccade_length = np.linalg.norm(current_pos - start_pos) #distance of start and end point
-                    if saccade_length > 1: 
-                        self.session.win.flip() #blanks screen for all saccades longer than 1 degree of visual angle
-            if len(saccade_ends) > 0 and None not in current_pos and None not in start_pos: 
-                saccade = saccade_ends[0]
-                saccade_length = np.linalg.norm(current_pos - start_pos) #distance of start and end point
-                
-                if saccade_length > 2:
-                    n_saccades += np.array((1,0))
-                else:
-                    n_saccades += np.array((0,1))
+        Sets self.blanking if (long) saccade is ongoing, so that a blank screen is shown.
+        Returns number of saccades and microsaccades that ended since last call.
+        '''
+        self.blanking = False
+        if self.session.saccadeDetector is not None:
+            self.blanking = self.session.saccadeDetector.current_amplitude() > 1
+        elif self.saccadeStart is not None:
+            current_pos = self.gazePosDeg()
+            if not np.isnan(current_pos).any() and not np.isnan(self.saccadeStart).any():
+                saccade_length = np.linalg.norm(current_pos - self.saccadeStart) #distance of start and current point
+                self.blanking = saccade_length > 1 #blanks screen for all saccades longer than 1 degree of visual angle
+        n_saccades = self.n_saccades
+        self.n_saccades = np.array((0,0))
         return n_saccades
     
     def abort(self):
@@ -419,30 +726,20 @@ class Trial:
         Returns True if gaze is in periphery, else returns False.
         Terminates session if abortOption is True and Escape was pressed.
         '''
-        if self.session.abortOption and event.getKeys('escape'):
+        if self.session.abortOption and self.session.get_keys(['escape']):
             print('session terminated')
             self.session.terminate()
-        if event.getKeys(['c']):
+        if self.session.get_keys(['c']):
             self.session.tracker.runSetupProcedure()
         
-        #Check for saccade
         aborted = False
         
-        #Wait during blinks... blinks always start with saccade event
-        saccade_inits = self.session.tracker.getEvents(event_type_id = iohub.constants.EventConstants.SACCADE_START)
-        if len(saccade_inits) > 0:
-            saccade_ends = [] 
-            while len(saccade_ends) == 0:
-                saccade_ends = self.session.tracker.getEvents(event_type_id = iohub.constants.EventConstants.SACCADE_END)
+        #Wait during saccades and blinks... blinks always start with saccade event
+        if self.in_saccade() or self.inBlink:
+            return aborted
                 
-        gaze_pos = self.gazePosDeg()
-        if isinstance(gaze_pos, (tuple, list)):
-            if gaze_pos == (None,None):
-                gaze_in_center = True
-            else:
-                gaze_in_center = self.session.fixationArea.contains(gaze_pos)    
-        else:
-            gaze_in_center = True #do not abort when participant blinks
+        #current position, do not abort when participant blinks
+        gaze_in_center = self.session.fixationROI.contains(self.gazePosDeg(), missing = True)
         
         if not gaze_in_center:
             aborted = True
@@ -450,29 +747,62 @@ class Trial:
             
         return aborted
     
+    def cue(self, name):
+        '''
+        Plays auditory cue with onset at next flip (first frame of following phase).
+        '''
+        self.session.cues.play(name, self.session.profiler.lastFlip, self.session.profiler.refresh)
+    
+    def log_cues(self):
+        '''
+        Sends measured onsets of cues (tracker clock) to eye tracker.
+        '''
+        for cue in self.session.cues.poll():
+            self.send_msg('cue', txt = 'onset %s %.6f requested %.6f delay %.2f ms' % (
+                cue['name'], cue['onset'], cue['requested'], cue['delay'] * 1000))
+    
     def send_msg(self, phase, txt = None):
         '''
-        Sends message to eye tracker EDF file
+        Sends message to eye tracker EDF file (queued, sent by message channel)
         '''
-        t = str(core.monotonicClock.getTime())
+        t = core.monotonicClock.getTime()
         msg = f"{t};{phase};{txt}"
-        self.session.tracker.sendMessage(msg)
+        self.session.messages.send(msg, t)
     
     def gazePosDeg(self):
         '''
-        Returns current gaze position in degrees of visual angle.
+        Returns current gaze position in degrees of visual angle as array of shape [2].
+        Position is NaN during blinks.
         '''
-        posPix = self.session.tracker.getPosition()
-        if isinstance(posPix, (tuple, list)):
-            if posPix == (None, None):
-                posDeg = posPix
-            else:
-                posDeg = []
-                for coord in posPix:
-                    posDeg.append(monitorunittools.pix2deg(coord,self.session.mon))
-        else:
-            posDeg = None
-        return posDeg
+        return self.session.gazeTransform.to_deg(self.session.tracker.getPosition())
+    
+    def update_gaze(self):
+        '''
+        Polls tracker events (once per frame) and converts all new samples to degrees.
+        Passes samples on to online saccade detector if used.
+        '''
+        self.session.events.poll()
+        samples = self.session.events.get(iohub.constants.EventConstants.MONOCULAR_EYE_SAMPLE)
+        self.sampleTimes, self.samplesDeg = self.session.gazeTransform.samples_to_deg(samples)
+        self.session.recorder.add(self.sampleTimes, self.samplesDeg, self.phase)
+        detector = self.session.saccadeDetector
+        if detector is not None:
+            now = core.getTime()
+            for saccade in detector.push(self.sampleTimes, self.samplesDeg):
+                if saccade.onset != self.lastOnset: #saccade started and ended within new samples
+                    self.session.latency.onset(saccade.onset, now, self.phase)
+                self.session.latency.offset(saccade.offset)
+                self.lastOnset = saccade.onset
+                self.count_saccade(saccade.amplitude)
+            if detector.inSaccade and detector.onset_time() != self.lastOnset:
+                self.lastOnset = detector.onset_time()
+                self.session.latency.onset(self.lastOnset, now, self.phase)
+    
+    def in_saccade(self):
+        if self.session.saccadeDetector is not None:
+            return self.session.saccadeDetector.inSaccade
+        return self.saccadeStart is not None
 
-session = Session(simulate = True, abortOption = True)
-session.run()
+if __name__ == '__main__': #worker processes import this module
+    session = Session(simulate = True, abortOption = True)
+    session.run()
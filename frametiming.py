@@ -0,0 +1,113 @@
+import csv
+import os
+import threading
+import time
+import numpy as np
+
+costCategories = ('draw', 'poll', 'logic', 'wait')
+histBins = (0, .5, .75, 1.25, 1.75, 2.5, 3.5, np.inf) #frame intervals in units of refresh period
+fields = (['recording', 'blockType', 'trialN', 'periphType', 'samplingType', 'phase', 'nFrames', 'refresh',
+    'duration', 'meanInterval', 'maxInterval', 'droppedFrames', 'jitter'] +
+    ['hist_%g-%g' % bounds for bounds in zip(histBins[:-1], histBins[1:])] +
+    ['%s_%s' % (stat, category) for category in costCategories for stat in ('mean', 'max')] +
+    ['maxFrameCost', 'meanSlack', 'minSlack', 'missedDeadlines', 'budget', 'latching'])
+
+class FrameProfiler:
+    '''
+    Timestamps every win.flip() of a phase and splits the work per frame into draw, tracker poll and logic costs
+    (and time spent waiting for the frame scheduler).
+    Phase loops call mark(category) after each piece of work; time since previous mark is added to category.
+    At end of phase, interval histogram, dropped frames and jitter are summarized into one row,
+    rows are written to csv file with write().
+    '''
+    def __init__(self, win, filename, capacity = 4096):
+        self.win = win
+        self.filename = filename
+        self.refresh = getattr(win, 'monitorFramePeriod', None) or 1/60
+        self.flips = np.zeros(capacity)
+        self.costs = np.zeros((capacity, len(costCategories)))
+        self.rows = []
+        self.phase = None
+        self.lastFlip = None #timestamp of last flip, also outside of phases
+        self.flipping = threading.Event() #set while waiting for flip (other threads may use the tracker then)
+
+    def start(self, phase, **info):
+        '''
+        Starts profiling phase. Info (e.g. blockType, trialN) is added to summary row.
+        '''
+        self.phase = phase
+        self.info = info
+        self.n = 0
+        self.costs[0] = 0
+        self.last = time.perf_counter()
+
+    def mark(self, category):
+        now = time.perf_counter()
+        if self.phase is not None and self.n < len(self.flips):
+            self.costs[self.n, costCategories.index(category)] += now - self.last
+        self.last = now
+
+    def flip(self):
+        '''
+        Flips window and records flip timestamp. Time since last mark counts as logic.
+        '''
+        self.mark('logic')
+        self.flipping.set()
+        try:
+            flipTime = self.win.flip()
+        finally:
+            self.flipping.clear()
+        self.lastFlip = flipTime
+        if self.phase is not None and self.n < len(self.flips):
+            self.flips[self.n] = flipTime
+            self.n += 1
+            if self.n < len(self.flips):
+                self.costs[self.n] = 0
+        self.last = time.perf_counter()
+        return flipTime
+
+    def stop(self, **extra):
+        '''
+        Summarizes phase into row. Extra fields (e.g. scheduler metrics) are added to row.
+        '''
+        if self.phase is None:
+            return
+        n = self.n
+        intervals = np.diff(self.flips[:n])
+        row = dict(self.info, phase = self.phase, nFrames = n, refresh = self.refresh)
+        if len(intervals) > 0:
+            ratio = intervals / self.refresh
+            row['duration'] = self.flips[n-1] - self.flips[0]
+            row['meanInterval'] = intervals.mean()
+            row['maxInterval'] = intervals.max()
+            row['droppedFrames'] = int(np.maximum(np.round(ratio) - 1, 0).sum())
+            row['jitter'] = np.abs(intervals - self.refresh).max()
+            counts, _ = np.histogram(ratio, bins = histBins)
+            for lower, upper, count in zip(histBins[:-1], histBins[1:], counts):
+                row['hist_%g-%g' % (lower, upper)] = count
+        costs = self.costs[:n]
+        if n > 0:
+            for i, category in enumerate(costCategories):
+                row['mean_' + category] = costs[:, i].mean()
+                row['max_' + category] = costs[:, i].max()
+            row['maxFrameCost'] = costs[:, :-1].sum(axis = 1).max() #without waiting
+        row.update(extra)
+        self.rows.append(row)
+        self.phase = None
+
+    def write(self):
+        '''
+        Appends summary rows to csv file.
+        '''
+        if not self.rows:
+            return
+        newFile = not os.path.exists(self.filename)
+        try:
+            with open(self.filename, 'a', newline = '') as f:
+                writer = csv.DictWriter(f, fieldnames = fields, extrasaction = 'ignore')
+                if newFile:
+                    writer.writeheader()
+                writer.writerows(self.rows)
+        except OSError:
+            print('WARNING: Could not store frame timing:', self.filename)
+        self.rows = []
@@ -0,0 +1,47 @@
+import numpy as np
+from psychopy.tools import monitorunittools
+
+class GazeTransform:
+    '''
+    Converts gaze positions from pixels to degrees of visual angle.
+    The conversion is linear, so the factor is computed once instead of calling pix2deg per coordinate.
+    '''
+    def __init__(self, mon):
+        self.degPerPix = 1 / monitorunittools.deg2pix(1, mon)
+
+    def to_deg(self, posPix):
+        '''
+        Returns float array of shape [...,2] in degrees for a single position or an array of positions.
+        Missing data (None or (None, None) during blinks) becomes NaN.
+        '''
+        if posPix is None:
+            return np.full(2, np.nan)
+        return np.asarray(posPix, dtype = float) * self.degPerPix
+
+    def samples_to_deg(self, samples):
+        '''
+        Returns sample times (s) and gaze positions in degrees (shape [N,2]) for list of iohub eye sample events.
+        '''
+        times = np.empty(len(samples))
+        posPix = np.empty((len(samples), 2))
+        for i, sample in enumerate(samples):
+            times[i] = sample.time
+            posPix[i] = sample.gaze_x, sample.gaze_y
+        return times, posPix * self.degPerPix
+
+class RectROI:
+    '''
+    Rectangular region of interest (in degrees), tested on arrays of gaze positions.
+    '''
+    def __init__(self, size, pos = (0,0)):
+        self.halfSize = np.asarray(size, dtype = float)/2
+        self.pos = np.asarray(pos, dtype = float)
+
+    def contains(self, posDeg, missing = True):
+        '''
+        Returns boolean array of shape [...] that is True for all positions inside ROI.
+        Missing positions (NaN, e.g. blinks) count as inside if missing is True.
+        '''
+        posDeg = np.asarray(posDeg, dtype = float)
+        inside = np.all(np.abs(posDeg - self.pos) < self.halfSize, axis = -1)
+        return np.where(np.isnan(posDeg).any(axis = -1), missing, inside)
@@ -0,0 +1,12 @@
+'''
+Configures pyglet for runs without a visible display. Must be imported before psychopy
+(psychopy.visual imports pyglet, which opens a shadow window on import).
+The shadow window is disabled. With --headless on the command line, pyglet's headless mode is used:
+windows are created offscreen through EGL, so no X server (or Xvfb) is needed, only EGL drivers (GPU or Mesa).
+'''
+import sys
+import pyglet
+
+pyglet.options['shadow_window'] = False
+if '--headless' in sys.argv:
+    pyglet.options['headless'] = True
@@ -0,0 +1,99 @@
+import csv
+import os
+import numpy as np
+
+saccadeFields = ['recording', 'blockType', 'trialN', 'periphType', 'samplingType', 'phase',
+    'onsetTime', 'detectTime', 'endTime', 'displayTime', 'content', 'detectLatency', 'displayLatency', 'late']
+summaryFields = ['recording', 'blockType', 'trialN', 'periphType', 'samplingType',
+    'nSaccades', 'nDisplayChanges', 'nLate', 'medianDetectLatency', 'maxDetectLatency',
+    'medianDisplayLatency', 'p95DisplayLatency', 'maxDisplayLatency']
+
+class LatencyMonitor:
+    '''
+    Measures saccade-to-display latency of gaze-contingent display changes.
+    Per saccade, records tracker time of onset sample, local time at which onset was detected,
+    flip time of first display change (blank or swapped frame) and tracker time of saccade end.
+    Display changes that land after saccade end are flagged as late.
+    '''
+    def __init__(self, filename, window = .1):
+        self.filename = filename
+        self.summaryFilename = os.path.splitext(filename)[0] + '_summary.csv'
+        self.window = window #display changes up to this long after saccade end are attributed to saccade (s)
+        self.saccades = []
+        self.current = None
+        self.info = {}
+
+    def start_trial(self, **info):
+        self.info = info
+        self.saccades = []
+        self.current = None
+
+    def onset(self, onsetTime, detectTime, phase = None):
+        self.current = dict(self.info, phase = phase, onsetTime = onsetTime, detectTime = detectTime,
+            endTime = np.nan, displayTime = np.nan, content = '')
+        self.saccades.append(self.current)
+
+    def offset(self, endTime):
+        if self.current is not None and np.isnan(self.current['endTime']):
+            self.current['endTime'] = endTime
+
+    def display_change(self, flipTime, content):
+        '''
+        Attributes first display change after onset to ongoing (or just ended) saccade.
+        '''
+        saccade = self.current
+        if saccade is None or not np.isnan(saccade['displayTime']):
+            return
+        if flipTime - saccade['endTime'] > self.window: #comparison is False while saccade is ongoing
+            return
+        saccade['displayTime'] = flipTime
+        saccade['content'] = content
+
+    def stop_trial(self):
+        '''
+        Writes saccade rows and trial summary to csv files. Returns summary.
+        '''
+        rows = self.saccades
+        onsetTime = np.array([row['onsetTime'] for row in rows], dtype = float)
+        detectTime = np.array([row['detectTime'] for row in rows], dtype = float)
+        endTime = np.array([row['endTime'] for row in rows], dtype = float)
+        displayTime = np.array([row['displayTime'] for row in rows], dtype = float)
+        detectLatency = detectTime - onsetTime
+        displayLatency = displayTime - onsetTime
+        late = displayTime > endTime
+        for i, row in enumerate(rows):
+            row.update(detectLatency = detectLatency[i], displayLatency = displayLatency[i], late = late[i])
+
+        changed = displayLatency[~np.isnan(displayLatency)]
+        summary = dict(self.info,
+            nSaccades = len(rows),
+            nDisplayChanges = len(changed),
+            nLate = int(late.sum()))
+        if len(rows) > 0:
+            summary.update(
+                medianDetectLatency = np.nanmedian(detectLatency),
+                maxDetectLatency = np.nanmax(detectLatency))
+        if len(changed) > 0:
+            summary.update(
+                medianDisplayLatency = np.median(changed),
+                p95DisplayLatency = np.percentile(changed, 95),
+                maxDisplayLatency = changed.max())
+
+        append_rows(self.filename, saccadeFields, rows)
+        append_rows(self.summaryFilename, summaryFields, [summary])
+        self.saccades = []
+        self.current = None
+        return summary
+
+def append_rows(filename, fieldnames, rows):
+    if not rows:
+        return
+    newFile = not os.path.exists(filename)
+    try:
+        with open(filename, 'a', newline = '') as f:
+            writer = csv.DictWriter(f, fieldnames = fieldnames, extrasaction = 'ignore')
+            if newFile:
+                writer.writeheader()
+            writer.writerows(rows)
+    except OSError:
+        print('WARNING: Could not store latencies:', filename)
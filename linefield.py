@@ -0,0 +1,75 @@
+import math
+import numpy as np
+
+defaultStds = {'none': 0, 'small': 5, 'large': 10} #orientation std (deg) per periphery condition
+
+def grid_coordinates(width, height, spacing = .87):
+    '''
+    Returns coordinates of line grid as array of shape [N,2].
+    Width, height and spacing in degrees of visual angle.
+    '''
+    nStepsHor = math.ceil(width/spacing) #Field size divided by step size (in visual angles)
+    stepsHor = np.linspace(-width/2, width/2, nStepsHor)
+    nStepsVert = math.ceil(height/spacing)
+    stepsVert = np.linspace(-height/2, height/2, nStepsVert)
+
+    x, y = np.meshgrid(stepsHor, stepsVert, indexing = 'ij') #same order as looping over x, then y
+    return np.column_stack((x.ravel(), y.ravel()))
+
+def rect_contains(coordinates, size, pos = (0,0)):
+    '''
+    Returns boolean array of shape [N] that is True for all coordinates inside rectangle.
+    '''
+    coordinates = np.asarray(coordinates, dtype = float)
+    halfSize = np.asarray(size, dtype = float)/2
+    return np.all(np.abs(coordinates - np.asarray(pos, dtype = float)) < halfSize, axis = -1)
+
+def orientations(nLines, stds = defaultStds, mean = 45, rng = None):
+    '''
+    Returns dict of orientation arrays of shape [nLines], one per condition in stds.
+    Conditions with std of 0 get constant orientation.
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    oris = {}
+    for name, std in stds.items():
+        if std == 0:
+            oris[name] = np.full(nLines, float(mean))
+        else:
+            oris[name] = rng.normal(loc = mean, scale = std, size = nLines)
+    return oris
+
+def stimulus_params(width, distance, size, stds = defaultStds, seed = None, renderer = 'gl',
+        spacing = .87, length = .82, lineWidth = 1, centerSize = (25.3, 13.3), mean = 45):
+    '''
+    Returns (json serializable) dict with all parameters that determine the stimulus textures.
+    Width and distance of monitor in cm, size of window in pixels.
+    '''
+    return {
+        'monitor': {
+            'width': float(width), 
+            'distance': float(distance), 
+            'size': [int(s) for s in size]},
+        'renderer': renderer,
+        'spacing': float(spacing),
+        'length': float(length),
+        'lineWidth': float(lineWidth),
+        'centerSize': [float(s) for s in centerSize],
+        'mean': float(mean),
+        'stds': {name: float(std) for name, std in stds.items()},
+        'seed': seed}
+
+def pix_per_deg(params):
+    '''
+    Returns number of pixels per degree of visual angle (same as monitorunittools.deg2pix).
+    '''
+    monitor = params['monitor']
+    return monitor['size'][0] / monitor['width'] * monitor['distance'] * 0.017455
+
+def field_coordinates(params):
+    '''
+    Returns coordinates of line grid spanning the monitor width.
+    '''
+    width = params['monitor']['width'] / (params['monitor']['distance'] * 0.017455) #cm2deg
+    height = width * 9/16 #assume aspect ratio 16:9
+    return grid_coordinates(width, height, params['spacing'])
@@ -1,37 +1,199 @@
-import math
 import numpy as np
 import os
-from psychopy import visual, sound, monitors, prefs, data
+from PIL import Image
+from psychopy import visual, monitors, data
 from psychopy.tools import monitorunittools
 from psychopy.iohub import launchHubServer
+import linefield
+import rasterizer
+import events
+import gaze
+import frametiming
+import scheduler
+import messages
+import prefetch
+import startup
+import patches
+import texturestore
+import cues
+import acquisition
+
+def line_field(win, mon, coordinates, oris, length = .82, lineWidth = 1):
+    '''
+    Returns all lines of a field as one ElementArrayStim, which is drawn in a single batched call.
+    Coordinates (shape [N,2]) and length in degrees, lineWidth in pixels.
+    '''
+    return visual.ElementArrayStim(win,
+        units = 'deg',
+        nElements = len(coordinates),
+        xys = coordinates,
+        oris = oris,
+        sizes = (monitorunittools.pix2deg(lineWidth, mon), length),
+        sfs = 0,
+        elementTex = np.ones((4,4)),
+        elementMask = None,
+        colors = (1,1,1),
+        colorSpace = 'rgb')
+
+def capture_field(win, stim):
+    '''
+    Draws stim to back buffer and returns it as uint8 array of shape [height,width,3].
+    '''
+    win.clearBuffer()
+    stim.draw()
+    pixels = np.asarray(win._getRegionOfFrame(buffer = 'back'))
+    win.clearBuffer()
+    return pixels
+
+def texture_stim(win, pixels):
+    '''
+    Returns full-window ImageStim showing pixel array (as returned by capture_field).
+    '''
+    return visual.ImageStim(win,
+        image = Image.fromarray(np.ascontiguousarray(pixels)),
+        units = 'pix',
+        size = (pixels.shape[1], pixels.shape[0]),
+        interpolate = False)
+
+def compose_frame(win, aperture, center, periph):
+    '''
+    Draws center and periphery through the stencil (as Trial.fixation_phase does)
+    and returns the resulting frame as uint8 array of shape [height,width,3].
+    '''
+    win.clearBuffer()
+    aperture.enabled = True
+    aperture.inverted = False
+    center.draw()
+    aperture.inverted = True
+    periph.draw()
+    aperture.enabled = False
+    pixels = np.asarray(win._getRegionOfFrame(buffer = 'back'))
+    win.clearBuffer()
+    return pixels
+
+def texture_set(win, store, conditions, aperture = None, pixPerDeg = None):
+    '''
+    Returns drawable textures of store: center and periphery per condition (uploaded when first drawn),
+    center views composited through aperture (if given) and periphery patches (if pixPerDeg is given).
+    Composited frames are added to the store as 'frame_<condition>' (sharing tiles with center and periphery),
+    and are only uploaded for the trial that draws them (see Trial.select_textures).
+    Full-window textures that are not drawn in trials are released after compositing.
+    '''
+    center = texturestore.LazyTexture(win, store, 'center', texture_stim)
+    periph = {name: texturestore.LazyTexture(win, store, 'periph_' + name, texture_stim) for name in conditions}
+    frames = {}
+    if aperture is not None:
+        for name in conditions:
+            store.add('frame_' + name, compose_frame(win, aperture, center, periph[name]))
+            frames[name] = texturestore.LazyTexture(win, store, 'frame_' + name, texture_stim)
+        center.release() #center view is drawn from frames
+    if aperture is None or pixPerDeg is None: #drawn every frame or through sampling aperture
+        for texture in [center] + list(periph.values()):
+            texture.load()
+    else:
+        for texture in periph.values():
+            texture.release()
+    patchRenderer = None
+    if pixPerDeg is not None:
+        patchRenderer = patches.PatchRenderer(win, store, {name: 'periph_' + name for name in conditions}, pixPerDeg)
+    return {'center': center, 'periph': periph, 'frames': frames, 'patches': patchRenderer}
+
+def texture_memory(store, textures):
+    '''
+    Returns resident texture memory (bytes) per texture of store: CPU-side store ('own' and 'shared' tiles),
+    uploaded full-window texture ('gpu') and size of uncompressed RGB array ('full').
+    '''
+    report = store.memory()
+    for name, stats in report.items():
+        if name.startswith('periph_'):
+            texture = textures['periph'][name[len('periph_'):]]
+        elif name.startswith('frame_'):
+            texture = textures['frames'][name[len('frame_'):]]
+        else:
+            texture = textures['center']
+        stats['gpu'] = texture.resident_bytes()
+    return report
+
+def render_textures(win, mon, params):
+    '''
+    Renders center and periphery fields with orientations drawn from params['seed'].
+    Returns dict of pixel arrays with keys 'center' and 'periph_<condition>'.
+    '''
+    coordinates = linefield.field_coordinates(params)
+    rng = np.random.default_rng(params['seed'])
+    inCenter = linefield.rect_contains(coordinates, params['centerSize'])
+    oris = linefield.orientations(len(coordinates), params['stds'], params['mean'], rng)
+    
+    textures = {}
+    centerLines = line_field(win, mon, coordinates[inCenter], 
+        np.full(inCenter.sum(), float(params['mean'])), params['length'], params['lineWidth'])
+    textures['center'] = capture_field(win, centerLines)
+    for name in params['stds']:
+        periphLines = line_field(win, mon, coordinates[~inCenter], 
+            oris[name][~inCenter], params['length'], params['lineWidth'])
+        textures['periph_' + name] = capture_field(win, periphLines)
+    return textures
 
 def prepare_materials(self):
     '''
     Pre-loads stimuli and materials for experiment session.
     Connects to eyetracker and runs set-up procedure.
+    Tracker connection, sounds and CPU-side textures are prepared in the background while stimuli are built,
+    timing per stage is stored in startup file.
+    '''
+    self.startup = startup.Startup()
+    self.prepare_stimuli()
+    self.prepare_devices()
+    self.startup.finish(self.startupfilename)
+
+def prepare_stimuli(self):
+    '''
+    Opens window and loads stimuli and sounds (shared by sessions that use the same window).
+    Starts tracker connection in the background as soon as the window is open.
     '''
-    
     print('Loading stimuli...')
     self.mon = monitors.Monitor('samplingExperiment')
-    self.win = visual.Window(
-        color = (-1, -1, -1),
-        colorSpace = 'rgb', 
-        fullscr = True, 
-        units='pix', 
-        allowStencil = True, 
-        allowGUI = True,
-        useRetina = True,
-        monitor = self.mon)
+    self.win = self.startup.run('window', self.open_window)
     self.win.mouseVisible = False
+    self.startup.show(self.win)
+    
+    self.startup.start('tracker', self.connect_tracker)
+    self.startup.start('sounds', self.load_sounds)
+    params = linefield.stimulus_params(
+        self.mon.getWidth(), self.mon.getDistance(), self.win.size, 
+        stds = self.periphStds, 
+        seed = self.seed, 
+        renderer = self.renderer,
+        centerSize = (25.3, 13.3))
+    self.stimulusParams = params
+    self.startup.start('textures', self.load_textures, params)
     
-    prefs.hardware['audioLib'] = ['PTB', 'sounddevice', 'pyo', 'pygame']
-    loading = visual.TextStim(
-        self.win, 
-        text = 'Loading Stimuli...', 
-        units = 'norm')
-    loading.draw()
-    self.win.flip()
+    self.startup.run('stimuli', self.create_stimuli)
     
+    textures = self.startup.result('textures')
+    if textures is None:
+        textures = self.startup.run('render', render_textures, self.win, self.mon, params)
+        self.textureCache.store(params, textures)
+    self.startup.run('upload', self.upload_textures, textures)
+    self.startup.result('sounds')
+
+def load_textures(self, params):
+    '''
+    Returns cached textures (memory-mapped, copied into tiles by upload_textures)
+    or, with renderer 'numpy', renders and caches them.
+    Returns None if textures have to be rendered with OpenGL. Does not need the window.
+    '''
+    textures = self.textureCache.load(params)
+    if textures is not None:
+        print('Loaded cached stimuli')
+        return textures
+    if self.renderer == 'numpy':
+        textures = rasterizer.render_textures(params)
+        self.textureCache.store(params, textures)
+        return textures
+    return None
+
+def create_stimuli(self):
     self.fixationDot = visual.Circle(
             self.win, 
             units = 'deg', 
@@ -42,17 +204,6 @@ def prepare_materials(self):
     self.gazeDot = visual.GratingStim(self.win, tex=None, mask='gauss', pos=(0, 0),
                               size=(1,1), color='green', colorSpace='named', units='deg')
     
-    width = monitorunittools.cm2deg(self.mon.getWidth(), self.mon)
-    
-    nStepsHor = math.ceil(width/.87) #Field size divided by step size (in visual angles)
-    stepsHor = np.linspace(-width/2,width/2,nStepsHor)
-    
-    height = width * 9/16 #assume aspect ratio 16:9
-    nStepsVert = math.ceil(height/.87)
-    stepsVert = np.linspace(-height/2,height/2,nStepsVert)
-    
-    coordinates = np.asarray([(x,y) for x in stepsHor for y in stepsVert]) #stores coordinates in array of shape [N,2]
-
     self.centerRect = visual.Rect(self.win, 
         size = (25.3, 13.3), 
         units = 'deg', 
@@ -63,42 +214,9 @@ def prepare_materials(self):
         units = 'deg', 
         pos = (0,0)
         )
-
-    orisSmallStd = np.random.normal(loc = 45, scale = 5, size = len(coordinates))
-    orisLargeStd = np.random.normal(loc = 45, scale = 10, size = len(coordinates))
-    
-    centerLines = []
-    periphLinesZeroStd = []
-    periphLinesSmallStd = []
-    periphLinesLargeStd = []
-    
-    for i in range(len(coordinates)):
-        if self.centerRect.contains(x = coordinates[i][0], y = coordinates[i][1], units = 'deg'):
-            centerLines.append(visual.Line(self.win, 
-                lineWidth = 1, start = (0,-.41), end= (0,.41), 
-                units = 'deg', ori = 45, pos = coordinates[i], 
-                lineColor = (1,1,1), colorSpace = 'rgb'))
-        else:
-            periphLinesZeroStd.append(visual.Line(self.win, 
-                lineWidth = 1, start = (0,-.41), end= (0,.41), 
-                units = 'deg', ori = 45, pos = coordinates[i], 
-                lineColor = (1,1,1), colorSpace = 'rgb')) 
-            periphLinesSmallStd.append(visual.Line(self.win, 
-                lineWidth = 1, start = (0,-.41), end= (0,.41), 
-                units = 'deg', ori = orisSmallStd[i], pos = coordinates[i], 
-                lineColor = (1,1,1), colorSpace = 'rgb')) 
-            periphLinesLargeStd.append(visual.Line(self.win, 
-                lineWidth = 1, start = (0,-.41), end= (0,.41), 
-                units = 'deg', ori = orisLargeStd[i], pos = coordinates[i], 
-                lineColor = (1,1,1), colorSpace = 'rgb')) 
-    centralPatch = (-12.65,6.65,12.65,-6.65)
-    
-    self.center = visual.BufferImageStim(self.win, 
-        stim = centerLines) 
-    self.periph = {}
-    self.periph['none'] = visual.BufferImageStim(self.win, stim = periphLinesZeroStd)
-    self.periph['small'] = visual.BufferImageStim(self.win, stim = periphLinesSmallStd)
-    self.periph['large'] = visual.BufferImageStim(self.win, stim = periphLinesLargeStd)
+    self.centerROI = gaze.RectROI(self.centerRect.size)
+    self.fixationROI = gaze.RectROI(self.fixationArea.size)
+    self.gazeTransform = gaze.GazeTransform(self.mon)
     
     centralCorners = [(-12.2,-7),(-12.2,7),(12.2,7),(12.2,-7)]
     self.aperture = visual.Aperture(
@@ -111,6 +229,7 @@ def prepare_materials(self):
             size = 5.5,
             units = 'deg')
     self.samplingAperture.enabled = False
+    
     self.ratingText = visual.TextStim(self.win, units = 'norm', pos = (0, .6),
                     color = '#ffffff',
                     text = '''
@@ -119,16 +238,75 @@ How similar were center and periphery at the END of the trial?
 1: not at all
 4: completely
 ''')
+
+def upload_textures(self, textures):
+    '''
+    Keeps textures in compact store and uploads what is drawn in trials:
+    combined center+periphery frame per condition (if composite, uploaded per trial), so center view is a single draw,
+    and periphery patches of exploration phase cut from the store instead of drawn through stencil (if samplingPatches).
+    '''
+    self.textureStore = texturestore.TextureStore()
+    for name, pixels in textures.items():
+        self.textureStore.add(name, pixels)
+    textureSet = texture_set(self.win, self.textureStore, self.periphStds,
+        self.aperture if self.composite else None,
+        monitorunittools.deg2pix(1, self.mon) if self.samplingPatches else None)
+    self.center = textureSet['center']
+    self.periph = textureSet['periph']
+    self.frames = textureSet['frames']
+    self.patches = textureSet['patches']
     
-    
-    print('Using %s (with %s) for sounds' % (sound.audioLib, sound.audioDriver))
-    self.soundLow = sound.Sound('A', octave=2, sampleRate=44100, secs=0.8, stereo=True)
-    self.soundHigh = sound.Sound('A', octave=3, sampleRate=44100, secs=0.8, stereo=True)
-    
+    print('Texture memory (MB):')
+    for name, stats in texture_memory(self.textureStore, textureSet).items():
+        print('%-14s store %7.2f (+%.2f shared), gpu %7.2f, uncompressed %7.2f' % (name,
+            stats['own'] / 1e6, stats['shared'] / 1e6, stats['gpu'] / 1e6, stats['full'] / 1e6))
+    print('Texture store total: %.2f MB' % (self.textureStore.total_bytes() / 1e6))
+
+def prepare_devices(self):
+    '''
+    Sets up per-session parts: frame profiling, texture prefetch, eyetracker and message channel.
+    '''
+    self.profiler = frametiming.FrameProfiler(self.win, self.framesfilename)
+    self.scheduler = scheduler.FrameScheduler(self.profiler.refresh) if self.lateLatching else None
+    self.prefetcher = None
+    if self.prefetch:
+        self.prefetcher = prefetch.TexturePrefetcher(self.win, self.aperture if self.composite else None,
+            monitorunittools.deg2pix(1, self.mon) if self.samplingPatches else None)
+    tracker = self.startup.result('tracker', self.connect_tracker)
+    if not self.simulate:
+        self.startup.run('setup', tracker.runSetupProcedure) #needs window, after stimuli are built
+    self.tracker = messages.SharedTracker(tracker) #also used by message channel thread
+    #with acquisition process, messages do not share the connection with polling and are sent right away
+    self.messages = messages.MessageChannel(self.tracker, self.msgfilename,
+        None if self.acquisition else self.profiler.flipping)
+    self.events = events.EventDispatcher(self.tracker)
+
+def open_window(self):
+    return visual.Window(
+        color = (-1, -1, -1),
+        colorSpace = 'rgb', 
+        fullscr = True, 
+        units='pix', 
+        allowStencil = True, 
+        allowGUI = True,
+        useRetina = True,
+        monitor = self.mon)
+
+def load_sounds(self):
+    '''
+    Pre-loads phase cues, played by cue engine (see cues.py).
+    '''
+    self.cues = cues.CueEngine(cues.SoundSink(cues.tones()))
+
+def connect_tracker(self):
+    '''
+    Connects to eyetracker (mouse simulation if self.simulate) and returns tracker device.
+    With self.acquisition (mouse simulator only), the tracker is connected in a separate acquisition process
+    (see acquisition.py).
+    Set-up procedure is run by prepare_devices.
+    '''
     if self.simulate:
         iohub_config = {'eyetracker.hw.mouse.EyeTracker': {'name':'tracker'}}
-        self.io = launchHubServer(window = self.win, **iohub_config)
-        self.tracker = self.io.devices.tracker
     else:
         iohub_config = {
             'eyetracker.hw.sr_research.eyelink.EyeTracker':{
@@ -146,6 +324,9 @@ How similar were center and periphery at the END of the trial?
                     }
                 }
             }
-        self.io = launchHubServer(window = self.win, **iohub_config)
-        self.tracker = self.io.devices.tracker
-        self.tracker.runSetupProcedure()
+    if self.acquisition: #iohub is launched without window, display is passed as config
+        iohub_config['Display'] = acquisition.display_config(self.win)
+        self.io = acquisition.RemoteTracker(acquisition.connect_iohub, (iohub_config,))
+        return self.io
+    self.io = launchHubServer(window = self.win, **iohub_config)
+    return self.io.devices.tracker
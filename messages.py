@@ -0,0 +1,122 @@
+import csv
+import queue
+import threading
+from psychopy import core
+
+class SharedTracker:
+    '''
+    Wraps tracker so that calls from several threads are serialized
+    (the iohub client sends a request and waits for its reply on one socket).
+    Methods the tracker lists in lockFree do not use its connection (e.g. reads from the shared buffer
+    of acquisition.RemoteTracker) and are called without the lock, so per-frame polling never waits for messages.
+    '''
+    def __init__(self, tracker):
+        self._tracker = tracker
+        self.lock = threading.RLock()
+        self.lockFree = set(getattr(tracker, 'lockFree', ()))
+
+    def __getattr__(self, name):
+        attr = getattr(self._tracker, name)
+        if not callable(attr):
+            return attr
+        if name in self.lockFree:
+            setattr(self, name, attr)
+            return attr
+        lock = self.lock
+        def call(*args, **kwargs):
+            with lock:
+                return attr(*args, **kwargs)
+        setattr(self, name, call) #later lookups do not go through __getattr__
+        return call
+
+class MessageChannel:
+    '''
+    Sends messages to the tracker (EDF file) from a worker thread.
+    send() only puts the message on a queue, so phase transitions do not wait for the tracker.
+    Messages are sent in order, in batches of everything queued so far,
+    and mirrored to a local csv file (call time, send time, message) for cross-checking against the EDF.
+    They are sent with a time offset, so their timestamps in the EDF file are the times of the events,
+    not the (later) send times.
+    If idle (threading.Event, set while the main thread waits for a flip) is given, each message is sent
+    while the main thread is idle (or after maxWait s), so per-frame tracker polling rarely waits for a message.
+    '''
+    def __init__(self, tracker, mirrorFilename, idle = None, maxWait = .05):
+        self.tracker = tracker
+        self.mirrorFilename = mirrorFilename
+        self.idle = idle
+        self.maxWait = maxWait
+        self.queue = queue.SimpleQueue()
+        self.sent = 0
+        self.mirrorError = None #error of mirror file, raised by close()
+        self.thread = threading.Thread(target = self.run, name = 'MessageChannel', daemon = True)
+        self.thread.start()
+
+    def send(self, msg, t):
+        '''
+        Queues message. t is the time of the event (core.monotonicClock) at the call site.
+        '''
+        self.queue.put((t, msg))
+
+    def run(self):
+        writer, f = self.open_mirror()
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            rows = []
+            for item in batch:
+                if item is None:
+                    stop = True
+                    break
+                t, msg = item
+                if self.idle is not None:
+                    self.idle.wait(self.maxWait)
+                sent = core.monotonicClock.getTime()
+                try:
+                    #EDF timestamp is moved back to the call site (offset in ms, as in EyeLink MSG lines)
+                    self.tracker.sendMessage(msg, time_offset = int(round((sent - t) * 1000)))
+                except Exception as e:
+                    print('WARNING: Could not send message to tracker:', msg, e)
+                rows.append([t, sent, msg])
+                self.sent += 1
+            if writer is not None:
+                try:
+                    writer.writerows(rows)
+                    f.flush()
+                except OSError as e: #messages still go to tracker, mirror stops
+                    self.mirrorError = e
+                    writer = None
+        if f is not None:
+            try:
+                f.close()
+            except OSError as e:
+                self.mirrorError = self.mirrorError or e
+
+    def open_mirror(self):
+        '''
+        Returns csv writer and file of mirror, (None, None) if it cannot be written (error is kept).
+        '''
+        try:
+            f = open(self.mirrorFilename, 'a', newline = '')
+            writer = csv.writer(f)
+            writer.writerow(['time', 'sent', 'message'])
+            return writer, f
+        except OSError as e:
+            self.mirrorError = e
+            return None, None
+
+    def close(self, timeout = 5):
+        '''
+        Sends remaining messages and stops thread.
+        Raises error of mirror file, if it could not be written (messages were still sent to tracker).
+        '''
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+        if self.mirrorError is not None:
+            error, self.mirrorError = self.mirrorError, None
+            raise error
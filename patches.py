@@ -0,0 +1,91 @@
+import math
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from psychopy import visual
+
+class PatchRenderer:
+    '''
+    Draws circular patches of periphery textures around a position, instead of drawing the full-window texture
+    through the sampling aperture (stencil). Patches are cut from the CPU-side texture store (see texturestore.py).
+    Positions are snapped to a grid of cellSize (deg), so the patch center is up to cellSize/2 per axis
+    (.125 deg by default) away from the position the aperture would be centered on. Patches are aligned
+    to the pixel grid of the full texture, so they show exactly the pixels the stencil would show at the snapped position.
+    One ImageStim per condition is built up front; when a patch of another grid cell is shown,
+    only its image and position are updated. Cut patches are cached per texture and grid cell
+    (at most maxCells, least recently used are dropped).
+    '''
+    def __init__(self, win, store, names, pixPerDeg, size = 5.5, cellSize = .25, maxCells = 64):
+        self.win = win
+        self.store = store
+        self.names = names #condition -> name of full-window texture in store
+        self.pixPerDeg = pixPerDeg
+        self.size = int(round(size * pixPerDeg)) #patch diameter (pix)
+        self.cellSize = max(1, int(round(cellSize * pixPerDeg))) #grid cell (pix)
+        self.texRes = 2**math.ceil(math.log2(self.size)) #resolution of circular mask
+        self.maxCells = maxCells
+        self.cache = OrderedDict() #(name, cell) -> (patch image, position)
+        self.stims = {name: self.create_stim() for name in names}
+        self.shown = {} #condition -> grid cell currently set on its ImageStim
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+
+    def create_stim(self):
+        return visual.ImageStim(self.win,
+            image = Image.new('RGB', (self.size, self.size)),
+            units = 'pix',
+            size = (self.size, self.size),
+            mask = 'circle',
+            texRes = self.texRes,
+            interpolate = False)
+
+    def cell(self, posDeg):
+        return tuple(np.round(np.asarray(posDeg, dtype = float) * self.pixPerDeg / self.cellSize).astype(int))
+
+    def crop(self, name, cell):
+        '''
+        Returns patch pixels of condition around grid cell and its position (pix) in window.
+        Parts outside the texture are black.
+        '''
+        height, width = self.store.shapes[self.names[name]][:2]
+        x, y = cell[0] * self.cellSize, cell[1] * self.cellSize
+        #first column and row of patch in texture (row 0 is top of window)
+        c0 = int(round(width/2 + x - self.size/2))
+        r0 = int(round(height/2 - y - self.size/2))
+        patch = self.store.region(self.names[name], r0, c0, self.size, self.size)
+        pos = (-width/2 + c0 + self.size/2, height/2 - r0 - self.size/2)
+        return patch, pos
+
+    def patch(self, name, posDeg):
+        '''
+        Returns ImageStim of condition name showing patch around position (deg).
+        '''
+        stim = self.stims[name]
+        cell = self.cell(posDeg)
+        if self.shown.get(name) == cell:
+            return stim
+        key = (name, cell)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+        else:
+            self.misses += 1
+            pixels, pos = self.crop(name, cell)
+            cached = self.cache[key] = (Image.fromarray(np.ascontiguousarray(pixels)), pos)
+            while len(self.cache) > self.maxCells:
+                self.cache.popitem(last = False)
+        stim.image, stim.pos = cached
+        self.shown[name] = cell
+        self.updates += 1
+        return stim
+
+    def draw(self, name, posDeg):
+        self.patch(name, posDeg).draw()
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'updates': self.updates, 'cached': len(self.cache)}
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+from concurrent import futures
+import rasterizer
+import texturestore
+
+def render_store(params):
+    '''
+    Renders textures (in worker process) and returns them as compact texture store.
+    '''
+    store = texturestore.TextureStore()
+    for name, pixels in rasterizer.render_textures(params).items():
+        store.add(name, pixels)
+    return store
+
+class TexturePrefetcher:
+    '''
+    Renders freshly randomized textures for upcoming trials in a worker process (NumPy rasterizer),
+    while the current trial waits for input.
+    Textures are packed into a compact texture store in the worker, so only the store is sent back.
+    Finished textures are uploaded (as ImageStims) by poll(), which is called from the main thread.
+    At most maxPending requests are rendered at a time and at most maxReady uploaded sets are kept,
+    so memory stays bounded. get() returns None if textures are not ready by the deadline
+    (trial then uses the shared textures of the session, which are rasterized as well when prefetch is on,
+    so line rendering does not depend on whether prefetch finished in time).
+    '''
+    def __init__(self, win, aperture = None, pixPerDeg = None, timeout = .05, maxPending = 1, maxReady = 2):
+        self.win = win
+        self.pixPerDeg = pixPerDeg #if given, periphery patches are cut from store (see patches.py)
+        self.timeout = timeout #time get() waits for pending request (s), None: until rendered
+        self.aperture = aperture #if given, center views are composited into single frame
+        self.maxPending = maxPending
+        self.maxReady = maxReady
+        self.executor = futures.ProcessPoolExecutor(max_workers = 1)
+        self.pending = OrderedDict() #key -> (params, future)
+        self.ready = OrderedDict() #key -> textures
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    def request(self, key, params):
+        '''
+        Starts rendering textures for params (renderer 'numpy'). Returns False if buffer is full.
+        '''
+        if key in self.pending or key in self.ready:
+            return True
+        if len(self.pending) >= self.maxPending:
+            self.skipped += 1
+            return False
+        self.pending[key] = (params, self.executor.submit(render_store, params))
+        return True
+
+    def poll(self):
+        '''
+        Uploads finished textures. Must be called from the thread that owns the window.
+        '''
+        for key, (params, future) in list(self.pending.items()):
+            if not future.done():
+                continue
+            del self.pending[key]
+            try:
+                store = future.result()
+            except Exception as e:
+                print('WARNING: Could not prefetch textures:', e)
+                continue
+            self.ready[key] = self.prepare(params, store)
+            while len(self.ready) > self.maxReady:
+                self.ready.popitem(last = False) #drops oldest
+
+    def prepare(self, params, store):
+        import materials #not at module level: materials imports this module
+        textures = materials.texture_set(self.win, store, params['stds'], self.aperture, self.pixPerDeg)
+        textures['seed'] = params['seed']
+        return textures
+
+    def get(self, key, timeout = None):
+        '''
+        Returns textures (dict with seed, center, periph, frames and patches) for key,
+        waiting at most timeout (s, default self.timeout, None: until rendered) for pending request.
+        Returns None if deadline is missed.
+        '''
+        if timeout is None:
+            timeout = self.timeout
+        if key in self.pending and (timeout is None or timeout > 0):
+            futures.wait([self.pending[key][1]], timeout = timeout)
+        self.poll()
+        if key in self.ready:
+            self.hits += 1
+            return self.ready.pop(key)
+        self.misses += 1
+        if key in self.pending:
+            _, future = self.pending.pop(key)
+            future.cancel() #result is discarded if rendering already started
+        return None
+
+    def close(self):
+        self.executor.shutdown(wait = False, cancel_futures = True)
+        self.pending.clear()
+        self.ready.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'skipped': self.skipped}
@@ -0,0 +1,102 @@
+import argparse
+import math
+import multiprocessing
+import os
+import numpy as np
+import linefield
+import texturecache
+
+def rasterize(coordinates, oris, size, pixPerDeg, length = .82, lineWidth = 1, chunkSize = 2048):
+    '''
+    Draws anti-aliased white lines on black background without OpenGL.
+    Coordinates (shape [N,2]) and length in degrees, orientations in degrees clockwise from vertical
+    (as visual.Line with start (0,-length/2) and end (0,length/2)), lineWidth and size in pixels.
+    Returns uint8 RGBA array of shape [height,width,4].
+    '''
+    width, height = size
+    coverage = np.zeros((height, width), dtype = np.float32)
+    halfLength = length/2 * pixPerDeg
+    halfWidth = lineWidth/2
+    radius = math.ceil(max(halfLength, halfWidth) + 1)
+    offsets = np.arange(-radius, radius + 1)
+
+    coordinates = np.asarray(coordinates, dtype = float)
+    oris = np.broadcast_to(np.asarray(oris, dtype = float), (len(coordinates),))
+    for i in range(0, len(coordinates), chunkSize): #chunks keep memory bounded for dense fields
+        centerX = width/2 + coordinates[i:i+chunkSize, 0] * pixPerDeg #image coordinates, y points down
+        centerY = height/2 - coordinates[i:i+chunkSize, 1] * pixPerDeg
+        theta = np.radians(oris[i:i+chunkSize])
+        dirX, dirY = np.sin(theta), -np.cos(theta)
+
+        #pixel indices and pixel center offsets of square patch around every line, shape [n,P]
+        colIdx = np.floor(centerX).astype(int)[:,None] + offsets
+        rowIdx = np.floor(centerY).astype(int)[:,None] + offsets
+        dx = colIdx + .5 - centerX[:,None]
+        dy = rowIdx + .5 - centerY[:,None]
+
+        #distance along and across line for every pixel, shape [n,P,P] (rows, columns)
+        along = dx[:,None,:] * dirX[:,None,None] + dy[:,:,None] * dirY[:,None,None]
+        across = dy[:,:,None] * dirX[:,None,None] - dx[:,None,:] * dirY[:,None,None]
+        patch = (np.clip(halfWidth + .5 - np.abs(across), 0, 1) *
+            np.clip(halfLength + .5 - np.abs(along), 0, 1)).astype(np.float32)
+
+        rows = np.broadcast_to(rowIdx[:,:,None], patch.shape)
+        cols = np.broadcast_to(colIdx[:,None,:], patch.shape)
+        valid = (patch > 0) & (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        np.maximum.at(coverage, (rows[valid], cols[valid]), patch[valid])
+
+    pixels = np.empty((height, width, 4), dtype = np.uint8)
+    pixels[..., :3] = np.round(coverage * 255)[..., None]
+    pixels[..., 3] = 255
+    return pixels
+
+def render_textures(params):
+    '''
+    Same as materials.render_textures, but rasterized with NumPy (no window needed).
+    Returns dict of RGBA arrays with keys 'center' and 'periph_<condition>'.
+    '''
+    coordinates = linefield.field_coordinates(params)
+    rng = np.random.default_rng(params['seed'])
+    inCenter = linefield.rect_contains(coordinates, params['centerSize'])
+    oris = linefield.orientations(len(coordinates), params['stds'], params['mean'], rng)
+
+    size = params['monitor']['size']
+    pixPerDeg = linefield.pix_per_deg(params)
+    textures = {}
+    textures['center'] = rasterize(coordinates[inCenter], params['mean'], size, pixPerDeg,
+        params['length'], params['lineWidth'])
+    for name in params['stds']:
+        textures['periph_' + name] = rasterize(coordinates[~inCenter], oris[name][~inCenter],
+            size, pixPerDeg, params['length'], params['lineWidth'])
+    return textures
+
+def _build(args):
+    directory, params = args
+    cache = texturecache.TextureCache(directory)
+    if cache.load(params) is None:
+        cache.store(params, render_textures(params))
+    return params['seed']
+
+def build_library(directory, paramsList, processes = None):
+    '''
+    Renders textures for all params (with renderer 'numpy') into texture cache directory,
+    spread across process pool. Already cached entries are skipped.
+    '''
+    os.makedirs(directory, exist_ok = True)
+    with multiprocessing.Pool(processes) as pool:
+        for seed in pool.imap_unordered(_build, [(directory, params) for params in paramsList]):
+            print('Rendered stimuli for seed', seed)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Pre-builds stimulus library on CPU-only machines.')
+    parser.add_argument('--width', type = float, required = True, help = 'monitor width (cm)')
+    parser.add_argument('--distance', type = float, required = True, help = 'viewing distance (cm)')
+    parser.add_argument('--size', type = int, nargs = 2, required = True, help = 'window size (pixels)')
+    parser.add_argument('--seeds', type = int, nargs = '+', required = True)
+    parser.add_argument('--processes', type = int, default = None)
+    parser.add_argument('--cache', default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Cache'))
+    args = parser.parse_args()
+
+    paramsList = [linefield.stimulus_params(args.width, args.distance, args.size,
+        seed = seed, renderer = 'numpy') for seed in args.seeds]
+    build_library(args.cache, paramsList, args.processes)
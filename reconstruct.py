@@ -0,0 +1,241 @@
+import argparse
+import json
+import multiprocessing
+import os
+import zipfile
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import linefield
+import rasterizer
+import recorder
+import saccades
+import texturecache
+
+contentCodes = {'blank': 0, 'center': 1, 'patch': 2, 'dot': 3}
+phaseCodes = dict(recorder.phaseCodes, fixation_dot = 0)
+#geometry of stimuli in degrees, as in materials.create_stimuli
+apertureHalfSize = (12.2, 7) #central aperture of center view
+centerHalfSize = (25.3/2, 13.3/2) #centerROI, gaze outside shows periphery patch
+patchRadius = 5.5/2 #samplingAperture
+dotRadius = .5
+blankAmplitude = 1 #screen is blank during saccades once gaze moved this far from onset (as Trial.blank)
+
+_textures = OrderedDict() #textures of worker process, most recently used last
+
+def read_attempts(msgfilename):
+    '''
+    Returns trial attempts in order of recording (recording numbers count from 1, as in GazeRecorder),
+    each with texture seed and phase windows (phase, start, end) in message times (core.monotonicClock).
+    '''
+    messages = pd.read_csv(msgfilename)
+    attempts, seed, started = [], None, {}
+    for t, msg in zip(messages['time'], messages['message']):
+        parts = [part.strip() for part in str(msg).split(';')]
+        if len(parts) != 3: #block messages of session
+            continue
+        _, phase, txt = parts
+        if phase == 'textures':
+            seed = int(txt.split()[1])
+        elif txt == 'start_phase':
+            if phase == 'fixation_dot': #every attempt starts with fixation dot
+                attempts.append({'recording': len(attempts) + 1, 'seed': seed, 'phases': []})
+            started[phase] = float(t)
+        elif txt == 'end_phase' and phase in started and attempts:
+            attempts[-1]['phases'].append((phase, started.pop(phase), float(t)))
+    return attempts
+
+def texture_params(settings, seed, periphType):
+    '''
+    Returns params of textures shown in trial: shared textures of session, or prefetched ones (Trial.texture_params).
+    '''
+    params = settings['stimulus']
+    if seed is None or seed == params['seed']:
+        return params
+    stds = {name: params['stds'][name] for name in ('none', periphType)}
+    return dict(params, renderer = 'numpy', stds = stds, seed = seed)
+
+def load_textures(params, cacheDir, maxTextures = 2):
+    '''
+    Returns grey textures of params from texture cache, or rendered with NumPy rasterizer.
+    Kept per worker process for following recordings with the same textures.
+    '''
+    key = json.dumps(params, sort_keys = True)
+    if key in _textures:
+        _textures.move_to_end(key)
+        return _textures[key]
+    textures = texturecache.TextureCache(cacheDir).load(params) if cacheDir else None
+    if textures is None:
+        textures = rasterizer.render_textures(dict(params, renderer = 'numpy'))
+    _textures[key] = {name: np.array(texture[..., 0]) for name, texture in textures.items()}
+    while len(_textures) > maxTextures:
+        _textures.popitem(last = False)
+    return _textures[key]
+
+def downscale(image, factor):
+    '''
+    Returns image averaged over blocks of factor x factor pixels.
+    '''
+    if factor == 1:
+        return image
+    height, width = image.shape[0] // factor * factor, image.shape[1] // factor * factor
+    blocks = image[:height, :width].reshape(height // factor, factor, width // factor, factor)
+    return np.round(blocks.mean(axis = (1, 3))).astype(np.uint8)
+
+def frame_plan(phases, sampleTimes, posDeg, refresh, offset, pixPerDeg, patchCell = None):
+    '''
+    Returns per frame of fixation dot, fixation and exploration phases: flip time (tracker clock), phase code,
+    content code, gaze position used for the frame and position of periphery patch (deg).
+    Frames are flipped at every refresh after the start of the phase, and drawn with the last gaze sample
+    of the previous refresh. Exploration frames follow Trial.exploration_frame: blank during saccades
+    (detected offline) once gaze moved more than blankAmplitude and while gaze is missing, center view while gaze is in centerROI,
+    else patch at the gaze position of the first frame outside the center (snapped to patchCell pixels).
+    '''
+    windows = [(phase, start, end) for phase, start, end in phases if phase in phaseCodes]
+    nFrames = [max(0, int(round((end - start) / refresh))) for _, start, end in windows]
+    times = np.concatenate([start + offset + (np.arange(n) + 1) * refresh for (_, start, _), n in zip(windows, nFrames)]
+        + [np.zeros(0)])
+    phase = np.repeat([phaseCodes[phase] for phase, _, _ in windows], nFrames).astype(np.uint8)
+
+    i = np.searchsorted(sampleTimes, times - refresh, side = 'right') - 1
+    gaze = np.where((i >= 0)[:,None], posDeg[np.maximum(i, 0)], np.nan) if len(sampleTimes) else np.full((len(times), 2), np.nan)
+    content = np.full(len(times), contentCodes['center'], dtype = np.uint8)
+    content[phase == phaseCodes['fixation_dot']] = contentCodes['dot']
+    patchPos = np.full((len(times), 2), np.nan)
+
+    exploring = np.flatnonzero(phase == phaseCodes['exploration_phase'])
+    if len(exploring):
+        g, t = gaze[exploring], times[exploring] - refresh
+        detected = saccades.detect(sampleTimes, posDeg)
+        k = np.searchsorted(detected['onset'], t, side = 'right') - 1
+        ongoing = (k >= 0) & (t <= detected['offset'][np.maximum(k, 0)]) if len(detected['onset']) else np.zeros(len(t), bool)
+        onsetPos = posDeg[np.searchsorted(sampleTimes, detected['onset'])] if len(detected['onset']) else np.zeros((1, 2))
+        with np.errstate(invalid = 'ignore'):
+            blank = ongoing & (np.linalg.norm(g - onsetPos[np.maximum(k, 0)], axis = 1) > blankAmplitude)
+            blank |= np.isnan(g).any(axis = 1)
+            inCenter = np.all(np.abs(g) < centerHalfSize, axis = 1)
+        exploreContent = np.where(blank, contentCodes['blank'], np.where(inCenter, contentCodes['center'], contentCodes['patch']))
+        content[exploring] = exploreContent
+
+        #patch stays at landing position until gaze returns to center
+        excursion = np.cumsum(exploreContent == contentCodes['center'])
+        patch = np.flatnonzero(exploreContent == contentCodes['patch'])
+        groups, first = np.unique(excursion[patch], return_index = True)
+        landing = g[patch[first]]
+        if patchCell:
+            landing = np.round(landing * pixPerDeg / patchCell) * patchCell / pixPerDeg
+        patchPos[exploring[patch]] = landing[np.searchsorted(groups, excursion[patch])]
+    return {'time': times, 'phase': phase, 'content': content, 'gaze': gaze, 'patchPos': patchPos}
+
+def compose_images(textures, periphType, patchName, positions, size, pixPerDeg, factor):
+    '''
+    Returns stack of distinct images of recording at output resolution:
+    blank, center view, fixation dot, then one periphery patch per position.
+    '''
+    width, height = size
+    xs = ((np.arange(width // factor) + .5) * factor - width/2) / pixPerDeg
+    ys = (height/2 - (np.arange(height // factor) + .5) * factor) / pixPerDeg
+    x, y = xs[None,:], ys[:,None]
+    center = downscale(textures['center'], factor)
+    periph = downscale(textures['periph_' + periphType], factor)
+    patchSource = downscale(textures['periph_' + patchName], factor)
+    inAperture = (np.abs(x) < apertureHalfSize[0]) & (np.abs(y) < apertureHalfSize[1])
+    images = np.zeros((3 + len(positions),) + center.shape, dtype = np.uint8)
+    images[1] = np.where(inAperture, center, periph)
+    images[2] = np.where(x**2 + y**2 < dotRadius**2, 255, 0)
+    for i, (px, py) in enumerate(positions):
+        images[3 + i] = np.where((x - px)**2 + (y - py)**2 < patchRadius**2, patchSource, 0)
+    return images
+
+def write_array(zf, name, array):
+    with zf.open(name + '.npy', 'w', force_zip64 = True) as f:
+        np.lib.format.write_array(f, np.ascontiguousarray(array), allow_pickle = False)
+
+def write_video(filename, images, ids, fps, batchSize):
+    try:
+        import imageio
+    except ImportError:
+        print('WARNING: imageio is not installed, no video written:', filename)
+        return
+    with imageio.get_writer(filename, fps = fps, macro_block_size = 1) as writer:
+        for start in range(0, len(ids), batchSize):
+            for frame in images[ids[start:start + batchSize]]:
+                writer.append_data(frame)
+
+def reconstruct_recording(task):
+    '''
+    Reconstructs frames of one recording (trial attempt) and streams them into compressed npz file
+    (frames in batches of batchSize, plus per-frame time, phase, content, gaze and patchPos). Runs in worker process.
+    '''
+    attempt, info, config = task
+    settings = config['settings']
+    samples, index = recorder.load(config['gazefilename'])
+    trialSamples = recorder.trial_samples(samples, index, attempt['recording'])
+    sampleTimes = np.asarray(trialSamples['time'], dtype = float)
+    posDeg = np.column_stack((trialSamples['x'], trialSamples['y'])).astype(float)
+    params = texture_params(settings, attempt['seed'], info['periphType'])
+    pixPerDeg = linefield.pix_per_deg(params)
+
+    plan = frame_plan(attempt['phases'], sampleTimes, posDeg, settings['refresh'], settings['clockOffset'],
+        pixPerDeg, settings.get('patchCell'))
+    patch = plan['content'] == contentCodes['patch']
+    positions, patchIds = np.unique(plan['patchPos'][patch], axis = 0, return_inverse = True)
+    ids = np.array([0, 1, 0, 2])[plan['content']] #blank, center view, (patch), fixation dot
+    ids[patch] = 3 + patchIds.ravel()
+    patchName = 'none' if info['samplingType'] == 'invalid' else info['periphType']
+    images = compose_images(load_textures(params, config['cacheDir']), info['periphType'], patchName, positions,
+        params['monitor']['size'], pixPerDeg, config['downscale'])
+
+    filename = os.path.join(config['out'], 'recording%04d.npz' % attempt['recording'])
+    tmp = filename + '.tmp'
+    with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, array in plan.items():
+            write_array(zf, name, array)
+        for i, start in enumerate(range(0, len(ids), config['batchSize'])):
+            write_array(zf, 'frames_%05d' % i, images[ids[start:start + config['batchSize']]])
+    os.replace(tmp, filename)
+    if config['video']:
+        write_video(os.path.splitext(filename)[0] + '.mp4', images, ids, round(1 / settings['refresh']), config['batchSize'])
+    return filename, len(ids)
+
+def iter_frames(filename):
+    '''
+    Yields frames of reconstructed recording in batches (arrays of shape [n,height,width]).
+    '''
+    with np.load(filename) as f:
+        for name in sorted(name for name in f.files if name.startswith('frames_')):
+            yield f[name]
+
+def reconstruct_session(prefix, out, processes = None, downscale = 2, batchSize = 64, cacheDir = None, video = False):
+    '''
+    Reconstructs all recordings of session (files starting with prefix, e.g. Data/uniformity_<pp>_<date>)
+    from messages, gaze recordings and settings, across process pool. One output file per recording.
+    '''
+    with open(prefix + 'SETTINGS.json') as f:
+        settings = json.load(f)
+    gazefilename = prefix + 'GAZE.dat'
+    index = recorder.load_index(gazefilename)
+    infos = {recording: rows.iloc[0].to_dict() for recording, rows in index.groupby('recording')}
+    attempts = read_attempts(prefix + 'MSG.csv')
+    config = {'settings': settings, 'gazefilename': gazefilename, 'cacheDir': cacheDir, 'out': out,
+        'downscale': downscale, 'batchSize': batchSize, 'video': video}
+    tasks = [(attempt, infos[attempt['recording']], config) for attempt in attempts if attempt['recording'] in infos]
+    if len(tasks) < len(attempts):
+        print('WARNING: %d recordings without gaze samples are skipped' % (len(attempts) - len(tasks)))
+    os.makedirs(out, exist_ok = True)
+    with multiprocessing.Pool(processes) as pool:
+        for filename, nFrames in pool.imap_unordered(reconstruct_recording, tasks):
+            print('Reconstructed %d frames:' % nFrames, filename)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Reconstructs displayed frames of session from messages and gaze.')
+    parser.add_argument('prefix', help = 'session files without suffix, e.g. Data/uniformity_01_2022-05-01_10h00.00.000')
+    parser.add_argument('--out', required = True, help = 'folder for reconstructed recordings')
+    parser.add_argument('--processes', type = int, default = None)
+    parser.add_argument('--downscale', type = int, default = 2, help = 'output pixel = factor x factor screen pixels')
+    parser.add_argument('--batch', type = int, default = 64, help = 'frames per compressed batch')
+    parser.add_argument('--cache', default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Cache'))
+    parser.add_argument('--video', action = 'store_true', help = 'also write mp4 per recording (needs imageio)')
+    args = parser.parse_args()
+
+    reconstruct_session(args.prefix, args.out, args.processes, args.downscale, args.batch, args.cache, args.video)
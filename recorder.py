@@ -0,0 +1,133 @@
+import csv
+import os
+import numpy as np
+import pandas as pd
+
+sampleDtype = np.dtype([
+    ('time', 'f8'),  #tracker time (s)
+    ('x', 'f4'),     #gaze position (deg), NaN during blinks
+    ('y', 'f4'),
+    ('phase', 'u1')])
+phaseCodes = {'fixation_phase': 1, 'exploration_phase': 2}
+indexFields = ['recording', 'blockType', 'trialN', 'periphType', 'samplingType', 'phase', 'start', 'stop']
+outcomeFields = ['recording', 'aborted']
+
+class GazeRecorder:
+    '''
+    Records gaze samples of a trial into a preallocated structured buffer.
+    The buffer is appended to a binary session file at the end of the trial (or when full),
+    together with one index row per phase (sample range in file).
+    Whether a recording was aborted is only known at its end, it is stored in a separate outcome row per recording.
+    '''
+    def __init__(self, filename, capacity = 32768):
+        self.filename = filename
+        self.indexFilename = index_filename(filename)
+        self.outcomeFilename = outcome_filename(filename)
+        self.buffer = np.zeros(capacity, dtype = sampleDtype)
+        self.n = 0 #samples in buffer
+        self.recording = 0 #counts all recorded trials, including practice trials and repetitions
+        self.info = {}
+        self.offset = os.path.getsize(filename) // sampleDtype.itemsize if os.path.exists(filename) else 0
+
+    def start_trial(self, **info):
+        '''
+        Starts new recording. Info (blockType, trialN, periphType, samplingType) is stored in index.
+        '''
+        self.recording += 1
+        self.info = dict(info)
+        self.n = 0
+
+    def add(self, times, posDeg, phase):
+        '''
+        Copies samples (times of shape [N], positions of shape [N,2]) into buffer.
+        '''
+        start = 0
+        while start < len(times):
+            if self.n == len(self.buffer):
+                self.write()
+            stop = min(len(times), start + len(self.buffer) - self.n)
+            chunk = self.buffer[self.n:self.n + stop - start]
+            chunk['time'] = times[start:stop]
+            chunk['x'] = posDeg[start:stop, 0]
+            chunk['y'] = posDeg[start:stop, 1]
+            chunk['phase'] = phaseCodes[phase]
+            self.n += stop - start
+            start = stop
+
+    def flush(self, aborted = False):
+        '''
+        Writes remaining samples of trial to session file, and outcome of recording.
+        '''
+        self.write()
+        newFile = not os.path.exists(self.outcomeFilename)
+        with open(self.outcomeFilename, 'a', newline = '') as f:
+            writer = csv.DictWriter(f, fieldnames = outcomeFields)
+            if newFile:
+                writer.writeheader()
+            writer.writerow({'recording': self.recording, 'aborted': aborted})
+
+    def write(self):
+        if self.n == 0:
+            return
+        samples = self.buffer[:self.n]
+        with open(self.filename, 'ab') as f:
+            f.write(samples.tobytes())
+
+        #one index row per run of samples with same phase
+        phases = samples['phase']
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(phases)) + 1, [self.n]))
+        phaseNames = {code: name for name, code in phaseCodes.items()}
+        newFile = not os.path.exists(self.indexFilename)
+        with open(self.indexFilename, 'a', newline = '') as f:
+            writer = csv.DictWriter(f, fieldnames = indexFields, extrasaction = 'ignore')
+            if newFile:
+                writer.writeheader()
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                row = dict(self.info)
+                row.update(recording = self.recording, phase = phaseNames[phases[start]],
+                    start = self.offset + start, stop = self.offset + stop)
+                writer.writerow(row)
+        self.offset += self.n
+        self.n = 0
+
+def index_filename(filename):
+    return os.path.splitext(filename)[0] + '_index.csv'
+
+def outcome_filename(filename):
+    return os.path.splitext(filename)[0] + '_outcome.csv'
+
+def load_index(filename):
+    '''
+    Returns index (DataFrame) of session file, with outcome (aborted) of every recording.
+    Recordings without outcome (session ended during trial) count as aborted.
+    '''
+    index = pd.read_csv(index_filename(filename))
+    if not os.path.exists(outcome_filename(filename)):
+        if 'aborted' not in index: #sessions written before outcomes were stored separately have it in index
+            index['aborted'] = True
+        return index
+    outcome = pd.read_csv(outcome_filename(filename)).drop_duplicates('recording', keep = 'last')
+    index = index.drop(columns = 'aborted', errors = 'ignore').merge(outcome, on = 'recording', how = 'left')
+    index['aborted'] = index['aborted'].astype(object).fillna(True).astype(bool)
+    return index
+
+def load(filename):
+    '''
+    Returns memory-mapped samples and index (DataFrame, see load_index) of session file.
+    '''
+    index = load_index(filename)
+    if os.path.getsize(filename) == 0:
+        return np.zeros(0, dtype = sampleDtype), index
+    return np.memmap(filename, dtype = sampleDtype, mode = 'r'), index
+
+def trial_samples(samples, index, recording, phase = None):
+    '''
+    Returns samples of recording (optionally of one phase) as view into memory-mapped samples.
+    Samples of a recording are contiguous, because the session file is append-only.
+    '''
+    rows = index[index['recording'] == recording]
+    if phase is not None:
+        rows = rows[rows['phase'] == phase]
+    if len(rows) == 0:
+        return samples[:0]
+    return samples[rows['start'].min():rows['stop'].max()]
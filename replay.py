@@ -0,0 +1,301 @@
+import argparse
+import bisect
+import math
+import os
+from collections import deque, namedtuple
+import numpy as np
+import pandas as pd
+import headless #before psychopy
+from psychopy import core, clock, visual
+from psychopy.tools import monitorunittools
+from psychopy.iohub.constants import EventConstants
+import experiment
+import cues
+import recorder
+import saccades
+
+TrackerEvent = namedtuple('TrackerEvent', ['type', 'time', 'gaze_x', 'gaze_y'])
+
+class VirtualClock:
+    '''
+    Replaces psychopy's time source, so that time only advances when a frame is flipped
+    or when core.wait is called. Times are deterministic and runs take less than real time.
+    '''
+    def __init__(self):
+        self.t = 0.
+
+    def getTime(self):
+        return self.t
+
+    def wait(self, secs, hogCPUperiod = .2):
+        if secs > 0:
+            self.t += secs
+
+    def next_frame(self, refresh):
+        '''
+        Advances time to next vsync (multiple of refresh).
+        '''
+        self.t = (math.floor(self.t / refresh + 1e-6) + 1) * refresh
+
+    def install(self):
+        self.saved = [(module, name, getattr(module, name))
+            for module in (clock, core) for name in ('getTime', 'wait')]
+        for module, name, _ in self.saved:
+            setattr(module, name, getattr(self, name))
+        core.monotonicClock._timeAtLastReset = 0. #flip times and tracker times share virtual time base
+
+    def uninstall(self):
+        for module, name, function in self.saved:
+            setattr(module, name, function)
+
+def trace_events(times, posDeg, chunk = 8):
+    '''
+    Returns (available time, event) pairs of saccades and blinks in trace.
+    Saccades are found with the online detector (start events become available when onset is detected),
+    blinks are runs of missing samples.
+    '''
+    events = []
+    detector = saccades.SaccadeDetector()
+    for i in range(0, len(times), chunk):
+        for saccade in detector.push(times[i:i+chunk], posDeg[i:i+chunk]):
+            events.append((saccade.detected, TrackerEvent(EventConstants.SACCADE_START, saccade.onset, *saccade.start)))
+            events.append((saccade.offset, TrackerEvent(EventConstants.SACCADE_END, saccade.offset, *saccade.end)))
+    missing = np.isnan(posDeg).any(axis = 1).astype(int)
+    changes = np.flatnonzero(np.diff(np.concatenate(([0], missing, [0]))))
+    for start, stop in zip(changes[::2], changes[1::2]):
+        events.append((times[start], TrackerEvent(EventConstants.BLINK_START, times[start], np.nan, np.nan)))
+        if stop < len(times):
+            events.append((times[stop], TrackerEvent(EventConstants.BLINK_END, times[stop], np.nan, np.nan)))
+    return events
+
+class ReplayTracker:
+    '''
+    Stands in for session.tracker, fed from gaze traces instead of an eye tracker.
+    traces(trial) returns times (s, relative to start of recording) and gaze positions (degrees)
+    of the trial that starts recording. Samples and events become available as virtual time passes.
+    '''
+    def __init__(self, session, traces, pixPerDeg):
+        self.session = session
+        self.traces = traces
+        self.pixPerDeg = pixPerDeg
+        self.recording = False
+        self.available = []
+        self.events = []
+        self.cursor = 0
+        self.messages = []
+
+    def setRecordingState(self, recording):
+        if recording and not self.recording:
+            self.load(*self.traces(self.session.trial))
+        self.recording = recording
+
+    def load(self, times, posDeg):
+        start = core.getTime()
+        times = np.asarray(times, dtype = float) + start
+        posPix = np.asarray(posDeg, dtype = float) * self.pixPerDeg
+        items = [(t, TrackerEvent(EventConstants.MONOCULAR_EYE_SAMPLE, t, x, y))
+            for t, (x, y) in zip(times.tolist(), posPix.tolist())]
+        items += [(available, event._replace(gaze_x = event.gaze_x * self.pixPerDeg, gaze_y = event.gaze_y * self.pixPerDeg))
+            for available, event in trace_events(times, posDeg)]
+        items.sort(key = lambda item: item[0]) #stable, samples come before events of same time
+        self.available = [available for available, _ in items]
+        self.events = [event for _, event in items]
+        self.samples = [i for i, event in enumerate(self.events) if event.type == EventConstants.MONOCULAR_EYE_SAMPLE]
+        self.sampleTimes = [self.available[i] for i in self.samples]
+        self.cursor = 0
+
+    def getEvents(self):
+        if not self.recording:
+            return []
+        stop = bisect.bisect_right(self.available, core.getTime())
+        events = self.events[self.cursor:stop]
+        self.cursor = max(self.cursor, stop)
+        return events
+
+    def clearEvents(self):
+        self.cursor = max(self.cursor, bisect.bisect_right(self.available, core.getTime()))
+
+    def getPosition(self):
+        '''
+        Returns latest gaze position in pixels, None during blinks and before recording.
+        '''
+        i = bisect.bisect_right(self.sampleTimes, core.getTime()) - 1 if self.recording else -1
+        if i < 0:
+            return None
+        sample = self.events[self.samples[i]]
+        if math.isnan(sample.gaze_x):
+            return None
+        return (sample.gaze_x, sample.gaze_y)
+
+    def sendMessage(self, msg, time_offset = 0):
+        self.messages.append(msg)
+
+    def runSetupProcedure(self):
+        pass
+
+    def setConnectionState(self, connected):
+        pass
+
+class ReplayHub:
+    '''
+    Stands in for ioHubConnection of session.
+    '''
+    def __init__(self, tracker):
+        self.tracker = tracker
+
+    def quit(self):
+        pass
+
+def synthetic_traces(seed = 0, duration = 12, rate = 500, lookAway = 0):
+    '''
+    Returns traces function of synthetic gaze: fixation with microsaccades in all trials,
+    plus a saccade into the periphery and back during exploration in sampling trials.
+    With probability lookAway, gaze leaves the fixation area during the final fixation phase (trial is aborted).
+    '''
+    rng = np.random.default_rng(seed)
+    def traces(trial):
+        shifts = [(onset, rng.normal(scale = .3, size = 2)) for onset in np.sort(rng.uniform(1.6, duration - .5, 3))]
+        if trial.samplingType != 'none':
+            onset = rng.uniform(2, 4)
+            target = np.array((rng.choice((-1, 1)) * rng.uniform(14, 18), rng.uniform(-4, 4)))
+            shifts += [(onset, target), (onset + rng.uniform(.4, 1), -target)]
+        if rng.random() < lookAway:
+            onset = rng.uniform(8, 11)
+            target = np.array((rng.choice((-1, 1)) * rng.uniform(9, 12), 0))
+            shifts += [(onset, target), (onset + .3, -target)]
+        return saccades.synthetic_trace(duration, rate, shifts, rng = rng)
+    return traces
+
+def recorded_traces(gazefilename, lead = 1.5):
+    '''
+    Returns traces function that replays recordings of session gaze file in order of recording
+    (including aborted recordings, so that trials are repeated as in the session).
+    Recordings start lead seconds after recording state is set (fixation dot is not recorded).
+    '''
+    samples, index = recorder.load(gazefilename)
+    recordings = {}
+    for recording, rows in index.groupby('recording', sort = True):
+        row = rows.iloc[0]
+        key = (row['blockType'], -1 if pd.isna(row['trialN']) else int(row['trialN']), row['periphType'], row['samplingType'])
+        recordings.setdefault(key, deque()).append(recording)
+    def traces(trial):
+        key = (trial.blockType, -1 if trial.trialN is None else trial.trialN, trial.periphType, trial.samplingType)
+        if not recordings.get(key):
+            return np.zeros(0), np.zeros((0,2))
+        trialSamples = recorder.trial_samples(samples, index, recordings[key].popleft())
+        if len(trialSamples) == 0:
+            return np.zeros(0), np.zeros((0,2))
+        times = trialSamples['time'] - trialSamples['time'][0] + lead
+        return times, np.column_stack((trialSamples['x'], trialSamples['y']))
+    return traces
+
+def uniform_response(trial, rng):
+    return int(rng.integers(1, 5))
+
+class ReplaySession(experiment.Session):
+    '''
+    Session that runs without participant or eye tracker, in a hidden window:
+    gaze comes from traces (see synthetic_traces and recorded_traces), time is virtual,
+    keys are answered immediately and ratings, given by respond(trial, rng), after responseDelay (s).
+    Runs with the same seed and traces give the same output
+    (apart from measured costs in frame timing and message send times).
+    A clock that is already installed can be passed to run several sessions in one process.
+    The hidden window needs a display, unless pyglet runs in headless mode (--headless, see headless.py),
+    where it is an offscreen EGL surface. With prefetch, trials wait for their textures, so runs stay deterministic.
+    '''
+    def __init__(self, traces, dataDir, seed = 0, refresh = 1/60, size = (1920, 1080), responseDelay = 1,
+            respond = None, participant = 'replay', clock = None, **kwargs):
+        self.traces = traces
+        self.refresh = refresh
+        self.size = size
+        self.responseDelay = responseDelay
+        self.respond = respond or uniform_response
+        self.responses = np.random.default_rng(seed)
+        self.participant = participant
+        self.slider = None
+        if clock is None:
+            clock = VirtualClock()
+            clock.install()
+        self.clock = clock
+        self.clock.t = 0.
+        os.makedirs(dataDir, exist_ok = True)
+        super().__init__(seed = seed, dataDir = dataDir, **kwargs)
+
+    def participant_id(self):
+        return self.participant
+
+    def open_window(self):
+        '''
+        Returns hidden pyglet window (offscreen in headless mode) that does not wait for vsync.
+        Flips advance virtual time by one frame.
+        '''
+        win = visual.Window(
+            size = self.size,
+            color = (-1, -1, -1),
+            colorSpace = 'rgb',
+            fullscr = False,
+            units = 'pix',
+            allowStencil = True,
+            waitBlanking = False,
+            monitor = self.mon)
+        win.winHandle.set_visible(False)
+        win.monitorFramePeriod = self.refresh
+        flip = win.flip
+        def virtual_flip(clearBuffer = True):
+            self.clock.next_frame(self.refresh)
+            return flip(clearBuffer)
+        win.flip = virtual_flip
+        return win
+
+    def load_sounds(self):
+        self.cues = cues.CueEngine(cues.NullSink())
+
+    def prepare_devices(self):
+        super().prepare_devices()
+        if self.prefetcher is not None: #time is virtual, trials wait for their textures instead of a deadline
+            self.prefetcher.timeout = None
+
+    def connect_tracker(self):
+        tracker = ReplayTracker(self, self.traces, monitorunittools.deg2pix(1, self.mon))
+        self.io = ReplayHub(tracker)
+        return tracker
+
+    def get_keys(self, keyList = None):
+        return ['return'] if keyList is not None and 'return' in keyList else []
+
+    def get_rating(self, slider):
+        if slider is not self.slider:
+            self.slider = slider
+            self.sliderShown = core.getTime()
+        if core.getTime() - self.sliderShown < self.responseDelay:
+            return None
+        return self.respond(self.trial, self.responses)
+
+    def terminate(self):
+        if hasattr(self, 'logger'):
+            try:
+                self.logger.close()
+            except OSError as e:
+                print('WARNING: Could not write trial log', self.logger.filename, e)
+        if hasattr(self, 'messages'):
+            try:
+                self.messages.close()
+            except OSError as e:
+                print('WARNING: Could not mirror tracker messages to', self.messages.mirrorFilename, e)
+        self.win.close()
+        self.clock.uninstall()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Runs full session in a hidden window with recorded or synthetic gaze.')
+    parser.add_argument('--gaze', default = None, help = 'GAZE.dat file of recorded session (default: synthetic gaze)')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--detection', choices = ('iohub', 'online'), default = 'iohub',
+        help = 'saccade events of replay tracker or online detector over replayed samples')
+    parser.add_argument('--out', default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Replay'))
+    parser.add_argument('--headless', action = 'store_true', help = 'offscreen EGL window, no display needed (see headless.py)')
+    args = parser.parse_args()
+
+    traces = recorded_traces(args.gaze) if args.gaze else synthetic_traces(args.seed)
+    session = ReplaySession(traces, args.out, seed = args.seed, saccadeDetection = args.detection)
+    session.run()
+    session.terminate()
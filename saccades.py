@@ -0,0 +1,258 @@
+import argparse
+import time
+from collections import namedtuple
+import numpy as np
+
+Saccade = namedtuple('Saccade', [
+    'onset',        #time of first sample above velocity threshold
+    'offset',       #time of last sample above velocity threshold
+    'detected',     #time of sample at which onset was detected
+    'amplitude',    #distance between start and end position (deg)
+    'peakVelocity', #deg/s
+    'duration',     #s
+    'start',        #position at onset (deg)
+    'end'])         #position at offset (deg)
+
+class SaccadeDetector:
+    '''
+    Online velocity-threshold saccade detector (Engbert & Kliegl, 2003).
+    Samples are kept in a preallocated ring buffer. Velocities are computed with a 5-sample window,
+    so onset is detected 2 + onsetSamples - 1 samples after it happened.
+    Thresholds are vfac times the median-based velocity SD of the buffer, per dimension.
+    '''
+    def __init__(self, capacity = 4096, vfac = 6, onsetSamples = 3, minDuration = .006,
+            minThreshold = 10, updateInterval = 100):
+        self.capacity = capacity
+        self.vfac = vfac
+        self.onsetSamples = onsetSamples #consecutive samples above threshold to flag onset
+        self.minDuration = minDuration #shorter saccades are discarded at offset (s)
+        self.minThreshold = minThreshold #lower bound of velocity thresholds (deg/s)
+        self.updateInterval = updateInterval #samples between threshold updates
+        self.times = np.zeros(capacity)
+        self.pos = np.zeros((capacity, 2))
+        self.vel = np.full((capacity, 2), np.nan)
+        self.reset()
+
+    def reset(self):
+        '''
+        Clears buffer and detection state.
+        '''
+        self.n = 0 #number of samples pushed
+        self.nVel = 0 #number of samples with velocity
+        self.vel[:] = np.nan
+        self.thresholds = np.full(2, float(self.minThreshold))
+        self.nextUpdate = self.updateInterval
+        self.nAbove = 0
+        self.inSaccade = False
+        self.onsetIndex = None
+        self.detectedAt = None
+        self.peakVelocity = 0.
+
+    def push(self, times, posDeg):
+        '''
+        Adds samples (times in s, positions of shape [N,2] in degrees, NaN for missing data)
+        and returns list of saccades that ended within these samples.
+        '''
+        times = np.asarray(times, dtype = float)
+        posDeg = np.asarray(posDeg, dtype = float).reshape(-1, 2)
+        if len(times) > self.capacity:
+            times, posDeg = times[-self.capacity:], posDeg[-self.capacity:]
+        idx = (self.n + np.arange(len(times))) % self.capacity
+        self.times[idx] = times
+        self.pos[idx] = posDeg
+        self.n += len(times)
+
+        #velocities for all samples that have two neighbours on each side
+        first = max(self.nVel, 2, self.n - self.capacity + 2)
+        last = self.n - 2
+        if last <= first:
+            return []
+        k = np.arange(first, last)
+        i = lambda offset: (k + offset) % self.capacity
+        dt = 1.5 * (self.times[i(2)] - self.times[i(-2)])
+        vel = (self.pos[i(2)] + self.pos[i(1)] - self.pos[i(-1)] - self.pos[i(-2)]) / dt[:,None]
+        self.vel[i(0)] = vel
+        self.nVel = last
+
+        if self.n >= self.nextUpdate:
+            self.update_thresholds()
+        above = np.sum((vel / self.thresholds)**2, axis = 1) > 1 #elliptic criterion, False for NaN
+        missing = np.isnan(vel).any(axis = 1)
+        speed = np.linalg.norm(vel, axis = 1)
+
+        saccades = []
+        for j in range(len(k)):
+            if missing[j]:
+                self.nAbove = 0
+                self.inSaccade = False #saccade interrupted by blink or data loss
+            elif above[j]:
+                self.nAbove += 1
+                if self.inSaccade:
+                    self.peakVelocity = max(self.peakVelocity, speed[j])
+                elif self.nAbove >= self.onsetSamples:
+                    self.inSaccade = True
+                    self.onsetIndex = k[j] - self.nAbove + 1
+                    self.detectedAt = self.times[(k[j] + 2) % self.capacity] #latest sample used for velocity
+                    self.peakVelocity = np.nanmax(speed[max(j - self.nAbove + 1, 0):j + 1])
+            else:
+                if self.inSaccade:
+                    saccade = self.finish(k[j] - 1)
+                    if saccade.duration >= self.minDuration:
+                        saccades.append(saccade)
+                self.nAbove = 0
+                self.inSaccade = False
+        return saccades
+
+    def finish(self, offsetIndex):
+        onset = self.onsetIndex % self.capacity
+        offset = offsetIndex % self.capacity
+        start, end = self.pos[onset].copy(), self.pos[offset].copy()
+        return Saccade(
+            onset = self.times[onset],
+            offset = self.times[offset],
+            detected = self.detectedAt,
+            amplitude = float(np.linalg.norm(end - start)),
+            peakVelocity = float(self.peakVelocity),
+            duration = self.times[offset] - self.times[onset],
+            start = start,
+            end = end)
+
+    def update_thresholds(self):
+        '''
+        Recomputes velocity thresholds from median-based SD of velocities in buffer.
+        '''
+        vel = self.vel[~np.isnan(self.vel).any(axis = 1)]
+        if len(vel) > 10:
+            sd = np.sqrt(np.median(vel**2, axis = 0) - np.median(vel, axis = 0)**2)
+            self.thresholds = np.maximum(self.vfac * sd, self.minThreshold)
+        self.nextUpdate = self.n + self.updateInterval
+
+    def onset_time(self):
+        '''
+        Returns time of onset of ongoing saccade, else None.
+        '''
+        if not self.inSaccade:
+            return None
+        return self.times[self.onsetIndex % self.capacity]
+
+    def current_amplitude(self):
+        '''
+        Returns distance between onset and latest sample of ongoing saccade, else 0.
+        '''
+        if not self.inSaccade:
+            return 0.
+        return float(np.linalg.norm(self.pos[(self.n - 1) % self.capacity] - self.pos[self.onsetIndex % self.capacity]))
+
+def detect(times, posDeg, vfac = 6, minSamples = 3, minDuration = .006, minThreshold = 10):
+    '''
+    Offline version of SaccadeDetector for a whole recording (vectorized, thresholds from all samples).
+    Returns dict of arrays onset, offset, amplitude, peakVelocity and duration (one entry per saccade).
+    Runs of samples above threshold that contain missing data are discarded.
+    '''
+    times = np.asarray(times, dtype = float)
+    posDeg = np.asarray(posDeg, dtype = float).reshape(-1, 2)
+    empty = {key: np.zeros(0) for key in ('onset', 'offset', 'amplitude', 'peakVelocity', 'duration')}
+    if len(times) < 5:
+        return empty
+    vel = np.full((len(times), 2), np.nan)
+    dt = 1.5 * (times[4:] - times[:-4])
+    vel[2:-2] = (posDeg[4:] + posDeg[3:-1] - posDeg[1:-3] - posDeg[:-4]) / dt[:,None]
+    valid = ~np.isnan(vel).any(axis = 1)
+    thresholds = np.full(2, float(minThreshold))
+    if valid.sum() > 10:
+        sd = np.sqrt(np.median(vel[valid]**2, axis = 0) - np.median(vel[valid], axis = 0)**2)
+        thresholds = np.maximum(vfac * sd, minThreshold)
+    above = valid & (np.sum((np.nan_to_num(vel) / thresholds)**2, axis = 1) > 1)
+
+    changes = np.flatnonzero(np.diff(np.concatenate(([0], above.astype(int), [0]))))
+    onsets, stops = changes[::2], changes[1::2] #stop is first sample after run
+    #runs next to missing data are interrupted by blinks
+    interrupted = ~valid[np.maximum(onsets - 1, 0)] | ~valid[np.minimum(stops, len(times) - 1)]
+    keep = (stops - onsets >= minSamples) & ~interrupted
+    onsets, offsets = onsets[keep], stops[keep] - 1
+    duration = times[offsets] - times[onsets]
+    keep = duration >= minDuration
+    onsets, offsets, duration = onsets[keep], offsets[keep], duration[keep]
+    if len(onsets) == 0:
+        return empty
+    speed = np.linalg.norm(np.nan_to_num(vel), axis = 1)
+    return {
+        'onset': times[onsets],
+        'offset': times[offsets],
+        'amplitude': np.linalg.norm(posDeg[offsets] - posDeg[onsets], axis = 1),
+        'peakVelocity': np.maximum.reduceat(speed, np.column_stack((onsets, offsets + 1)).ravel())[::2],
+        'duration': duration}
+
+def synthetic_trace(duration, rate = 500, saccades = (), noise = .01, rng = None):
+    '''
+    Returns times and gaze positions (degrees, shape [N,2]) of fixations with gaussian noise,
+    and saccades given as (onset time, (dx, dy)) with sigmoid velocity profile.
+    Saccade duration follows main sequence (2.2 ms/deg + 21 ms).
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    times = np.arange(0, duration, 1/rate)
+    pos = rng.normal(scale = noise, size = (len(times), 2))
+    for onset, shift in saccades:
+        amplitude = np.linalg.norm(shift)
+        saccadeDuration = .0022 * amplitude + .021
+        progress = np.clip((times - onset) / saccadeDuration, 0, 1)
+        pos += (3*progress**2 - 2*progress**3)[:,None] * np.asarray(shift, dtype = float)
+    return times, pos
+
+def compare(detected, reference, tolerance = .02):
+    '''
+    Matches detected saccades to reference onsets (e.g. ground truth or times of iohub SACCADE_START events).
+    Returns dict with detection latencies (detected - reference onset, s) of hits, misses and false alarms.
+    '''
+    reference = np.sort(np.asarray(reference, dtype = float))
+    matched = np.zeros(len(reference), dtype = bool)
+    latencies = []
+    falseAlarms = 0
+    for saccade in detected:
+        candidates = np.flatnonzero(~matched & (np.abs(reference - saccade.onset) < tolerance))
+        if len(candidates) == 0:
+            falseAlarms += 1
+            continue
+        best = candidates[np.argmin(np.abs(reference[candidates] - saccade.onset))]
+        matched[best] = True
+        latencies.append(saccade.detected - reference[best])
+    return {
+        'latencies': np.array(latencies),
+        'hits': int(matched.sum()),
+        'misses': int((~matched).sum()),
+        'falseAlarms': falseAlarms}
+
+def benchmark(rate = 500, duration = 60, chunk = 8, seed = 0):
+    '''
+    Runs detector over synthetic trace in chunks (as delivered per frame)
+    and reports detection latency, agreement with ground truth and cost per chunk.
+    '''
+    rng = np.random.default_rng(seed)
+    onsets = np.arange(.5, duration - .5, .7) + rng.uniform(0, .2, size = len(np.arange(.5, duration - .5, .7)))
+    shifts = rng.normal(scale = 4, size = (len(onsets), 2))
+    times, pos = synthetic_trace(duration, rate, zip(onsets, shifts), rng = rng)
+
+    detector = SaccadeDetector()
+    detected = []
+    t0 = time.perf_counter()
+    for i in range(0, len(times), chunk):
+        detected.extend(detector.push(times[i:i+chunk], pos[i:i+chunk]))
+    cost = (time.perf_counter() - t0) / (len(times) / chunk)
+
+    result = compare(detected, onsets)
+    latencies = result['latencies'] * 1000
+    print('%d Hz: %d hits, %d misses, %d false alarms' % (rate, result['hits'], result['misses'], result['falseAlarms']))
+    print('    detection latency (ms): median %.1f, max %.1f' % (np.median(latencies), latencies.max()))
+    print('    of which after threshold crossing (ms): median %.1f' % (
+        np.median([saccade.detected - saccade.onset for saccade in detected]) * 1000))
+    print('    cost per chunk of %d samples: %.1f us' % (chunk, cost * 1e6))
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmarks online saccade detector on synthetic traces.')
+    parser.add_argument('--rates', type = int, nargs = '+', default = [500, 1000, 2000])
+    parser.add_argument('--duration', type = float, default = 60)
+    args = parser.parse_args()
+    for rate in args.rates:
+        benchmark(rate, args.duration, chunk = rate // 60 + 1)
@@ -0,0 +1,204 @@
+import argparse
+import itertools
+import time
+import numpy as np
+import pandas as pd
+
+blockTypes = ('sampling', 'no-sampling')
+periphTypes = ('none', 'small', 'large')
+samplingTypes = ('none', 'valid', 'invalid')
+
+#(periphType, samplingType, repetitions) of practice and experimental trials per block,
+#pauses at fractions of experimental trials
+design = {
+    'no-sampling': {
+        'practice': [('none', 'none', 1), ('small', 'none', 1), ('large', 'none', 1)],
+        'trials': [('none', 'none', 10), ('small', 'none', 15), ('large', 'none', 15)],
+        'pauses': ()},
+    'sampling': {
+        'practice': [('none', 'invalid', 1), ('none', 'valid', 1), ('small', 'valid', 1),
+            ('large', 'valid', 1), ('small', 'invalid', 1), ('large', 'invalid', 1)],
+        'trials': [('none', 'invalid', 10), ('none', 'valid', 10), ('small', 'invalid', 15),
+            ('small', 'valid', 15), ('large', 'invalid', 15), ('large', 'valid', 15)],
+        'pauses': (1/2,)}}
+
+#one row per trial in order of presentation (codes index blockTypes, periphTypes, samplingTypes)
+dtype = np.dtype([('block', 'i1'), ('practice', '?'), ('periph', 'i1'), ('sampling', 'i1'),
+    ('trialN', 'i2'), ('pause', '?')])
+
+def condition_codes(conditions):
+    '''
+    Returns condition code (periph * len(samplingTypes) + sampling) of every trial of condition list.
+    '''
+    return np.repeat([periphTypes.index(periph) * len(samplingTypes) + samplingTypes.index(sampling)
+        for periph, sampling, _ in conditions], [n for _, _, n in conditions]).astype('i1')
+
+def longest_runs(sequences):
+    '''
+    Returns length of longest run of identical codes in every row of sequences (2d array).
+    '''
+    n = sequences.shape[1]
+    starts = np.ones(sequences.shape, dtype = bool)
+    starts[:,1:] = sequences[:,1:] != sequences[:,:-1]
+    positions = np.arange(n)
+    runStart = np.maximum.accumulate(np.where(starts, positions, 0), axis = 1)
+    return (positions - runStart + 1).max(axis = 1)
+
+def participant_rngs(seed, participants):
+    '''
+    Returns one random generator per participant number, seeded by (seed, participant),
+    so that the schedule of a participant does not depend on the batch it is generated in.
+    '''
+    return [np.random.default_rng([seed, int(participant)]) for participant in participants]
+
+def shuffle(rngs, codes, maxRun = None, maxTries = 10000):
+    '''
+    Returns independent random orders of codes, one row per generator in rngs, all in one batch.
+    Orders with runs longer than maxRun are redrawn until none are left.
+    '''
+    orders = np.empty((len(rngs), len(codes)), dtype = codes.dtype)
+    todo = np.arange(len(rngs))
+    for _ in range(maxTries):
+        keys = np.array([rngs[i].random(len(codes)) for i in todo]).reshape(len(todo), len(codes))
+        orders[todo] = codes[np.argsort(keys, axis = 1)]
+        if maxRun is not None:
+            todo = todo[longest_runs(orders[todo]) > maxRun]
+        else:
+            todo = todo[:0]
+        if len(todo) == 0:
+            return orders
+    raise ValueError('No trial order with runs of at most %d trials found' % maxRun)
+
+def block_schedule(rngs, blockType, maxRun = None):
+    '''
+    Returns schedules (one row per generator in rngs x trials) of one block: practice trials, then experimental trials.
+    '''
+    blockDesign = design[blockType]
+    practice = shuffle(rngs, condition_codes(blockDesign['practice']))
+    trials = shuffle(rngs, condition_codes(blockDesign['trials']), maxRun)
+    rows = np.zeros((len(rngs), practice.shape[1] + trials.shape[1]), dtype = dtype)
+    codes = np.concatenate((practice, trials), axis = 1)
+    rows['block'] = blockTypes.index(blockType)
+    rows['practice'][:,:practice.shape[1]] = True
+    rows['periph'] = codes // len(samplingTypes)
+    rows['sampling'] = codes % len(samplingTypes)
+    rows['trialN'][:,practice.shape[1]:] = np.arange(1, trials.shape[1] + 1)
+    for fraction in blockDesign['pauses']:
+        rows['pause'][:,practice.shape[1] + int(trials.shape[1] * fraction)] = True
+    return rows
+
+def block_orders():
+    return list(itertools.permutations(range(len(blockTypes))))
+
+def generate(nParticipants, seed = 0, maxRun = None, firstParticipant = 0):
+    '''
+    Returns schedules of nParticipants (structured array, one row per participant, one column per trial).
+    Block order is counterbalanced: participant number firstParticipant + i gets order i modulo number of orders.
+    Trial orders are drawn independently per participant and block, with runs of the same condition
+    (periphType and samplingType) of at most maxRun experimental trials (None: unconstrained).
+    Every participant has its own generator (see participant_rngs), so row i equals
+    participant_schedule(seed, firstParticipant + i, maxRun).
+    '''
+    participants = firstParticipant + np.arange(nParticipants)
+    rngs = participant_rngs(seed, participants)
+    blocks = [block_schedule(rngs, blockType, maxRun) for blockType in blockTypes]
+    orders = block_orders()
+    participantOrders = participants % len(orders)
+    schedules = np.empty((nParticipants, sum(block.shape[1] for block in blocks)), dtype = dtype)
+    for i, order in enumerate(orders):
+        selected = participantOrders == i
+        schedules[selected] = np.concatenate([blocks[block][selected] for block in order], axis = 1)
+    return schedules
+
+def participant_schedule(seed, participant = None, maxRun = None):
+    '''
+    Returns schedule of single session, the same as the participant's row of generate(..., seed, maxRun).
+    Block order is counterbalanced by participant number, or by seed if participant number is unknown.
+    '''
+    return generate(1, seed, maxRun, seed if participant is None else participant)[0]
+
+def blocks(schedule):
+    '''
+    Returns (blockType, start, stop) of every block of schedule in order of presentation.
+    '''
+    changes = np.flatnonzero(np.diff(schedule['block'])) + 1
+    bounds = np.concatenate(([0], changes, [len(schedule)]))
+    return [(blockTypes[schedule['block'][start]], int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+def to_frame(schedule):
+    '''
+    Returns schedule of one session as DataFrame with condition names.
+    '''
+    return pd.DataFrame({
+        'blockType': np.array(blockTypes)[schedule['block']],
+        'practice': schedule['practice'],
+        'periphType': np.array(periphTypes)[schedule['periph']],
+        'samplingType': np.array(samplingTypes)[schedule['sampling']],
+        'trialN': np.where(schedule['practice'], np.nan, schedule['trialN']),
+        'pause': schedule['pause']})
+
+def save(filename, schedules, seed, maxRun, firstParticipant = 0):
+    np.savez_compressed(filename, schedules = schedules, seed = seed, maxRun = -1 if maxRun is None else maxRun,
+        firstParticipant = firstParticipant)
+
+def load(filename):
+    '''
+    Returns schedules and dict of arguments they were generated with.
+    '''
+    with np.load(filename) as f:
+        maxRun = int(f['maxRun'])
+        return f['schedules'], {'seed': int(f['seed']), 'maxRun': None if maxRun < 0 else maxRun,
+            'firstParticipant': int(f['firstParticipant'])}
+
+class LazyTrials:
+    '''
+    Trials of schedule in order of presentation. Trial objects are created by factory(index, row)
+    when first accessed. Slices are views that share created trials.
+    '''
+    def __init__(self, schedule, factory, cache = None, offset = 0):
+        self.schedule = schedule
+        self.factory = factory
+        self.cache = {} if cache is None else cache #index in session schedule -> Trial
+        self.offset = offset
+
+    def __len__(self):
+        return len(self.schedule)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                raise ValueError('Only contiguous slices of trials are supported')
+            return LazyTrials(self.schedule[start:stop], self.factory, self.cache, self.offset + start)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Trial index out of range')
+        index = self.offset + i
+        if index not in self.cache:
+            self.cache[index] = self.factory(index, self.schedule[i])
+        return self.cache[index]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Generates counterbalanced trial schedules of participants.')
+    parser.add_argument('--participants', type = int, required = True)
+    parser.add_argument('--out', required = True, help = 'npz file')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--max-run', type = int, default = None, help = 'maximum run of same condition (default: unconstrained)')
+    parser.add_argument('--first', type = int, default = 0, help = 'participant number of first schedule')
+    args = parser.parse_args()
+
+    maxRun = args.max_run
+    t0 = time.perf_counter()
+    schedules = generate(args.participants, args.seed, maxRun, args.first)
+    print('Generated %d schedules in %.2f s (%d bytes)' % (len(schedules), time.perf_counter() - t0, schedules.nbytes))
+    save(args.out, schedules, args.seed, maxRun, args.first)
+    print('Stored schedules under:', args.out)
+    print('First block:', {blockTypes[code]: int(n) for code, n in zip(*np.unique(schedules['block'][:,0], return_counts = True))})
+    experimental = ~schedules['practice']
+    codes = np.where(experimental, schedules['periph'] * len(samplingTypes) + schedules['sampling'], -1 - np.arange(schedules.shape[1]))
+    print('Longest run of same condition:', longest_runs(codes).max())
@@ -0,0 +1,85 @@
+import numpy as np
+from psychopy import core
+
+class FrameScheduler:
+    '''
+    Late-latching frame scheduler for gaze-contingent phases.
+    Predicts the next vsync from the previous flip timestamp and waits until just before the draw deadline,
+    so that gaze is sampled as late as possible before the frame is submitted.
+    The time reserved for sampling and drawing (budget) adapts to the measured frame work.
+    After repeated missed deadlines, waiting is switched off until the next phase.
+    Times are on core.monotonicClock (same as win.flip() timestamps).
+    '''
+    def __init__(self, refresh, minBudget = .002, safety = .001, history = 120, maxMisses = 3):
+        self.refresh = refresh
+        self.minBudget = minBudget
+        self.maxBudget = .8 * refresh
+        self.safety = safety #margin added to measured frame work (s)
+        self.workTimes = np.full(history, minBudget)
+        self.nWork = 0
+        self.maxMisses = maxMisses #consecutive misses after which waiting is switched off
+        self.budget = minBudget
+        self.start_phase()
+
+    def start_phase(self):
+        '''
+        Resets prediction and per-phase metrics.
+        '''
+        self.lastFlip = None
+        self.target = None
+        self.latched = None
+        self.consecutiveMisses = 0
+        self.enabled = True
+        self.slack = []
+        self.missed = 0
+
+    def wait(self):
+        '''
+        Waits until draw deadline of next vsync. Returns predicted vsync time (None if unknown).
+        '''
+        if self.lastFlip is None:
+            self.target = None
+        else:
+            now = core.monotonicClock.getTime()
+            nFrames = max(1, np.ceil((now - self.lastFlip) / self.refresh)) #next vsync still ahead
+            self.target = self.lastFlip + nFrames * self.refresh
+            delay = self.target - self.budget - now
+            if self.enabled and delay > 0:
+                core.wait(delay, hogCPUperiod = min(delay, .002))
+        self.latched = core.monotonicClock.getTime()
+        return self.target
+
+    def flip(self, flip):
+        '''
+        Submits frame with flip function (returning flip timestamp) and updates prediction and metrics.
+        '''
+        submitted = core.monotonicClock.getTime()
+        flipTime = flip()
+        self.workTimes[self.nWork % len(self.workTimes)] = submitted - self.latched
+        self.nWork += 1
+        if self.target is not None:
+            self.slack.append(self.target - submitted)
+            if flipTime > self.target + self.refresh/2: #frame landed on a later vsync
+                self.missed += 1
+                self.consecutiveMisses += 1
+                self.budget = min(self.budget * 1.5, self.maxBudget)
+                if self.consecutiveMisses >= self.maxMisses:
+                    self.enabled = False #degrade to flipping as soon as frame is drawn
+            else:
+                self.consecutiveMisses = 0
+                work = self.workTimes[:min(self.nWork, len(self.workTimes))]
+                self.budget = float(np.clip(np.percentile(work, 95) + self.safety, self.minBudget, self.maxBudget))
+        self.lastFlip = flipTime
+        return flipTime
+
+    def summary(self):
+        '''
+        Returns per-phase slack metrics (slack: time between frame submission and predicted vsync).
+        '''
+        slack = np.array(self.slack)
+        return {
+            'meanSlack': slack.mean() if len(slack) else np.nan,
+            'minSlack': slack.min() if len(slack) else np.nan,
+            'missedDeadlines': self.missed,
+            'budget': self.budget,
+            'latching': self.enabled}
@@ -0,0 +1,140 @@
+import argparse
+import functools
+import multiprocessing
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError as e: #see requirements.txt
+    raise ImportError('simulate.py writes parquet files and needs pyarrow (pip install pyarrow)') from e
+import linefield
+import replay
+import schedule
+
+#attributes set by prepare_stimuli, shared by all sessions of a worker process
+sharedMaterials = ('mon', 'win', 'fixationDot', 'gazeDot', 'centerRect', 'fixationArea', 'centerROI', 'fixationROI',
+    'gazeTransform', 'stimulusParams', 'center', 'periph', 'aperture', 'samplingAperture', 'frames', 'ratingText',
+    'textureStore', 'patches', 'cues')
+columnTypes = {
+    'participant': 'int64', 'seed': 'int64', 'order': 'int64', 'blockType': 'object', 'trialN': 'int64',
+    'periphType': 'object', 'samplingType': 'object', 'rating': 'int64', 'saccades': 'int64',
+    'microsaccades': 'int64', 'aborts': 'int64'}
+schema = pa.schema([(name, pa.string() if dtype == 'object' else pa.int64()) for name, dtype in columnTypes.items()])
+
+_worker = {} #materials and virtual clock of worker process
+
+class SimulatedSession(replay.ReplaySession):
+    '''
+    Replay session of a simulated participant. Stimuli are rendered by the first session of a worker process
+    and reused by all later ones. Stimuli (and texture cache key) depend on stimulusSeed only,
+    gaze and responses on seed, trial order on trialSchedule (see schedule.generate).
+    '''
+    def __init__(self, traces, dataDir, seed, trialSchedule, stimulusSeed = 0, **kwargs):
+        super().__init__(traces, dataDir, seed = stimulusSeed, clock = _worker.get('clock'),
+            trialSchedule = trialSchedule, **kwargs)
+        _worker['clock'] = self.clock
+        self.responses = np.random.default_rng(seed)
+
+    def prepare_stimuli(self):
+        if 'materials' in _worker:
+            self.__dict__.update(_worker['materials'])
+            return
+        super().prepare_stimuli()
+        _worker['materials'] = {name: getattr(self, name) for name in sharedMaterials}
+
+def ordinal_response(trial, rng, means = None, effect = .3, noise = .8):
+    '''
+    Rating (1-4) from latent similarity: mean per periphery condition (default: decreasing with orientation std),
+    plus effect in invalid sampling trials (uniform patch shown after saccades) and gaussian noise.
+    '''
+    if means is None:
+        means = {'none': 3.5, 'small': 2.5, 'large': 1.5}
+    latent = means[trial.periphType] + (effect if trial.samplingType == 'invalid' else 0) + rng.normal(scale = noise)
+    return int(np.clip(np.round(latent), 1, 4))
+
+def results_frame(participant, seed, data):
+    '''
+    Returns session data (as stored by Session.store_data) as DataFrame with fixed columns and types.
+    '''
+    df = pd.DataFrame(data)
+    n_saccades = np.array([np.asarray(n) for n in df['n_saccades']]).reshape(-1, 2)
+    df = df.assign(participant = participant, seed = seed, order = np.arange(len(df)),
+        saccades = n_saccades[:,0], microsaccades = n_saccades[:,1])
+    return df[list(columnTypes)].astype(columnTypes)
+
+def run_participant(task):
+    participant, seed, trialSchedule, config = task
+    with tempfile.TemporaryDirectory() as tmp:
+        dataDir = os.path.join(config['keep'], 'sim%d' % participant) if config['keep'] else tmp
+        session = SimulatedSession(
+            replay.synthetic_traces(seed, lookAway = config['lookAway']),
+            dataDir,
+            seed,
+            trialSchedule,
+            stimulusSeed = config['stimulusSeed'],
+            scheduleSeed = config['scheduleSeed'],
+            maxRun = config['maxRun'],
+            scheduleParticipant = participant,
+            refresh = config['refresh'],
+            respond = functools.partial(ordinal_response, effect = config['effect'], noise = config['noise']),
+            participant = 'sim%d' % participant,
+            periphStds = config['periphStds'])
+        session.run()
+    return results_frame(participant, seed, session.data)
+
+def run_simulation(filename, nParticipants, seed = 0, processes = None, lookAway = .05, effect = .3, noise = .8,
+        stimulusSeed = 0, refresh = 1/60, periphStds = linefield.defaultStds, keep = None, maxRun = None):
+    '''
+    Runs nParticipants simulated sessions across process pool.
+    Trial schedules of all participants are generated in one batch (counterbalanced block order).
+    Trial data of every participant is appended to parquet file as soon as the session is done.
+    '''
+    config = {'lookAway': lookAway, 'effect': effect, 'noise': noise, 'stimulusSeed': stimulusSeed,
+        'refresh': refresh, 'periphStds': dict(periphStds), 'keep': keep, 'scheduleSeed': seed, 'maxRun': maxRun}
+    seeds = np.random.SeedSequence(seed).generate_state(nParticipants)
+    schedules = schedule.generate(nParticipants, seed, maxRun)
+    tasks = [(participant, int(participantSeed), schedules[participant], config)
+        for participant, participantSeed in enumerate(seeds)]
+    with pq.ParquetWriter(filename, schema) as writer:
+        with multiprocessing.Pool(processes) as pool:
+            for i, df in enumerate(pool.imap_unordered(run_participant, tasks)):
+                writer.write_table(pa.Table.from_pandas(df, schema = schema, preserve_index = False))
+                print('Simulated %d/%d participants' % (i+1, nParticipants))
+
+def summarize(filename):
+    '''
+    Returns trial counts, abort (repeat) rates and mean ratings per condition, and block order counts.
+    '''
+    df = pd.read_parquet(filename)
+    conditions = df.groupby(['blockType', 'periphType', 'samplingType']).agg(
+        trials = ('rating', 'size'),
+        participants = ('participant', 'nunique'),
+        abortRate = ('aborts', 'mean'),
+        meanRating = ('rating', 'mean'),
+        meanSaccades = ('saccades', 'mean'))
+    firstBlocks = df[df['order'] == 0].groupby('blockType').size().rename('firstBlock')
+    return conditions, firstBlocks
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Runs simulated participants for design validation.')
+    parser.add_argument('--participants', type = int, required = True)
+    parser.add_argument('--out', required = True, help = 'parquet file')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--processes', type = int, default = None)
+    parser.add_argument('--look-away', type = float, default = .05, help = 'probability of aborting trial')
+    parser.add_argument('--effect', type = float, default = .3, help = 'rating effect of invalid sampling')
+    parser.add_argument('--noise', type = float, default = .8, help = 'sd of rating noise')
+    parser.add_argument('--frame-rate', type = float, default = 60, help = 'virtual frame rate (lower runs faster)')
+    parser.add_argument('--max-run', type = int, default = None, help = 'maximum run of same condition (default: unconstrained)')
+    parser.add_argument('--headless', action = 'store_true', help = 'offscreen EGL windows, no display needed (see headless.py)')
+    parser.add_argument('--keep', default = None, help = 'keep session files of participants in this folder')
+    args = parser.parse_args()
+
+    run_simulation(args.out, args.participants, args.seed, args.processes, args.look_away, args.effect,
+        args.noise, refresh = 1/args.frame_rate, keep = args.keep, maxRun = args.max_run)
+    conditions, firstBlocks = summarize(args.out)
+    print(conditions)
+    print(firstBlocks)
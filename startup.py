@@ -0,0 +1,100 @@
+import csv
+import time
+from concurrent import futures
+from psychopy import visual
+
+class Startup:
+    '''
+    Runs the stages of session startup and records their timing.
+    Stages that do not need the window's GL context (tracker connection, sounds, CPU-side textures)
+    run in background threads while the main thread does GL work.
+    Once a window is shown, progress is drawn on it after every stage and while waiting for background stages.
+    '''
+    def __init__(self, maxWorkers = 3):
+        self.executor = futures.ThreadPoolExecutor(max_workers = maxWorkers, thread_name_prefix = 'Startup')
+        self.t0 = time.perf_counter()
+        self.stages = {} #name -> dict with thread, start, end (s since startup began)
+        self.futures = {}
+        self.text = None
+
+    def show(self, win):
+        self.win = win
+        self.text = visual.TextStim(win, text = '', units = 'norm', height = .05)
+        self.update()
+
+    def run(self, name, function, *args):
+        '''
+        Runs stage on main thread and returns its result.
+        '''
+        stage = self.stages[name] = {'thread': 'main', 'start': self.now()}
+        result = function(*args)
+        stage['end'] = self.now()
+        self.update()
+        return result
+
+    def start(self, name, function, *args):
+        '''
+        Starts stage in background thread.
+        '''
+        stage = self.stages[name] = {'thread': 'background', 'start': self.now()}
+        def timed():
+            try:
+                return function(*args)
+            finally:
+                stage['end'] = self.now()
+        self.futures[name] = self.executor.submit(timed)
+
+    def result(self, name, function = None, *args):
+        '''
+        Waits for background stage and returns its result (exceptions are raised here).
+        If stage was not started, function is run as main thread stage instead.
+        '''
+        if name not in self.futures:
+            return self.run(name, function, *args)
+        future = self.futures[name]
+        waitStart = self.now()
+        while True:
+            try:
+                result = future.result(timeout = .05)
+                break
+            except futures.TimeoutError:
+                self.update()
+        self.stages[name]['waited'] = self.now() - waitStart
+        self.update()
+        return result
+
+    def now(self):
+        return time.perf_counter() - self.t0
+
+    def update(self):
+        if self.text is None:
+            return
+        lines = ['Loading...', '']
+        for name, stage in self.stages.items():
+            lines.append('%s: %s' % (name, 'done' if 'end' in stage else 'running'))
+        self.text.text = '\n'.join(lines)
+        self.text.draw()
+        self.win.flip()
+
+    def finish(self, filename = None):
+        '''
+        Prints timing per stage and appends it to csv file. Returns rows.
+        '''
+        self.executor.shutdown(wait = False)
+        total = self.now()
+        rows = [{'stage': name, 'thread': stage['thread'], 'start': stage['start'], 'end': stage.get('end'),
+            'duration': stage.get('end', total) - stage['start'], 'waited': stage.get('waited', 0)}
+            for name, stage in self.stages.items()]
+        rows.append({'stage': 'total', 'thread': '', 'start': 0, 'end': total, 'duration': total, 'waited': 0})
+        for row in rows:
+            print('%-12s %-10s %6.2f s (waited %.2f s)' % (row['stage'], row['thread'], row['duration'], row['waited']))
+        if filename is not None:
+            try:
+                with open(filename, 'a', newline = '') as f:
+                    writer = csv.DictWriter(f, fieldnames = list(rows[0]))
+                    writer.writeheader()
+                    writer.writerows(rows)
+            except OSError:
+                print('WARNING: Could not store startup timing:', filename)
+        self.text = None
+        return rows
@@ -0,0 +1,85 @@
+'''
+Shared-memory ring buffer of gaze acquisition: wraparound, overrun counting and seqlock reads of latest sample.
+'''
+import importlib
+import math
+import sys
+from collections import namedtuple
+from unittest import mock
+import pytest
+
+Event = namedtuple('Event', ['type', 'time', 'gaze_x', 'gaze_y'])
+
+@pytest.fixture
+def acquisition(monkeypatch):
+    psychopy = mock.MagicMock()
+    monkeypatch.setitem(sys.modules, 'psychopy', psychopy)
+    monkeypatch.setitem(sys.modules, 'psychopy.core', psychopy.core)
+    monkeypatch.delitem(sys.modules, 'acquisition', raising = False)
+    yield importlib.import_module('acquisition')
+    sys.modules.pop('acquisition', None)
+
+@pytest.fixture
+def buffer(acquisition):
+    buffer = acquisition.RingBuffer(8)
+    yield buffer
+    buffer.close()
+
+def events(start, stop):
+    return [Event(1, float(i), float(i), -float(i)) for i in range(start, stop)]
+
+def test_wraparound(acquisition, buffer):
+    reader = acquisition.RingReader(buffer)
+    buffer.write(events(0, 5))
+    assert reader.read()['seq'].tolist() == [0, 1, 2, 3, 4]
+    buffer.write(events(5, 11)) #wraps around end of buffer
+    records = reader.read()
+    assert records['seq'].tolist() == list(range(5, 11))
+    assert records['gaze_y'].tolist() == [-float(i) for i in range(5, 11)]
+    assert len(reader.read()) == 0
+    assert reader.stats()['overruns'] == 0
+    assert reader.stats()['maxLag'] == 6
+
+def test_overrun(acquisition, buffer):
+    reader = acquisition.RingReader(buffer)
+    buffer.write(events(0, 20))
+    assert reader.read()['seq'].tolist() == list(range(12, 20)) #oldest events were overwritten
+    assert reader.stats()['overruns'] == 12
+
+def test_overwritten_while_copied(acquisition, buffer):
+    reader = acquisition.RingReader(buffer)
+    buffer.write(events(0, 8))
+    #writer has started to reuse slot of event 2 (sequence number is written first) but not yet published it
+    buffer.records[2]['seq'] = 10
+    records = reader.read()
+    assert records['seq'].tolist() == [0, 1, 3, 4, 5, 6, 7]
+    assert reader.stats()['overruns'] == 1
+
+def test_skip(acquisition, buffer):
+    reader = acquisition.RingReader(buffer)
+    buffer.write(events(0, 3))
+    reader.skip()
+    buffer.write(events(3, 4))
+    assert reader.read()['seq'].tolist() == [3]
+
+def test_read_latest(acquisition, buffer):
+    assert all(math.isnan(value) for value in buffer.read_latest())
+    buffer.set_latest(1.5, 10., 20.)
+    assert buffer.read_latest() == (1.5, 10., 20.)
+    other = acquisition.RingBuffer(8, buffer.name) #as attached by acquisition process
+    other.set_latest(2.5, 30., 40.)
+    assert buffer.read_latest() == (2.5, 30., 40.)
+    buffer.header[1] += 1 #writer is in the middle of an update
+    assert all(math.isnan(value) for value in buffer.read_latest(tries = 10))
+    other.close()
+
+def test_recording_drops_events_before_command(acquisition, buffer):
+    tracker = acquisition.RemoteTracker.__new__(acquisition.RemoteTracker)
+    tracker.buffer = buffer
+    tracker.reader = acquisition.RingReader(buffer)
+    buffer.write(events(0, 3)) #previous recording
+    def call(name, *args):
+        buffer.write(events(3, 5)) #written by acquisition process once recording has started
+    tracker.call = call
+    tracker.setRecordingState(True)
+    assert [event.time for event in tracker.getEvents()] == [3., 4.]
@@ -0,0 +1,68 @@
+'''
+Incremental analysis store: sessions are processed once, saccades are counted per completed trial.
+'''
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+import analysis
+import recorder
+import saccades
+
+session = 'uniformity_1_2024-01-01_10h00.00.000'
+
+def record(gaze, rng, shifts, aborted = False, **info):
+    '''
+    Records fixation (first second) and exploration phase of synthetic trace with saccades given as (onset, shift).
+    '''
+    times, pos = saccades.synthetic_trace(3, 500, shifts, rng = rng)
+    gaze.start_trial(**info)
+    fixation = times < 1
+    gaze.add(times[fixation], pos[fixation], 'fixation_phase')
+    gaze.add(times[~fixation], pos[~fixation], 'exploration_phase')
+    gaze.flush(aborted)
+
+@pytest.fixture
+def dataDir(tmp_path):
+    dataDir = tmp_path / 'Data'
+    dataDir.mkdir()
+    rng = np.random.default_rng(0)
+    gaze = recorder.GazeRecorder(str(dataDir / (session + 'GAZE.dat')))
+    info = {'blockType': 'test', 'periphType': 'small', 'samplingType': 'valid'}
+    #trial 0: saccade into periphery and back
+    record(gaze, rng, [(1.5, (10, 0)), (2.2, (-10, 0))], trialN = 0, **info)
+    #trial 1: aborted attempt with saccade, then completed attempt with microsaccade during fixation
+    record(gaze, rng, [(1.5, (12, 0))], aborted = True, trialN = 1, **info)
+    record(gaze, rng, [(.5, (.8, .4))], trialN = 1, **info)
+    pd.DataFrame({
+        'blockType': ['test', 'test'],
+        'trialN': [0, 1],
+        'periphType': ['small', 'small'],
+        'samplingType': ['valid', 'valid'],
+        'rating': [2, 3],
+        'n_saccades': ['[2 0]', '[0 1]']}).to_csv(dataDir / (session + '.csv'))
+    return str(dataDir)
+
+def test_update_processes_sessions_once(dataDir, tmp_path):
+    store = analysis.AnalysisStore(str(tmp_path / 'Analysis'))
+    assert store.update(dataDir, processes = 1) == 1
+    assert analysis.AnalysisStore(store.directory).update(dataDir, processes = 1) == 0 #manifest is reloaded
+
+    trials = store.load('trials', participant = '1').sort_values('trialN')
+    assert trials['trialN'].tolist() == [0, 1]
+    assert trials['saccades'].tolist() == [2, 0]
+    assert trials['microsaccades'].tolist() == [0, 1]
+    assert trials['onlineSaccades'].tolist() == [2, 0]
+
+    recordings = store.load('recordings')
+    assert sorted(recordings['recording'].unique()) == [1, 2, 3]
+    assert recordings.loc[recordings['recording'] == 2, 'aborted'].all()
+
+def test_update_reprocesses_changed_session(dataDir, tmp_path):
+    store = analysis.AnalysisStore(str(tmp_path / 'Analysis'))
+    store.update(dataDir, processes = 1)
+    with open(os.path.join(dataDir, session + 'LOG.csv'), 'w') as f:
+        f.write('blockType,trialN,n_saccades\n')
+    assert store.update(dataDir, processes = 1) == 1
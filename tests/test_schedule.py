@@ -0,0 +1,51 @@
+'''
+Trial schedules: run-length constraint, counterbalancing and reproducibility of single participants.
+'''
+import numpy as np
+import pytest
+import schedule
+
+def condition_runs(schedules):
+    '''
+    Returns longest run of same condition among experimental trials of every schedule (practice trials break runs).
+    '''
+    codes = schedules['periph'] * len(schedule.samplingTypes) + schedules['sampling']
+    codes = np.where(schedules['practice'], -1 - np.arange(schedules.shape[1]), codes)
+    return schedule.longest_runs(codes)
+
+def test_max_run():
+    unconstrained = schedule.generate(200, seed = 1)
+    assert condition_runs(unconstrained).max() > 2
+    constrained = schedule.generate(200, seed = 1, maxRun = 2)
+    assert condition_runs(constrained).max() <= 2
+
+def test_conditions_and_counterbalancing():
+    schedules = schedule.generate(12, seed = 3, maxRun = 3)
+    for blockType, blockDesign in schedule.design.items():
+        expected = np.sort(schedule.condition_codes(blockDesign['trials']))
+        for row in schedules:
+            trials = row[(row['block'] == schedule.blockTypes.index(blockType)) & ~row['practice']]
+            assert (np.sort(trials['periph'] * len(schedule.samplingTypes) + trials['sampling']) == expected).all()
+            assert (trials['trialN'] == np.arange(1, len(trials) + 1)).all()
+    firstBlocks = schedules['block'][:,0]
+    assert (firstBlocks[::2] == firstBlocks[0]).all() and (firstBlocks[1::2] != firstBlocks[0]).all()
+
+def test_deterministic():
+    first = schedule.generate(20, seed = 7, maxRun = 3)
+    assert (first == schedule.generate(20, seed = 7, maxRun = 3)).all()
+    assert not (first == schedule.generate(20, seed = 8, maxRun = 3)).all()
+
+@pytest.mark.parametrize('firstParticipant', [0, 5])
+def test_participant_schedule_matches_batch(firstParticipant):
+    schedules = schedule.generate(10, seed = 4, maxRun = 2, firstParticipant = firstParticipant)
+    for i in (0, 3, 9):
+        single = schedule.participant_schedule(4, firstParticipant + i, maxRun = 2)
+        assert (single == schedules[i]).all()
+
+def test_save_load(tmp_path):
+    filename = str(tmp_path / 'schedules.npz')
+    schedules = schedule.generate(4, seed = 2, maxRun = 3, firstParticipant = 10)
+    schedule.save(filename, schedules, 2, 3, 10)
+    loaded, args = schedule.load(filename)
+    assert (loaded == schedules).all()
+    assert args == {'seed': 2, 'maxRun': 3, 'firstParticipant': 10}
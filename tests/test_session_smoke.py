@@ -0,0 +1,70 @@
+'''
+Smoke test of session startup: builds a Session through prepare_stimuli with psychopy and PIL stubbed out,
+so that methods called on the session during startup are checked without window, tracker or audio device.
+'''
+import importlib
+import sys
+from unittest import mock
+import numpy as np
+import pytest
+
+stubbed = ['psychopy', 'psychopy.visual', 'psychopy.core', 'psychopy.event', 'psychopy.clock', 'psychopy.monitors',
+    'psychopy.prefs', 'psychopy.iohub', 'psychopy.iohub.constants', 'psychopy.data', 'psychopy.gui',
+    'psychopy.sound', 'psychopy.tools', 'psychopy.tools.monitorunittools', 'PIL', 'PIL.Image']
+project = ['experiment', 'materials', 'startup', 'events', 'gaze', 'frametiming', 'scheduler', 'messages',
+    'prefetch', 'patches', 'cues', 'acquisition', 'saccades', 'latency', 'recorder']
+
+class TextureCache:
+    def __init__(self, textures):
+        self.textures = textures
+
+    def load(self, params):
+        return self.textures
+
+    def store(self, params, textures):
+        pass
+
+@pytest.fixture
+def experiment(monkeypatch):
+    psychopy = mock.MagicMock()
+    for name in stubbed:
+        parts = name.split('.')
+        module = psychopy if parts[0] == 'psychopy' else mock.MagicMock()
+        for part in parts[1:]:
+            module = getattr(module, part)
+        monkeypatch.setitem(sys.modules, name, module)
+    monitor = psychopy.monitors.Monitor.return_value
+    monitor.getWidth.return_value = 53.
+    monitor.getDistance.return_value = 60.
+    psychopy.visual.Window.return_value.size = [64, 36]
+    for name in project:
+        monkeypatch.delitem(sys.modules, name, raising = False)
+    yield importlib.import_module('experiment')
+    for name in project:
+        sys.modules.pop(name, None)
+
+@pytest.mark.parametrize('composite', [False, True])
+def test_prepare_stimuli(experiment, composite):
+    import startup
+    import psychopy
+    psychopy.visual.Window.return_value._getRegionOfFrame.return_value = np.zeros((36, 64, 3), dtype = np.uint8)
+    session = experiment.Session.__new__(experiment.Session)
+    session.periphStds = {'none': 0., 'small': 10.}
+    session.seed = 1
+    session.renderer = 'numpy'
+    session.composite = composite
+    session.samplingPatches = False
+    session.acquisition = False
+    session.simulate = True
+    session.pp = 'test'
+    textures = {name: np.zeros((36, 64, 3), dtype = np.uint8) for name in ['center', 'periph_none', 'periph_small']}
+    session.textureCache = TextureCache(textures)
+    session.startup = startup.Startup()
+    session.prepare_stimuli()
+    session.startup.result('tracker')
+    session.startup.finish()
+    assert sorted(session.periph) == ['none', 'small']
+    frames = ['frame_none', 'frame_small'] if composite else []
+    assert session.textureStore.names() == list(textures) + frames
+    assert sorted(session.frames) == (['none', 'small'] if composite else [])
+    assert all(frame.stim is None for frame in session.frames.values()) #uploaded per trial
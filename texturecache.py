@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+
+class TextureCache:
+    '''
+    Persistent on-disk cache of pre-rendered stimulus textures.
+    Every entry is a directory with one .npy file per texture,
+    named after the hash of the parameters the textures were rendered with.
+    Textures are loaded as read-only memory-mapped arrays.
+    '''
+    def __init__(self, directory, maxBytes = 2*1024**3, maxAge = 30*24*3600):
+        self.directory = directory
+        self.maxBytes = maxBytes #total size of cache in bytes
+        self.maxAge = maxAge #seconds since last use
+        os.makedirs(self.directory, exist_ok = True)
+
+    def key(self, params):
+        '''
+        Returns hash of (json serializable) render parameters.
+        '''
+        txt = json.dumps(params, sort_keys = True)
+        return hashlib.sha1(txt.encode('utf-8')).hexdigest()[:20]
+
+    def load(self, params):
+        '''
+        Returns dict of memory-mapped textures, or None if entry is not cached.
+        '''
+        path = os.path.join(self.directory, self.key(params))
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            textures = {}
+            for name in meta['textures']:
+                textures[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode = 'r')
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(path) #marks entry as recently used
+        return textures
+
+    def store(self, params, textures):
+        '''
+        Writes textures (dict of arrays) to cache and evicts stale entries.
+        Entry is written to temporary directory first, so readers never see incomplete entries.
+        Entries larger than maxBytes are not cached.
+        '''
+        size = sum(np.asarray(pixels).nbytes for pixels in textures.values())
+        if size > self.maxBytes:
+            print('WARNING: Textures (%.1f MB) exceed texture cache size, not cached' % (size / 1e6))
+            return
+        key = self.key(params)
+        path = os.path.join(self.directory, key)
+        tmpPath = os.path.join(self.directory, '.%s.%d' % (key, os.getpid()))
+        os.makedirs(tmpPath, exist_ok = True)
+        for name, pixels in textures.items():
+            np.save(os.path.join(tmpPath, name + '.npy'), np.ascontiguousarray(pixels))
+        with open(os.path.join(tmpPath, 'meta.json'), 'w') as f:
+            json.dump({'params': params, 'textures': list(textures), 'created': time.time()}, f)
+        try:
+            os.replace(tmpPath, path)
+        except OSError: #entry was stored by another process in the meantime
+            shutil.rmtree(tmpPath, ignore_errors = True)
+        self.evict()
+
+    def entries(self):
+        '''
+        Returns list of (path, size in bytes, time of last use) for all cache entries.
+        '''
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(path) if f.is_file())
+            entries.append((path, size, os.stat(path).st_mtime))
+        return entries
+
+    def evict(self):
+        '''
+        Removes entries that were not used for maxAge seconds,
+        then least recently used entries until cache is smaller than maxBytes.
+        '''
+        now = time.time()
+        entries = []
+        for path, size, lastUsed in self.entries():
+            if now - lastUsed > self.maxAge:
+                shutil.rmtree(path, ignore_errors = True)
+            else:
+                entries.append((lastUsed, size, path))
+        entries.sort(reverse = True)
+        total = 0
+        for lastUsed, size, path in entries:
+            total += size
+            if total > self.maxBytes:
+                shutil.rmtree(path, ignore_errors = True)
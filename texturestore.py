@@ -0,0 +1,154 @@
+import hashlib
+import numpy as np
+
+class TextureStore:
+    '''
+    Compact CPU-side storage of line field textures (white lines on black background).
+    Textures are stored as a grid of single-channel tiles. Identical tiles are stored once and shared
+    between all textures of the store (e.g. the empty center of every periphery texture), tiles with only
+    black and white pixels are packed to one bit per pixel.
+    Textures are expanded to RGB arrays on demand (whole texture for upload, or a region for patches).
+    Textures that are not grey and opaque are kept as they are.
+    '''
+    def __init__(self, tileSize = 64):
+        self.tileSize = tileSize
+        self.tiles = [] #tile id -> packed bits (bool tile) or uint8 array [tileSize,tileSize]
+        self.tileIds = {} #(packed, hash of data) -> tile id
+        self.grids = {} #texture name -> array of tile ids [rows,columns]
+        self.shapes = {} #texture name -> (height, width, channels)
+        self.raw = {} #texture name -> uninterpretable pixel arrays, stored as they are
+
+    def __contains__(self, name):
+        return name in self.shapes
+
+    def names(self):
+        return list(self.shapes)
+
+    def add(self, name, pixels):
+        '''
+        Stores uint8 texture of shape [height,width,channels] (as rendered by render_textures or captured from window).
+        '''
+        pixels = np.asarray(pixels)
+        self.shapes[name] = pixels.shape
+        grey = pixels[..., 0]
+        if (pixels[..., 1:3] != grey[..., None]).any() or (pixels.shape[2] == 4 and (pixels[..., 3] != 255).any()):
+            self.raw[name] = np.array(pixels)
+            return
+        size = self.tileSize
+        height, width = grey.shape
+        rows, cols = -(-height // size), -(-width // size)
+        padded = np.zeros((rows * size, cols * size), dtype = np.uint8)
+        padded[:height, :width] = grey
+        tiles = padded.reshape(rows, size, cols, size).swapaxes(1, 2) #[rows,cols,size,size]
+        grid = np.empty((rows, cols), dtype = np.int32)
+        for (r, c), tile in zip(np.ndindex(rows, cols), tiles.reshape(-1, size, size)):
+            grid[r, c] = self.tile_id(tile)
+        self.grids[name] = grid
+
+    def tile_id(self, tile):
+        binary = ((tile == 0) | (tile == 255)).all()
+        data = np.packbits(tile > 0) if binary else np.array(tile)
+        key = (bool(binary), hashlib.blake2b(data.tobytes(), digest_size = 16).digest())
+        if key not in self.tileIds:
+            self.tileIds[key] = len(self.tiles)
+            self.tiles.append(data)
+        return self.tileIds[key]
+
+    def unpack(self, tileId):
+        data = self.tiles[tileId]
+        if data.ndim == 1:
+            return np.unpackbits(data)[:self.tileSize**2].reshape(self.tileSize, self.tileSize) * np.uint8(255)
+        return data
+
+    def region(self, name, r0, c0, height, width):
+        '''
+        Returns RGB array [height,width,3] of texture from row r0 and column c0 on.
+        Parts outside the texture are black.
+        '''
+        shape = self.shapes[name]
+        out = np.zeros((height, width, 3), dtype = np.uint8)
+        rows = slice(max(r0, 0), min(r0 + height, shape[0]))
+        cols = slice(max(c0, 0), min(c0 + width, shape[1]))
+        if rows.stop <= rows.start or cols.stop <= cols.start:
+            return out
+        if name in self.raw:
+            out[rows.start - r0:rows.stop - r0, cols.start - c0:cols.stop - c0] = self.raw[name][rows, cols, :3]
+            return out
+        size = self.tileSize
+        tr, tc = rows.start // size, cols.start // size
+        ids = self.grids[name][tr:(rows.stop - 1) // size + 1, tc:(cols.stop - 1) // size + 1]
+        unique, inverse = np.unique(ids, return_inverse = True)
+        stack = np.stack([self.unpack(tileId) for tileId in unique])
+        block = stack[inverse.reshape(ids.shape)].swapaxes(1, 2).reshape(ids.shape[0] * size, ids.shape[1] * size)
+        grey = block[rows.start - tr * size:rows.stop - tr * size, cols.start - tc * size:cols.stop - tc * size]
+        out[rows.start - r0:rows.stop - r0, cols.start - c0:cols.stop - c0] = grey[..., None]
+        return out
+
+    def expand(self, name):
+        '''
+        Returns whole texture as RGB array [height,width,3].
+        '''
+        height, width = self.shapes[name][:2]
+        return self.region(name, 0, 0, height, width)
+
+    def tile_bytes(self, tileId):
+        return self.tiles[tileId].nbytes
+
+    def memory(self):
+        '''
+        Returns resident bytes per texture: tiles used only by this texture plus tile grid ('own'),
+        tiles shared with other textures ('shared', counted once for the store) and size as full RGB array ('full').
+        '''
+        users = {}
+        for name, grid in self.grids.items():
+            for tileId in np.unique(grid):
+                users.setdefault(int(tileId), []).append(name)
+        report = {}
+        for name, shape in self.shapes.items():
+            full = shape[0] * shape[1] * 3
+            if name in self.raw:
+                report[name] = {'own': self.raw[name].nbytes, 'shared': 0, 'full': full}
+                continue
+            tileIds = np.unique(self.grids[name])
+            own = sum(self.tile_bytes(i) for i in tileIds if len(users[int(i)]) == 1)
+            shared = sum(self.tile_bytes(i) for i in tileIds if len(users[int(i)]) > 1)
+            report[name] = {'own': own + self.grids[name].nbytes, 'shared': shared, 'full': full}
+        return report
+
+    def total_bytes(self):
+        return (sum(tile.nbytes for tile in self.tiles) + sum(grid.nbytes for grid in self.grids.values())
+            + sum(pixels.nbytes for pixels in self.raw.values()))
+
+class LazyTexture:
+    '''
+    Full-window ImageStim of texture in store that is only uploaded when first drawn (or loaded),
+    and can be released again to free its GPU memory.
+    '''
+    def __init__(self, win, store, name, create):
+        self.win = win
+        self.store = store
+        self.name = name
+        self.create = create #function(win, pixels) -> ImageStim
+        self.stim = None
+        self.uploads = 0
+
+    def load(self):
+        if self.stim is None:
+            self.stim = self.create(self.win, self.store.expand(self.name))
+            self.uploads += 1
+        return self.stim
+
+    def draw(self):
+        self.load().draw()
+
+    def release(self):
+        self.stim = None
+
+    def resident_bytes(self):
+        '''
+        Returns GPU memory of uploaded texture (RGBA), 0 if not uploaded.
+        '''
+        if self.stim is None:
+            return 0
+        height, width = self.store.shapes[self.name][:2]
+        return height * width * 4
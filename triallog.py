@@ -0,0 +1,124 @@
+import csv
+import os
+import queue
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+class TrialLogger:
+    '''
+    Writes trial data to csv log file from a background thread.
+    log() never blocks: rows are put on a bounded queue (dropped with warning if full,
+    they are still part of the session data stored at the end).
+    The thread keeps the file open, writes rows in batches and fsyncs according to policy:
+    'batch' (after every batch), 'never' (leave it to the OS) or a number of seconds between fsyncs.
+    '''
+    def __init__(self, filename, maxQueue = 1000, batchSize = 50, fsync = 'batch'):
+        self.filename = filename
+        self.queue = queue.Queue(maxQueue)
+        self.batchSize = batchSize
+        self.fsync = fsync
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0 #rows that could not be written to file
+        self.error = None #error of log file, raised by close()
+        self.maxQueueDepth = 0
+        self.latencies = [] #time from log() until row was written (s)
+        self.thread = threading.Thread(target = self.run, name = 'TrialLogger', daemon = True)
+        self.thread.start()
+
+    def log(self, row):
+        try:
+            self.queue.put_nowait((time.perf_counter(), dict(row)))
+        except queue.Full:
+            self.dropped += 1
+            print('WARNING: Trial log queue full, could not log trial data:', row)
+        self.maxQueueDepth = max(self.maxQueueDepth, self.queue.qsize())
+
+    def run(self):
+        newFile = not os.path.exists(self.filename) or os.path.getsize(self.filename) == 0
+        lastSync = time.perf_counter()
+        writer = None
+        try:
+            f = open(self.filename, 'a', newline = '')
+        except OSError as e: #queue is still drained, rows are counted as failed
+            self.error = e
+            f = None
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            while len(batch) < self.batchSize:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            rows = [item for item in batch if item is not None]
+            if not rows:
+                continue
+            if f is None:
+                self.failed += len(rows)
+                continue
+            try:
+                if writer is None:
+                    writer = csv.DictWriter(f, fieldnames = list(rows[0][1]), extrasaction = 'ignore')
+                    if newFile:
+                        writer.writeheader()
+                writer.writerows(row for _, row in rows)
+                f.flush()
+                if self.fsync == 'batch' or (self.fsync != 'never' and time.perf_counter() - lastSync > self.fsync):
+                    os.fsync(f.fileno())
+                    lastSync = time.perf_counter()
+            except OSError as e:
+                self.error = e
+                self.failed += len(rows)
+                f.close()
+                f = None
+                continue
+            now = time.perf_counter()
+            self.latencies.extend(now - queued for queued, _ in rows)
+            self.written += len(rows)
+        if f is not None:
+            f.close()
+
+    def close(self, timeout = 5):
+        '''
+        Writes remaining rows and stops thread.
+        Raises error of log file, if it could not be written (rows are still part of the session data).
+        '''
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+        if self.error is not None:
+            raise self.error
+
+    def stats(self):
+        latencies = np.array(self.latencies)
+        return {
+            'queueDepth': self.queue.qsize(),
+            'maxQueueDepth': self.maxQueueDepth,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'error': repr(self.error) if self.error is not None else None,
+            'meanWriteLatency': latencies.mean() if len(latencies) else np.nan,
+            'maxWriteLatency': latencies.max() if len(latencies) else np.nan}
+
+def recover(logfilename):
+    '''
+    Returns session data (as stored by Session.store_data) from trial log, e.g. after a crash.
+    '''
+    df = pd.read_csv(logfilename)
+    if 'n_saccades' in df:
+        df['n_saccades'] = [np.array(str(value).strip('[]').replace(',', ' ').split(), dtype = int)
+            for value in df['n_saccades']]
+    return df
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: python triallog.py LOGFILE DATAFILE')
+        sys.exit(1)
+    recover(sys.argv[1]).to_csv(sys.argv[2])
+    print('Recovered data stored under:', sys.argv[2])